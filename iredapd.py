@@ -3,6 +3,7 @@
 import os
 import sys
 import pwd
+import signal
 import asyncore
 
 # Always remove 'settings.pyc'.
@@ -17,7 +18,8 @@ del _pyc
 
 # Import config file (settings.py) and modules
 import settings
-from libs import __version__, daemon, utils
+from libs import __version__, daemon, utils, cleanup
+from libs import greylisting as lib_gl
 from libs.channel import DaemonSocket
 from libs.logger import logger
 
@@ -29,6 +31,10 @@ if settings.backend not in ['ldap', 'mysql', 'pgsql']:
     sys.exit("Invalid backend, it must be ldap, mysql or pgsql.")
 
 
+def _handle_sigterm(signum, frame):
+    raise SystemExit(0)
+
+
 def main():
     # Set umask.
     os.umask(0o077)
@@ -85,6 +91,18 @@ def main():
     os.setgid(gid)
     os.setuid(uid)
 
+    # Exit normally on SIGTERM (e.g. `systemctl stop iredapd`), so that
+    # functions registered with `atexit` are called (e.g. flushing buffered
+    # greylisting updates).
+    signal.signal(signal.SIGTERM, _handle_sigterm)
+
+    # Start background threads after daemonized.
+    if settings.CLEANUP_IN_DAEMON:
+        cleanup.start(engine_iredapd=db_conns['engine_iredapd'])
+
+    if settings.GREYLISTING_SPF_REFRESH_IN_DAEMON:
+        lib_gl.start_spf_refresh(engine_iredapd=db_conns['engine_iredapd'])
+
     # Starting loop.
     try:
         if sys.version_info >= (3, 4):
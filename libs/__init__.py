@@ -24,6 +24,10 @@ SMTP_ACTIONS = {
     'reject_max_rcpts_exceeded': 'REJECT Too many recipients in single message',
     # Sender Score
     'reject_low_sender_score': 'REJECT Server IP address has bad reputation. FYI: https://www.senderscore.org/lookup.php?lookup=',
+    # Local IP reputation list
+    'reject_ip_reputation': 'REJECT Server IP address has bad reputation',
+    # DNSBL
+    'reject_dnsbl': 'REJECT Server IP address is listed in DNS blacklists: ',
     'greylisting': '451 4.7.1',
 }
 
@@ -57,6 +61,7 @@ PLUGIN_PRIORITIES = {
     'reject_null_sender': 100,
     'reject_to_hostname': 100,
     'wblist_rdns': 99,
+    'ip_reputation': 98,
     'reject_sender_login_mismatch': 90,
     'greylisting': 80,
     'ldap_force_change_password_in_days': 70,
@@ -68,6 +73,7 @@ PLUGIN_PRIORITIES = {
     'amavisd_wblist': 40,
     'whitelist_outbound_recipient': 30,
     'senderscore': 10,
+    'dnsbl': 10,
 }
 
 # Account proiroties.
@@ -0,0 +1,262 @@
+"""In-memory caches."""
+
+import abc
+import time
+import threading
+from collections import OrderedDict
+
+from libs import utils
+from libs.logger import logger
+
+
+class SQLTableCache(abc.ABC):
+    """Keep (part of) a SQL table in memory.
+
+    Changes are detected by comparing signature of the table every
+    `check_interval` seconds. Signature is COUNT(id), MAX(id), and checksum
+    of columns `sql_checksum_columns` of all rows if defined:
+
+        - if only new rows were added (ids larger than the old MAX(id)),
+          only new rows are loaded.
+        - otherwise (rows were removed or updated) all rows are reloaded.
+
+    Updated rows (UPDATE) can be detected only with checksum. Without
+    checksum, all rows are reloaded every `max_age` seconds if it's set.
+
+    Sub-class must define `sql_table`, `sql_columns` (first column must be
+    `id`), and methods `new_data()` and `add_row()`.
+
+    For SQL table without `id` column, sub-class should override
+    `_get_signature()` (first element must be number of rows) and set
+    `incremental = False`, all rows are reloaded after signature changed.
+    """
+    sql_table = None
+    sql_columns = ['id']
+
+    # Optional sql WHERE clause.
+    sql_where = None
+
+    # Columns used to calculate checksum of table, so that updated rows are
+    # detected too.
+    sql_checksum_columns = None
+
+    # Load new rows only if possible.
+    incremental = True
+
+    def __init__(self, check_interval=60, max_age=None):
+        self.check_interval = check_interval
+        self.max_age = max_age
+
+        self.data = None
+
+        # (count, max_id[, checksum])
+        self.signature = None
+        self.last_check_time = 0
+        self.last_load_time = 0
+
+    @abc.abstractmethod
+    def new_data(self):
+        """Return an empty data structure."""
+
+    @abc.abstractmethod
+    def add_row(self, data, row):
+        """Add one SQL row (tuple of `sql_columns`) to data structure."""
+
+    def _get_sql_where(self, sql_where=None):
+        _wheres = [i for i in [self.sql_where, sql_where] if i]
+        if _wheres:
+            return " WHERE " + " AND ".join(['(%s)' % i for i in _wheres])
+
+        return ''
+
+    def _query(self, engine, sql_where=None):
+        sql = "SELECT {} FROM {}".format(', '.join(self.sql_columns), self.sql_table)
+        sql += self._get_sql_where(sql_where)
+
+        qr = utils.execute_sql(engine, sql)
+        return qr.fetchall()
+
+    def _get_signature(self, engine, sql_where=None):
+        _columns = ['COUNT(id)', 'MAX(id)']
+        if self.sql_checksum_columns:
+            _columns.append(utils.get_sql_checksum_expr(self.sql_checksum_columns))
+
+        sql = "SELECT {} FROM {}".format(', '.join(_columns), self.sql_table)
+        sql += self._get_sql_where(sql_where)
+
+        qr = utils.execute_sql(engine, sql)
+        return tuple(int(i or 0) for i in qr.fetchone())
+
+    def load(self, engine, signature=None):
+        """Load all rows."""
+        if not signature:
+            signature = self._get_signature(engine)
+
+        data = self.new_data()
+        for row in self._query(engine):
+            self.add_row(data, row)
+
+        self.data = data
+        self.signature = signature
+        self.last_load_time = time.time()
+
+        logger.debug("[cache] Loaded {} rows from SQL table {}.".format(signature[0], self.sql_table))
+
+    def refresh(self, engine):
+        now = time.time()
+        self.last_check_time = now
+
+        if self.data is None or (self.max_age and (now - self.last_load_time) >= self.max_age):
+            self.load(engine)
+            return None
+
+        signature = self._get_signature(engine)
+        if signature == self.signature:
+            return None
+
+        (old_count, old_max_id) = self.signature[:2]
+        (new_count, new_max_id) = signature[:2]
+
+        if self.incremental and new_max_id > old_max_id and new_count > old_count:
+            if self.sql_checksum_columns:
+                # Make sure old rows were not updated or removed.
+                if self._get_signature(engine, sql_where='id <= %d' % old_max_id) != self.signature:
+                    self.load(engine, signature=signature)
+                    return None
+
+            rows = self._query(engine, sql_where='id > %d' % old_max_id)
+
+            if len(rows) == new_count - old_count:
+                # Only new rows were added.
+                for row in rows:
+                    self.add_row(self.data, row)
+
+                self.signature = signature
+                logger.debug("[cache] Loaded {} new rows from SQL table {}.".format(len(rows), self.sql_table))
+                return None
+
+        self.load(engine, signature=signature)
+
+    def get(self, engine):
+        """Return cached data. Returns None if data was never loaded (e.g.
+        SQL error), caller should query SQL directly in this case."""
+        if self.data is None or (time.time() - self.last_check_time) >= self.check_interval:
+            try:
+                self.refresh(engine)
+            except Exception as e:
+                # Keep old data.
+                self.last_check_time = time.time()
+                logger.error("[cache] Error while loading SQL table {}: {}".format(self.sql_table, repr(e)))
+
+        return self.data
+
+
+class LRUCache:
+    """Thread-safe cache with per-item expire time and bounded size, least
+    recently used items are evicted first."""
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+
+        # {<key>: (<expire_time>, <value>)}
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                if item[0] > time.time():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return item[1]
+
+                del self._data[key]
+
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl):
+        if self.max_size <= 0 or ttl <= 0:
+            return None
+
+        with self._lock:
+            self._data[key] = (time.time() + ttl, value)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        if not total:
+            return 0.0
+
+        return self.hits * 100.0 / total
+
+
+class SingleFlight:
+    """Coalesce identical concurrent lookups.
+
+    The first caller of `do()` with a key runs the function, other callers
+    with same key wait and share its result (or exception), so that only
+    one query is sent to DNS server.
+
+    Policy requests are processed one by one in the main thread, so it's
+    useful only for lookups called from other threads.
+    """
+
+    class _Call:
+        def __init__(self):
+            self.event = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+        # {<key>: <_Call>}
+        self._calls = {}
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._Call()
+                self._calls[key] = call
+                is_leader = True
+            else:
+                is_leader = False
+
+        if not is_leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error.with_traceback(None)
+
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+            call.event.set()
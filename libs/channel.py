@@ -7,7 +7,7 @@ from web import sqlquote
 
 import settings # type: ignore
 from libs import SMTP_ACTIONS, TCP_REPLIES, SMTP_SESSION_ATTRIBUTES
-from libs import utils, srslib
+from libs import utils, srslib, cleanup
 from libs.logger import logger
 
 if settings.backend == 'ldap':
@@ -165,6 +165,8 @@ class Policy(asynchat.async_chat):
             logger.debug("Session ended.")
 
             _end_time = time.time()
+            cleanup.report_request_time(_end_time - _start_time)
+
             utils.log_policy_request(smtp_session_data=self.smtp_session_data,
                                      action=action,
                                      start_time=_start_time,
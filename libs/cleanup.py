@@ -0,0 +1,172 @@
+# Clean up expired records in iredapd database with a background thread
+# inside iRedAPD daemon, it's an alternative to the cron job of
+# `tools/cleanup_db.py`.
+#
+# Expired records are removed in small batches, batch size is adjusted
+# based on time used by each batch, and cleanup is paused while iRedAPD is
+# busy (average time used to process a policy request is too long).
+
+import time
+import threading
+
+from web import sqlquote
+
+from libs import utils
+from libs.logger import logger
+import settings  # type: ignore
+
+
+# Exponentially weighted moving average of time (in seconds) used to
+# process policy requests, updated by `report_request_time()`.
+_request_time_avg = 0.0
+_request_time_last = 0
+
+# Weight of the latest request time.
+_REQUEST_TIME_ALPHA = 0.1
+
+# Consider iRedAPD idle (not busy) if no policy request in given seconds.
+_REQUEST_IDLE_SECONDS = 10
+
+_thread = None
+
+# Functions called with a list of values of unique index column of removed
+# records, used by plugins to invalidate their in-memory caches.
+# {<sql_table>: [<function>, ...]}
+_invalidators = {}
+
+
+def register_invalidator(sql_table, func):
+    """Register a function called after expired records were removed from
+    given sql table."""
+    _invalidators.setdefault(sql_table, []).append(func)
+
+
+def _invalidate(sql_table, values):
+    for func in _invalidators.get(sql_table, []):
+        try:
+            func(values)
+        except Exception as e:
+            logger.error("[cleanup] Error while invalidating cached records of {}: {}".format(sql_table, repr(e)))
+
+
+def report_request_time(seconds):
+    """Track time used to process a policy request."""
+    global _request_time_avg, _request_time_last
+
+    _request_time_avg += _REQUEST_TIME_ALPHA * (seconds - _request_time_avg)
+    _request_time_last = time.time()
+
+
+def is_busy():
+    if time.time() - _request_time_last > _REQUEST_IDLE_SECONDS:
+        return False
+
+    return _request_time_avg > settings.CLEANUP_PAUSE_REQUEST_TIME
+
+
+def get_cleanup_tables():
+    """Return a list of (sql_table, unique_index_column, sql_where)."""
+    now = int(time.time())
+
+    return [
+        ('throttle_tracking', 'id', 'expire_at < %d' % now),
+        ('greylisting_tracking', 'id', 'record_expired < %d' % now),
+        ('greylisting_passed_clients', 'client_address', 'expire_at < %d' % now),
+        ('senderscore_cache',
+         'client_address',
+         'time < %d' % (now - settings.SENDERSCORE_CACHE_DAYS * 86400)),
+        ('smtp_sessions',
+         'id',
+         'time_num < %d' % (now - settings.LOG_SMTP_SESSIONS_EXPIRE_DAYS * 86400)),
+    ]
+
+
+class Cleaner:
+    def __init__(self, engine_iredapd):
+        self.engine_iredapd = engine_iredapd
+        self.batch_size = settings.CLEANUP_BATCH_SIZE_MIN
+
+    def adjust_batch_size(self, used_time):
+        if used_time > settings.CLEANUP_BATCH_TARGET_TIME:
+            self.batch_size = max(self.batch_size // 2,
+                                  settings.CLEANUP_BATCH_SIZE_MIN)
+        elif used_time < settings.CLEANUP_BATCH_TARGET_TIME / 2:
+            self.batch_size = min(self.batch_size * 2,
+                                  settings.CLEANUP_BATCH_SIZE_MAX)
+
+    def cleanup_batch(self, sql_table, unique_index_column, sql_where):
+        """Remove one batch of expired records, return number of removed
+        records."""
+        _start = time.time()
+
+        sql = """SELECT %s FROM %s WHERE %s LIMIT %d""" % (unique_index_column,
+                                                            sql_table,
+                                                            sql_where,
+                                                            self.batch_size)
+        qr = utils.execute_sql(self.engine_iredapd, sql)
+        values = [r[0] for r in qr.fetchall()]
+
+        if values:
+            sql = """DELETE FROM %s WHERE %s IN %s""" % (sql_table,
+                                                         unique_index_column,
+                                                         sqlquote(values))
+            utils.execute_sql(self.engine_iredapd, sql)
+
+            _invalidate(sql_table, values)
+
+        self.adjust_batch_size(time.time() - _start)
+        return len(values)
+
+    def cleanup_table(self, sql_table, unique_index_column, sql_where):
+        total = 0
+
+        while True:
+            # Don't compete with policy requests.
+            while is_busy():
+                time.sleep(settings.CLEANUP_BATCH_SLEEP)
+
+            _batch_size = self.batch_size
+            num = self.cleanup_batch(sql_table=sql_table,
+                                     unique_index_column=unique_index_column,
+                                     sql_where=sql_where)
+            total += num
+
+            if num < _batch_size:
+                break
+
+            time.sleep(settings.CLEANUP_BATCH_SLEEP)
+
+        if total:
+            logger.info("[cleanup] {}: {} expired records removed.".format(sql_table, total))
+
+    def run(self):
+        while True:
+            for (sql_table, unique_index_column, sql_where) in get_cleanup_tables():
+                try:
+                    self.cleanup_table(sql_table=sql_table,
+                                       unique_index_column=unique_index_column,
+                                       sql_where=sql_where)
+                except Exception as e:
+                    logger.error("[cleanup] Error while removing expired records from {}: {}".format(sql_table, repr(e)))
+
+                time.sleep(settings.CLEANUP_BATCH_SLEEP)
+
+            time.sleep(settings.CLEANUP_INTERVAL)
+
+
+def start(engine_iredapd):
+    """Start the cleanup thread. Must be called after iRedAPD forked."""
+    global _thread
+
+    if not engine_iredapd:
+        logger.error("[cleanup] No connection to iredapd database, background cleanup is disabled.")
+        return None
+
+    if _thread and _thread.is_alive():
+        return None
+
+    cleaner = Cleaner(engine_iredapd=engine_iredapd)
+    _thread = threading.Thread(target=cleaner.run, name='cleanup', daemon=True)
+    _thread.start()
+
+    logger.info("Started background cleanup of expired records in iredapd database.")
@@ -61,6 +61,20 @@ SQL_DB_DRIVER = ''
 # Timeout in seconds. Must be a float number.
 DNS_QUERY_TIMEOUT = 3.0
 
+# Cache DNS query results in memory, answers are cached until their TTL
+# expires.
+# - DNS_CACHE_SIZE: max number of cached answers (and max number of cached
+#   negative answers). Set to 0 to disable cache.
+# - DNS_CACHE_MAX_TTL: max seconds to cache an answer, even if its TTL is
+#   longer.
+# - DNS_NEGATIVE_CACHE_TTL: seconds to cache NXDOMAIN and NoAnswer.
+# - DNS_CACHE_STATS_INTERVAL: log cache statistics (including hit ratio) in
+#   given seconds.
+DNS_CACHE_SIZE = 10000
+DNS_CACHE_MAX_TTL = 3600
+DNS_NEGATIVE_CACHE_TTL = 300
+DNS_CACHE_STATS_INTERVAL = 3600
+
 # Log smtp actions returned by plugins in SQL database (table `smtp_actions`).
 LOG_SMTP_SESSIONS = True
 LOG_SMTP_SESSIONS_EXPIRE_DAYS = 7
@@ -84,6 +98,18 @@ TRACKING_EXPIRE_SECONDS = 10
 # Here we increase it to 20 for more user friendly in real world.
 SPF_MAX_DNS_QUERIES = 20
 
+# Number of threads used to run DNS queries of same level of SPF record
+# (e.g. all `include:` domains) concurrently. Set to 1 to query one by one.
+SPF_DNS_WORKERS = 10
+
+# Cache IP addresses/networks listed in SPF DNS record of sender domains,
+# until the shortest TTL of DNS records used expires.
+# - SPF_CACHE_SIZE: max number of cached sender domains.
+# - SPF_DECISION_CACHE_SIZE: max number of cached results of
+#   (sender domain, IP address) checks.
+SPF_CACHE_SIZE = 5000
+SPF_DECISION_CACHE_SIZE = 20000
+
 # ---------------
 # Required by:
 #   - plugins/amavisd_wblist.py
@@ -106,6 +132,27 @@ WBLIST_BYPASS_OUTGOING_EMAIL = False
 # Note: this setting applies to all plugins which do white/blacklisting.
 WBLIST_DISCARD_INSTEAD_OF_REJECT = False
 
+# Keep Amavisd SQL tables `users`, `mailaddr`, `wblist` and `outbound_wblist`
+# in memory, white/blacklists are checked without querying SQL database.
+# Tables are checked for new, removed or updated records every
+# `AMAVISD_WBLIST_CACHE_CHECK_INTERVAL` seconds.
+# Recommended if you have many white/blacklists.
+#
+# Note: CIDR networks stored in `mailaddr` table are always kept in memory,
+#       new, removed or updated networks take effect after up to
+#       `AMAVISD_WBLIST_CACHE_CHECK_INTERVAL` seconds.
+AMAVISD_WBLIST_IN_MEMORY = False
+AMAVISD_WBLIST_CACHE_CHECK_INTERVAL = 60
+
+# ---------------
+# Required by: plugins/wblist_rdns.py
+#
+# Load SQL table `wblist_rdns` into memory instead of querying SQL database
+# for each smtp session. Table is checked for new, removed or updated records
+# every `WBLIST_RDNS_CACHE_CHECK_INTERVAL` seconds.
+WBLIST_RDNS_CACHE = True
+WBLIST_RDNS_CACHE_CHECK_INTERVAL = 60
+
 # ---------------
 # Required by:
 #   - plugins/sql_force_change_password_in_days.py
@@ -162,6 +209,22 @@ ALLOWED_LOGIN_MISMATCH_STRICTLY = True
 # ('From: <email_of_mail_list>' in mail header). Default is False.
 ALLOWED_LOGIN_MISMATCH_LIST_MEMBER = False
 
+# --------------
+# Required by:
+#   - plugins/sql_alias_access_policy.py
+#   - plugins/ldap_maillist_access_policy.py
+#
+# Cache members and moderators of mail alias accounts in memory for given
+# seconds, recommended if you have mail alias accounts with many members.
+# Changes of members and moderators take effect after cache expired.
+# Set to 0 to disable cache, then only the sender is looked up with SQL or
+# LDAP queries.
+MAILLIST_MEMBERS_CACHE_TTL = 0
+
+# Max number of cached mail alias accounts (members and moderators are
+# cached separately).
+MAILLIST_MEMBERS_CACHE_SIZE = 1000
+
 # --------------
 # Required by: plugins/greylisting.py
 #
@@ -188,6 +251,68 @@ GREYLISTING_UNAUTH_TRIPLET_EXPIRE = 1
 # Bypass if sender server IP address is listed in sender domain SPF DNS record.
 GREYLISTING_BYPASS_SPF = True
 
+# Client addresses which passed greylisting are stored in SQL table
+# `greylisting_passed_clients` and cached in memory. Their expire time is
+# extended for each new message, but SQL record is updated at most once in
+# given seconds.
+GREYLISTING_PASSED_CLIENT_UPDATE_INTERVAL = 3600
+
+# Max number of passed client addresses cached in memory, least recently
+# seen clients are removed first (and looked up in SQL table again).
+GREYLISTING_PASSED_CLIENTS_CACHE_SIZE = 100000
+
+# Track (and whitelist passed) clients by network instead of exact IP
+# address, so that large mail providers which retry from another IP address
+# of the same network are not greylisted again, and IPv6 senders rotating
+# addresses don't create a new tracking record for each address.
+# Network is stored as client address in SQL tables, e.g. '192.0.2.0/24'.
+GREYLISTING_AGGREGATE_CLIENT_NETWORK = False
+GREYLISTING_AGGREGATE_IPV4_PREFIX = 24
+GREYLISTING_AGGREGATE_IPV6_PREFIX = 64
+
+# Look up greylisting tracking records by column `triplet_hash` (16-byte
+# BLAKE2 digest of sender, recipient and client address) instead of 3
+# VARCHAR columns. Before enabling it, please run
+# `tools/greylisting_tracking_hash.py` to fill up the hash of existing
+# records, then optionally run it again with `--drop-triplet-index` to
+# drop the large unique index on (sender, recipient, client_address).
+GREYLISTING_TRACKING_HASHED_KEY = False
+
+# Greylisting whitelists generated from SPF/MX DNS records of domains listed
+# in SQL table `greylisting_whitelist_domains`.
+#
+# - GREYLISTING_SPF_REFRESH_WORKERS: number of threads used to query DNS
+#   records of domains concurrently.
+# - GREYLISTING_SPF_REFRESH_IN_DAEMON: refresh whitelists of each domain
+#   inside iRedAPD daemon when TTL of its DNS records expires. It's an
+#   alternative to the cron job of `tools/spf_to_greylist_whitelists.py`.
+# - GREYLISTING_SPF_REFRESH_MIN_INTERVAL: refresh a domain at most once in
+#   given seconds, even if TTL of its DNS records is shorter. Also used as
+#   the interval to check new or removed domains.
+GREYLISTING_SPF_REFRESH_WORKERS = 10
+GREYLISTING_SPF_REFRESH_IN_DAEMON = False
+GREYLISTING_SPF_REFRESH_MIN_INTERVAL = 3600
+
+# Updates which are not used to make greylisting decision (`blocked_count`
+# of tracking records, expire time of passed clients) are buffered in
+# memory and written to SQL database in batches, once there're given number
+# of pending updates, or last write was given seconds ago.
+# Note: buffered updates are lost if iRedAPD is killed.
+GREYLISTING_FLUSH_SIZE = 500
+GREYLISTING_FLUSH_INTERVAL = 10
+
+# Load greylisting whitelists (SQL tables `greylisting_whitelists` and
+# `greylisting_whitelist_domain_spf`) into memory, instead of querying SQL
+# database for each smtp session.
+GREYLISTING_CACHE_WHITELISTS = True
+
+# Load greylisting settings (SQL table `greylisting`) into memory.
+GREYLISTING_CACHE_SETTINGS = True
+
+# Check changes of cached SQL tables every given seconds. New rows are loaded
+# incrementally, all rows are reloaded if some rows were removed or updated.
+GREYLISTING_CACHE_CHECK_INTERVAL = 60
+
 # --------------
 # Required by: plugins/whitelist_outbound_recipient.py
 #
@@ -245,6 +370,20 @@ THROTTLE_BYPASS_LOCAL_RECIPIENT = True
 # under same domain.
 THROTTLE_BYPASS_SAME_DOMAIN = True
 
+# Check throttle settings at RCPT state too, so that an over-quota sender is
+# rejected before transferring the message body:
+#
+#   - `msg_size` is checked against the message size declared by client
+#     (`MAIL FROM: <...> SIZE=xxx`).
+#   - `max_msgs` and `max_quota` are checked against current tracking data.
+#   - `max_rcpts` is checked against the recipients accepted so far in
+#     current mail transaction.
+#
+# Throttle tracking data is still updated at END-OF-MESSAGE state only.
+# Note: iRedAPD must be enabled in Postfix parameter
+#       `smtpd_recipient_restrictions` too.
+THROTTLE_CHECK_AT_RCPT = False
+
 # ----------------
 # Required by: plugins/senderscore.py
 #
@@ -254,6 +393,50 @@ SENDERSCORE_REJECT_SCORE = 30
 # Cache the score returned by DNS query for how many days.
 SENDERSCORE_CACHE_DAYS = 2
 
+# Max number of scores cached in memory, in front of SQL table
+# `senderscore_cache`.
+SENDERSCORE_MEMORY_CACHE_SIZE = 10000
+
+# Query the score again in background if cached score expires in given
+# seconds, so that active sender servers always hit the cache.
+SENDERSCORE_REFRESH_AHEAD = 3600
+
+# Timeout in seconds of DNS query. It's better to skip the check than
+# delaying the SMTP session.
+SENDERSCORE_DNS_TIMEOUT = 1.0
+
+# ------------------------
+# Required by: plugins/dnsbl.py
+#
+# DNSBL/DNSWL zones and their weights. Score of client IP address is the sum
+# of weights of zones which list it, DNSWL zones should have negative
+# weights. Zone name may end with `=<answer>` to count only given answer,
+# e.g. 'b.barracudacentral.org=127.0.0.2'.
+DNSBL_ZONES = {}
+
+# Reject the email if score equals to or is larger than this score.
+DNSBL_REJECT_SCORE = 10
+
+# All zones are queried concurrently, zones which don't answer in given
+# seconds are ignored.
+DNSBL_TIME_BUDGET = 2.0
+
+# Number of threads used to query zones.
+DNSBL_WORKERS = 10
+
+# Max number of client addresses whose results are cached in memory.
+# Results are cached until TTL of DNS answers expires.
+DNSBL_CACHE_SIZE = 10000
+
+# ------------------------
+# Required by: plugins/ip_reputation.py
+#
+# Binary files compiled from IP feeds with `tools/ip_reputation_compile.py`.
+IP_REPUTATION_FILES = []
+
+# Check whether files were updated every given seconds, reload if updated.
+IP_REPUTATION_CHECK_INTERVAL = 60
+
 # ------------------------
 # mlmmjadmin integration.
 #
@@ -285,3 +468,47 @@ NOTIFICATION_SENDER_NAME = 'No Reply'
 #
 # Query and return how many rows each time for delete.
 CLEANUP_QUERY_SIZE_LIMIT = 1000
+
+# Drop partitions which store only expired rows before deleting expired rows
+# one by one. It's much faster and doesn't cause replication lag, but
+# requires the SQL table to be partitioned by RANGE (time buckets) manually
+# on the column used to expire rows:
+#
+#   - throttle_tracking: expire_at
+#   - greylisting_tracking: record_expired
+#   - smtp_sessions: time_num
+#
+# Notes:
+#
+#   - Both MySQL/MariaDB and PostgreSQL require the partition column to be
+#     part of all unique indexes (including primary key). It's a natural fit
+#     for `smtp_sessions`, but tracking tables must then drop the unique
+#     index on (tid, account) or (sender, recipient, client_address).
+#   - You're responsible for creating partitions for upcoming time buckets.
+#   - Partition with `MAXVALUE` (MySQL) is never dropped.
+#   - If table is partitioned on another column, no partition is dropped and
+#     expired rows are deleted one by one.
+CLEANUP_DROP_EXPIRED_PARTITIONS = False
+
+# Remove expired records in iredapd database with a background thread inside
+# iRedAPD daemon, instead of (or in addition to) the daily cron job of
+# `tools/cleanup_db.py`.
+CLEANUP_IN_DAEMON = False
+
+# Seconds to wait between two rounds of cleanup.
+CLEANUP_INTERVAL = 300
+
+# Expired records are removed in small batches, batch size (number of
+# records) is adjusted between CLEANUP_BATCH_SIZE_MIN and
+# CLEANUP_BATCH_SIZE_MAX, so that each batch takes about
+# CLEANUP_BATCH_TARGET_TIME seconds.
+CLEANUP_BATCH_SIZE_MIN = 100
+CLEANUP_BATCH_SIZE_MAX = 5000
+CLEANUP_BATCH_TARGET_TIME = 0.2
+
+# Seconds to sleep between two batches.
+CLEANUP_BATCH_SLEEP = 0.5
+
+# Pause cleanup if average time used to process a policy request is longer
+# than given seconds.
+CLEANUP_PAUSE_REQUEST_TIME = 0.5
@@ -0,0 +1,98 @@
+"""In-process cache of DNS query results.
+
+Answers are cached until their TTL expires (capped by `DNS_CACHE_MAX_TTL`).
+NXDOMAIN and NoAnswer are cached separately for `DNS_NEGATIVE_CACHE_TTL`
+seconds, and re-raised on cache hit, so callers handle cached and fresh
+results the same way. Other errors (e.g. timeout) are not cached.
+"""
+
+import time
+
+from dns import resolver
+
+from libs.cache import LRUCache, SingleFlight
+from libs.logger import logger
+from libs.utils import get_dns_resolver
+import settings  # type: ignore
+
+_answers = LRUCache(max_size=settings.DNS_CACHE_SIZE)
+_negatives = LRUCache(max_size=settings.DNS_CACHE_SIZE)
+
+_single_flight = SingleFlight()
+
+_last_stats_time = time.time()
+
+
+def get_stats():
+    return {
+        'answers': len(_answers),
+        'negatives': len(_negatives),
+        'hits': _answers.hits,
+        'negative_hits': _negatives.hits,
+        'queries': _negatives.misses,
+    }
+
+
+def _log_stats():
+    global _last_stats_time
+
+    now = time.time()
+    if now - _last_stats_time < settings.DNS_CACHE_STATS_INTERVAL:
+        return None
+
+    _last_stats_time = now
+
+    _stats = get_stats()
+    _total = _stats['hits'] + _stats['negative_hits'] + _stats['queries']
+    if _total:
+        logger.info("[DNS] Cache: {} answers, {} negative answers, "
+                    "hit ratio {:.1f}% ({} positive hits, {} negative hits, "
+                    "{} queries).".format(_stats['answers'],
+                                          _stats['negatives'],
+                                          (_stats['hits'] + _stats['negative_hits']) * 100.0 / _total,
+                                          _stats['hits'],
+                                          _stats['negative_hits'],
+                                          _stats['queries']))
+
+
+def query(qname, rdtype, lifetime=None):
+    """Query DNS record with cache, returns `dns.resolver.Answer`.
+
+    @lifetime -- seconds to wait for an answer, defaults to
+                 `DNS_QUERY_TIMEOUT`.
+
+    Raises same exceptions as `dns.resolver.Resolver.resolve()`.
+    """
+    _log_stats()
+
+    key = (qname.lower(), rdtype)
+
+    answer = _answers.get(key)
+    if answer is not None:
+        return answer
+
+    e = _negatives.get(key)
+    if e is not None:
+        raise e.with_traceback(None)
+
+    # Identical concurrent queries are sent only once. Queries are sent
+    # concurrently by the thread pool used to resolve SPF records, and by the
+    # thread used to refresh senderscore.
+    return _single_flight.do(key, _query, key, qname, rdtype, lifetime)
+
+
+def _query(key, qname, rdtype, lifetime=None):
+    resv = get_dns_resolver()
+    try:
+        if hasattr(resv, 'resolve'):
+            answer = resv.resolve(qname, rdtype, lifetime=lifetime)
+        else:
+            answer = resv.query(qname, rdtype, lifetime=lifetime)
+    except (resolver.NXDOMAIN, resolver.NoAnswer) as e:
+        _negatives.set(key, e, ttl=settings.DNS_NEGATIVE_CACHE_TTL)
+        raise
+
+    _ttl = min(answer.expiration - time.time(), settings.DNS_CACHE_MAX_TTL)
+    _answers.set(key, answer, ttl=_ttl)
+
+    return answer
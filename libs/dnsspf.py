@@ -1,135 +1,57 @@
+import time
 import ipaddress
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dns import resolver
 
 from libs.logger import logger
-from libs import utils
-from libs.utils import get_dns_resolver
+from libs import utils, dnscache
+from libs.cache import LRUCache
+from libs.ipindex import IPNetworkIndex
 import settings
 
 
 max_queries = settings.SPF_MAX_DNS_QUERIES
 
+# Compiled IP networks of sender domains: {<domain>: (<expire_time>, <IPNetworkIndex>)}
+_compiled_spf = LRUCache(max_size=settings.SPF_CACHE_SIZE)
 
-def query_a(domains, queried_domains=None, returned_ips=None, num_queries=0):
-    """
-    Return a list of IP addresses/networks defined in A record of mail domain
-    names.
-
-    @domains - a list/tuple/set of mail domain names
-    @queried_domains - a set of mail domain names which already queried spf
-    @returned_ips - a set of IP addr/networks of queried mail domain names
-    """
-    ips = set()
-
-    queried_domains = queried_domains or set()
-    returned_ips = returned_ips or set()
-
-    domains = [d for d in domains if d not in queried_domains]
-    for domain in domains:
-        if num_queries >= max_queries:
-            break
-
-        try:
-            num_queries += 1
-            qr = get_dns_resolver().query(domain, 'A')
-            if qr:
-                for r in qr:
-                    _ip = str(r)
-                    logger.debug("[DNS][A] {} -> {}".format(domain, _ip))
-
-                    ips.add(_ip)
-                    returned_ips.add(_ip)
-
-            queried_domains.add('a:' + domain)
-        except (resolver.NoAnswer):
-            logger.debug("[DNS][A] {} -> NoAnswer".format(domain))
-        except resolver.NXDOMAIN:
-            logger.debug("[DNS][A] {} -> NXDOMAIN".format(domain))
-        except (resolver.Timeout):
-            logger.info("[DNS][A] {} -> Timeout".format(domain))
-        except Exception as e:
-            logger.debug("[DNS][A] {} -> Error: {}".format(domain, repr(e)))
-
-    return {
-        'ips': ips,
-        'queried_domains': queried_domains,
-        'returned_ips': returned_ips,
-        'num_queries': num_queries,
-    }
+# Results of `is_allowed_server_in_spf()`: {(<domain>, <ip>): <bool>}
+_spf_decisions = LRUCache(max_size=settings.SPF_DECISION_CACHE_SIZE)
 
+# Thread pool used to run DNS queries of same level of SPF tree
+# concurrently. Created on first use, so that threads are started after
+# iRedAPD forked.
+_executor = None
+_executor_lock = threading.Lock()
 
-def query_mx(domains, queried_domains=None, returned_ips=None, num_queries=0):
-    """
-    Return a list of IP addresses/networks defined in MX record of mail domain
-    names.
 
-    @domains - a list/tuple/set of mail domain names
-    @queried_domains - a set of mail domain names which already queried spf
-    @returned_ips - a set of IP addr/networks of queried mail domain names
-    """
-    ips = set()
+def _get_executor():
+    global _executor
 
-    queried_domains = queried_domains or set()
-    returned_ips = returned_ips or set()
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.SPF_DNS_WORKERS,
+                                               thread_name_prefix='spf')
 
-    hostnames = set()
+    return _executor
 
-    domains = [d for d in domains if d not in queried_domains]
-    for domain in domains:
-        if num_queries >= max_queries:
-            break
-
-        try:
-            num_queries += 1
-            qr = get_dns_resolver().query(domain, 'MX')
-            if qr:
-                for r in qr:
-                    hostname = str(r).split()[-1].rstrip('.')
-                    logger.debug("[SPF][{}] MX: {}".format(domain, hostname))
-                    if utils.is_domain(hostname):
-                        hostnames.add(hostname)
-
-            if hostnames:
-                qr = query_a(domains=hostnames,
-                             queried_domains=queried_domains,
-                             returned_ips=returned_ips,
-                             num_queries=num_queries)
-
-                ips_a = qr['ips']
-                queried_domains = qr['queried_domains']
-                returned_ips = qr['returned_ips']
-                num_queries = qr['num_queries']
-
-                ips.update(ips_a)
-
-            queried_domains.add('mx:' + domain)
-        except:
-            pass
 
-    return {
-        'ips': ips,
-        'queried_domains': queried_domains,
-        'returned_ips': returned_ips,
-        'num_queries': num_queries,
-    }
+def _get_ttl(answer):
+    """Return seconds before given DNS answer expires."""
+    return max(0, min(int(answer.expiration - time.time()), settings.DNS_CACHE_MAX_TTL))
 
 
-def query_spf(domain, queried_domains=None, num_queries=0):
-    """Return SPF record of given domain name."""
+def _get_spf(domain):
+    """Query DNS TXT records of given domain, return a tuple of SPF record (or
+    None) and seconds the result is valid for."""
     spf = None
-
-    queried_domains = queried_domains or set()
-    if ('spf:' + domain in queried_domains) or (num_queries >= max_queries):
-        return {
-            'spf': None,
-            'queried_domains': queried_domains,
-            'num_queries': num_queries,
-        }
+    ttl = settings.DNS_NEGATIVE_CACHE_TTL
 
     try:
-        # WARNING: DO NOT UPDATE queried_domains in this function
-        num_queries += 1
-        qr = get_dns_resolver().query(domain, 'TXT')
+        qr = dnscache.query(domain, 'TXT')
+        ttl = _get_ttl(qr)
         for r in qr:
             # Remove heading/ending quotes
             r = str(r).strip('"').strip("'")
@@ -152,38 +74,21 @@ def query_spf(domain, queried_domains=None, num_queries=0):
         pass
     except Exception as e:
         logger.debug("[SPF] Error while querying DNS SPF record {}: {}".format(domain, repr(e)))
+        ttl = 0
 
-    queried_domains.add('spf:' + domain)
+    return (spf, ttl)
 
-    return {
-        'spf': spf,
-        'queried_domains': queried_domains,
-        'num_queries': num_queries,
-    }
 
+def parse_spf_tags(domain, spf):
+    """Parse value of DNS SPF record without DNS queries.
 
-def parse_spf(domain,
-              spf,
-              queried_domains=None,
-              returned_ips=None,
-              num_queries=0):
-    """Parse value of DNS SPF record."""
+    Return a tuple of sets: (ips, included_domains, a, mx).
+    """
     ips = set()
     a = set()
     mx = set()
     included_domains = set()
 
-    queried_domains = queried_domains or set()
-    returned_ips = returned_ips or set()
-
-    if not spf:
-        return {
-            'ips': ips,
-            'queried_domains': queried_domains,
-            'returned_ips': returned_ips,
-            'num_queries': num_queries,
-        }
-
     tags = spf.split()
 
     for tag in tags:
@@ -237,119 +142,219 @@ def parse_spf(domain,
             # Support macro `%{i}` first.
             pass
 
-    # Find IP in included_domains
-    if included_domains:
-        included_domains = [i for i in included_domains if 'spf:' + i not in queried_domains]
+    return (ips, included_domains, a, mx)
 
-        logger.debug("[SPF][{}] 'spf:' tag: {}".format(domain, ', '.join(included_domains)))
-        qr = query_spf_of_included_domains(included_domains,
-                                           queried_domains=queried_domains,
-                                           returned_ips=returned_ips,
-                                           num_queries=num_queries)
 
-        ips_included = qr['ips']
-        queried_domains = qr['queried_domains']
-        returned_ips = qr['returned_ips']
-        num_queries = qr['num_queries']
+def _lookup(kind, domain):
+    """Run one DNS query of SPF evaluation, used in thread pool.
 
-        ips.update(ips_included)
+    - kind='spf': returns SPF record or None.
+    - kind='a': returns a set of IP addresses.
+    - kind='mx': returns a set of hostnames of MX servers.
 
-    if a:
-        _domains = [i for i in a if 'a:' + i not in queried_domains]
+    Returns a tuple of result and seconds it's valid for.
+    """
+    if kind == 'spf':
+        return _get_spf(domain)
 
-        logger.debug("[SPF][{}] 'a:' tag: {}".format(domain, ', '.join(a)))
-        qr = query_a(domains=_domains,
-                     queried_domains=queried_domains,
-                     returned_ips=returned_ips,
-                     num_queries=num_queries)
+    result = set()
+    ttl = settings.DNS_NEGATIVE_CACHE_TTL
+    try:
+        qr = dnscache.query(domain, kind.upper())
+        ttl = _get_ttl(qr)
+        for r in qr:
+            if kind == 'a':
+                _ip = str(r)
+                logger.debug("[DNS][A] {} -> {}".format(domain, _ip))
+                result.add(_ip)
+            else:
+                hostname = str(r).split()[-1].rstrip('.')
+                logger.debug("[SPF][{}] MX: {}".format(domain, hostname))
+                if utils.is_domain(hostname):
+                    result.add(hostname)
+    except resolver.NoAnswer:
+        logger.debug("[DNS][{}] {} -> NoAnswer".format(kind.upper(), domain))
+    except resolver.NXDOMAIN:
+        logger.debug("[DNS][{}] {} -> NXDOMAIN".format(kind.upper(), domain))
+    except resolver.Timeout:
+        logger.info("[DNS][{}] {} -> Timeout".format(kind.upper(), domain))
+        ttl = 0
+    except Exception as e:
+        logger.debug("[DNS][{}] {} -> Error: {}".format(kind.upper(), domain, repr(e)))
+        ttl = 0
 
-        ips_a = qr['ips']
-        queried_domains = qr['queried_domains']
-        returned_ips = qr['returned_ips']
-        num_queries = qr['num_queries']
+    return (result, ttl)
 
-        ips.update(ips_a)
 
-    if mx:
-        _domains = [i for i in mx if 'mx:' + i not in queried_domains]
+def _resolve_spf_tree(lookups, queried_domains, returned_ips, num_queries):
+    """Resolve SPF tree level by level, DNS queries of same level are
+    running concurrently.
 
-        logger.debug("[SPF][{}] 'mx:' tag: {}".format(domain, ', '.join(mx)))
-        qr = query_mx(domains=_domains,
-                      queried_domains=queried_domains,
-                      returned_ips=returned_ips,
-                      num_queries=num_queries)
+    @lookups - a list of (kind, domain) of first level, kind is one of
+               'spf' (include/redirect), 'a', 'mx'.
 
-        ips_mx = qr['ips']
-        queried_domains = qr['queried_domains']
-        returned_ips = qr['returned_ips']
-        num_queries = qr['num_queries']
+    Returned dict contains key `ttl`: minimal TTL of all DNS records used.
+    """
+    ips = set()
+    ttl = settings.DNS_CACHE_MAX_TTL
+
+    while lookups:
+        # Skip queried domains and stop at the max number of DNS queries.
+        _todo = []
+        for (kind, domain) in lookups:
+            _key = kind + ':' + domain
+            if _key in queried_domains:
+                continue
+
+            if num_queries >= max_queries:
+                logger.debug("[SPF] Reached max DNS queries ({}), skip others.".format(max_queries))
+                break
 
-        ips.update(ips_mx)
+            num_queries += 1
+            queried_domains.add(_key)
+            _todo.append((kind, domain))
 
-    queried_domains.add('spf:' + domain)
+        if not _todo:
+            break
 
-    if ips:
-        logger.debug("[SPF][{}] All IP addresses/networks: {}".format(domain, ', '.join(ips)))
-    else:
-        logger.debug("[SPF][{}] No valid IP addresses/networks.".format(domain))
+        if len(_todo) == 1 or settings.SPF_DNS_WORKERS <= 1:
+            results = [_lookup(kind, domain) for (kind, domain) in _todo]
+        else:
+            results = list(_get_executor().map(lambda x: _lookup(*x), _todo))
+
+        # Lookups of next level.
+        lookups = []
+        for ((kind, domain), (result, _ttl)) in zip(_todo, results):
+            ttl = min(ttl, _ttl)
+
+            if kind == 'spf':
+                if result:
+                    logger.debug("[SPF][include {}] {}".format(domain, result))
+                    (_ips, _included, _a, _mx) = parse_spf_tags(domain=domain, spf=result)
+
+                    ips.update(_ips)
+                    lookups += [('spf', i) for i in _included]
+                    lookups += [('a', i) for i in _a]
+                    lookups += [('mx', i) for i in _mx]
+                else:
+                    logger.debug("[SPF][include {}] empty".format(domain))
+            elif kind == 'a':
+                ips.update(result)
+            elif kind == 'mx':
+                lookups += [('a', i) for i in result]
+
+    returned_ips.update(ips)
 
     return {
         'ips': ips,
         'queried_domains': queried_domains,
         'returned_ips': returned_ips,
         'num_queries': num_queries,
+        'ttl': ttl,
     }
 
 
-def query_spf_of_included_domains(domains,
-                                  queried_domains=None,
-                                  returned_ips=None,
-                                  num_queries=0):
-    """
-    Return a set of IP addresses/networks defined in SPF record of given mail
-    domain names.
-    """
-    ips = set()
+def parse_spf(domain,
+              spf,
+              queried_domains=None,
+              returned_ips=None,
+              num_queries=0):
+    """Parse value of DNS SPF record, and resolve IP addresses/networks of
+    included domains, `a` and `mx` mechanisms."""
     queried_domains = queried_domains or set()
     returned_ips = returned_ips or set()
 
-    domains = [d for d in domains if 'spf:' + d not in queried_domains]
-    for domain in domains:
-        qr = query_spf(domain=domain,
-                       queried_domains=queried_domains,
-                       num_queries=num_queries)
-        spf = qr['spf']
-        queried_domains = qr['queried_domains']
-        num_queries = qr['num_queries']
-
-        if spf:
-            logger.debug("[SPF][include {}] {}".format(domain, spf))
-        else:
-            logger.debug("[SPF][include {}] empty".format(domain))
+    if not spf:
+        return {
+            'ips': set(),
+            'queried_domains': queried_domains,
+            'returned_ips': returned_ips,
+            'num_queries': num_queries,
+            'ttl': settings.DNS_CACHE_MAX_TTL,
+        }
 
-        qr = parse_spf(domain=domain,
-                       spf=spf,
-                       queried_domains=queried_domains,
-                       returned_ips=returned_ips,
-                       num_queries=num_queries)
+    (ips, included_domains, a, mx) = parse_spf_tags(domain=domain, spf=spf)
+    queried_domains.add('spf:' + domain)
 
-        ips_spf = qr['ips']
-        queried_domains = qr['queried_domains']
-        returned_ips = qr['returned_ips']
-        num_queries = qr['num_queries']
+    if included_domains:
+        logger.debug("[SPF][{}] 'spf:' tag: {}".format(domain, ', '.join(included_domains)))
 
-        ips.update(ips_spf)
-        queried_domains.add('spf:' + domain)
-        returned_ips.update(ips_spf)
+    if a:
+        logger.debug("[SPF][{}] 'a:' tag: {}".format(domain, ', '.join(a)))
+
+    if mx:
+        logger.debug("[SPF][{}] 'mx:' tag: {}".format(domain, ', '.join(mx)))
+
+    lookups = [('spf', i) for i in included_domains] \
+        + [('a', i) for i in a] \
+        + [('mx', i) for i in mx]
+
+    qr = _resolve_spf_tree(lookups=lookups,
+                           queried_domains=queried_domains,
+                           returned_ips=returned_ips,
+                           num_queries=num_queries)
+
+    ips.update(qr['ips'])
+
+    if ips:
+        logger.debug("[SPF][{}] All IP addresses/networks: {}".format(domain, ', '.join(ips)))
+    else:
+        logger.debug("[SPF][{}] No valid IP addresses/networks.".format(domain))
 
     return {
         'ips': ips,
-        'queried_domains': queried_domains,
-        'returned_ips': returned_ips,
-        'num_queries': num_queries,
+        'queried_domains': qr['queried_domains'],
+        'returned_ips': qr['returned_ips'],
+        'num_queries': qr['num_queries'],
+        'ttl': qr['ttl'],
     }
 
 
+def get_spf_ips(domain, mx_fallback=False):
+    """Resolve all IP addresses/networks listed in SPF DNS record of given
+    domain. If `mx_fallback` is True and domain doesn't have SPF record, IP
+    addresses of MX servers are returned.
+
+    Return a tuple of a set of IP addresses/networks and seconds the result
+    is valid for (minimal TTL of all DNS records used, 0 if failed to query
+    some records).
+    """
+    (spf, ttl) = _get_spf(domain)
+
+    if spf:
+        qr = parse_spf(domain=domain,
+                       spf=spf,
+                       queried_domains={'spf:' + domain},
+                       num_queries=1)
+    elif mx_fallback and ttl:
+        qr = _resolve_spf_tree(lookups=[('mx', domain)],
+                               queried_domains=set(),
+                               returned_ips=set(),
+                               num_queries=1)
+    else:
+        logger.debug("[SPF] Domain {} does not have a valid SPF DNS record.".format(domain))
+        return (set(), ttl)
+
+    return (qr['ips'], min(ttl, qr['ttl']))
+
+
+def compile_spf(domain):
+    """Resolve all IP addresses/networks listed in SPF DNS record of given
+    domain.
+
+    Return a tuple of `IPNetworkIndex` and seconds it's valid for.
+    """
+    networks = IPNetworkIndex()
+
+    (ips, ttl) = get_spf_ips(domain)
+    for i in ips:
+        # Entries like `@<domain>` are `ptr` mechanism, not supported.
+        if not i.startswith('@'):
+            networks.add(i)
+
+    return (networks, ttl)
+
+
 def is_allowed_server_in_spf(sender_domain, ip):
     """
     Check whether given IP address is listed in SPF DNS record of given
@@ -358,46 +363,33 @@ def is_allowed_server_in_spf(sender_domain, ip):
     if (not sender_domain) or (not ip):
         return False
 
-    qr = query_spf(domain=sender_domain, queried_domains=None, num_queries=0)
-
-    _spf = qr['spf']
-    if not _spf:
-        logger.debug("[SPF] Domain {} does not have a valid SPF DNS record.".format(sender_domain))
+    try:
+        _ip_object = ipaddress.ip_address(ip)
+    except ValueError:
         return False
 
-    queried_domains = qr['queried_domains']
-    qr = parse_spf(domain=sender_domain,
-                   spf=_spf,
-                   queried_domains=queried_domains)
+    sender_domain = sender_domain.lower()
+    _key = (sender_domain, ip)
 
-    _ips = qr['ips']
-    if ip in _ips:
-        logger.debug("[SPF] IP {} is listed in SPF DNS record of sender domain {}.".format(ip, sender_domain))
-        return True
+    result = _spf_decisions.get(_key)
+    if result is not None:
+        return result
 
-    _ip_object = ipaddress.ip_address(ip)
-    _cidrs = []
+    now = time.time()
+    _compiled = _compiled_spf.get(sender_domain)
+    if _compiled is None:
+        (networks, ttl) = compile_spf(sender_domain)
+        _compiled = (now + ttl, networks)
+        _compiled_spf.set(sender_domain, _compiled, ttl=ttl)
 
-    # Get CIDR networks
-    if _ip_object.version == 4:
-        # if ip is `a.b.c.d`, then ip prefix is `a.`
-        _ipv4_prefix = ip.split('.', 1)[0] + '.'
-        _cidrs = [i for i in _ips if (i.startswith(_ipv4_prefix) and '.0/' in i)]
-    elif _ip_object.version == 6:
-        _cidrs = [i for i in _ips if (':' in i and '/' in i)]
+    (_expire_time, networks) = _compiled
 
-    if _cidrs:
-        for _cidr in _cidrs:
-            try:
-                _network = ipaddress.ip_network(_cidr)
-
-                if _ip_object in _network:
-                    logger.debug("[SPF] IP ({}) is listed in SPF DNS record "
-                                 "of sender domain {} "
-                                 "(network={}).".format(ip, sender_domain, _cidr))
-                    return True
-            except Exception as e:
-                logger.debug("[SPF] Error while checking IP {} against network {}: {}".format(ip, _cidr, repr(e)))
-
-    logger.debug("[SPF] IP {} is NOT listed in SPF DNS record of domain {}.".format(ip, sender_domain))
-    return False
+    result = (networks.lookup(_ip_object) is not None)
+    _spf_decisions.set(_key, result, ttl=_expire_time - now)
+
+    if result:
+        logger.debug("[SPF] IP {} is listed in SPF DNS record of sender domain {}.".format(ip, sender_domain))
+    else:
+        logger.debug("[SPF] IP {} is NOT listed in SPF DNS record of domain {}.".format(ip, sender_domain))
+
+    return result
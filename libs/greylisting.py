@@ -1,4 +1,200 @@
-from libs import utils
+import time
+import hashlib
+import ipaddress
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from web import sqlquote
+
+from libs import ACCOUNT_PRIORITIES
+from libs import utils, dnsspf
+from libs.cache import SQLTableCache
+from libs.ipindex import IPNetworkIndex
+from libs.logger import logger
+import settings  # type: ignore
+
+
+class WhitelistCache(SQLTableCache):
+    """Greylisting whitelists stored in SQL table `greylisting_whitelists`
+    or `greylisting_whitelist_domain_spf`.
+
+    Data structure:
+
+        {<account>: {'senders': {<sender>, ...},
+                     'networks': <IPNetworkIndex of CIDR networks>}}
+    """
+    sql_columns = ['id', 'account', 'sender']
+    sql_checksum_columns = sql_columns
+
+    def __init__(self, sql_table, **kwargs):
+        self.sql_table = sql_table
+        SQLTableCache.__init__(self, **kwargs)
+
+    def new_data(self):
+        return {}
+
+    def add_row(self, data, row):
+        (_, account, sender) = row
+        account = account.lower()
+        sender = sender.lower()
+
+        if account not in data:
+            data[account] = {'senders': set(), 'networks': IPNetworkIndex()}
+
+        if '/' in sender:
+            data[account]['networks'].add(sender, sender)
+        else:
+            data[account]['senders'].add(sender)
+
+
+class SettingCache(SQLTableCache):
+    """Greylisting settings stored in SQL table `greylisting`.
+
+    Data structure:
+
+        {<account>: [<level>, <level>, ...]}
+
+    Each level holds settings with same (priority, sender_priority), levels
+    are sorted by priority (highest first):
+
+        (<priority>, <sender_priority>,
+         {<sender>: (<id>, <active>)},
+         <IPNetworkIndex of CIDR networks, value is (<id>, <sender>, <active>)>)
+
+    Same as SQL lookup, only valid IPv4 networks (without host bits) with
+    CIDR sender priority are matched against client address.
+    """
+    sql_table = 'greylisting'
+    sql_columns = ['id', 'account', 'priority', 'sender', 'sender_priority', 'active']
+    sql_checksum_columns = sql_columns
+
+    def new_data(self):
+        return {}
+
+    def add_row(self, data, row):
+        (_id, account, priority, sender, sender_priority, active) = row
+        account = account.lower()
+        priority = int(priority or 0)
+        sender_priority = int(sender_priority or 0)
+
+        levels = data.setdefault(account, [])
+
+        level = None
+        for lv in levels:
+            if lv[0] == priority and lv[1] == sender_priority:
+                level = lv
+                break
+
+        if not level:
+            level = (priority, sender_priority, {}, IPNetworkIndex())
+            levels.append(level)
+            levels.sort(key=lambda lv: (lv[0], lv[1]), reverse=True)
+
+        if '/' in sender:
+            if sender_priority != ACCOUNT_PRIORITIES['cidr']:
+                return None
+
+            try:
+                _net = ipaddress.ip_network(sender)
+            except ValueError:
+                return None
+
+            if _net.version == 4:
+                level[3].add(_net, (_id, sender, active))
+        else:
+            level[2][sender] = (_id, active)
+
+
+def get_setting_in_cache(data, senders, recipients, ip_object):
+    """Find the greylisting setting with highest priority which matches
+    given senders (or client IP address), cached by `SettingCache`.
+
+    Returns a tuple (<id>, <account>, <sender>, <active>), or None if no
+    setting matches.
+
+    Matching rules are same as SQL lookup in plugin `greylisting`, except
+    that if client address is in multiple CIDR networks with same
+    priority, the longest network wins (SQL lookup picks a random one).
+    """
+    # Like SQL lookup, CIDR network must start with same first octet as
+    # client address (e.g. `0.0.0.0/0` never matches).
+    _cidr_prefix = None
+    if ip_object.version == 4:
+        _cidr_prefix = str(ip_object).split('.', 1)[0] + '.'
+
+    levels = []
+    for rcpt in recipients:
+        for lv in data.get(rcpt, ()):
+            levels.append((lv, rcpt))
+
+    if len(levels) > 1:
+        levels.sort(key=lambda i: (i[0][0], i[0][1]), reverse=True)
+
+    for (lv, account) in levels:
+        _senders = lv[2]
+        for sender in senders:
+            _v = _senders.get(sender)
+            if _v:
+                return (_v[0], account, sender, _v[1])
+
+        if _cidr_prefix:
+            for _v in lv[3].lookup_all(ip_object):
+                if _v[1].startswith(_cidr_prefix):
+                    return (_v[0], account, _v[1], _v[2])
+
+    return None
+
+
+def is_whitelisted_in_cache(data, senders, recipients, ip_object):
+    """Check whitelists cached by `WhitelistCache`.
+
+    Returns a tuple (True, <matched sender or network>) or (False, None).
+    """
+    for rcpt in recipients:
+        wl = data.get(rcpt)
+        if not wl:
+            continue
+
+        for sender in senders:
+            if sender in wl['senders']:
+                return (True, sender)
+
+        _net = wl['networks'].lookup(ip_object)
+        if _net:
+            return (True, _net)
+
+    return (False, None)
+
+
+def get_tracking_client_address(client_address, ipv4_prefix=32, ipv6_prefix=128):
+    """Return client address used in greylisting tracking.
+
+    With prefix length shorter than the full address, client address is
+    normalized to its network (e.g. '192.0.2.0/24'), so that retries from
+    other IP addresses of the same network share the same tracking record.
+    """
+    try:
+        ip = ipaddress.ip_address(client_address)
+    except ValueError:
+        return client_address
+
+    if ip.version == 4:
+        prefix = ipv4_prefix
+    else:
+        prefix = ipv6_prefix
+
+    if not (0 < prefix < ip.max_prefixlen):
+        return client_address
+
+    return str(ipaddress.ip_network((ip, prefix), strict=False))
+
+
+def get_triplet_hash(sender, recipient, client_address) -> bytes:
+    """Return 16-byte BLAKE2 digest of greylisting triplet, stored in
+    `greylisting_tracking.triplet_hash`."""
+    s = '\0'.join([sender.lower(), recipient.lower(), client_address.lower()])
+    return hashlib.blake2b(s.encode(), digest_size=16).digest()
+
 
 def is_valid_sender(sender):
     if utils.is_ip(sender) or \
@@ -74,6 +270,47 @@ def disable_greylisting(engine_iredapd, account, sender):
         return (False, str(e))
 
 
+def import_settings(engine_iredapd, records):
+    """Import greylisting settings with one multi-row INSERT statement,
+    existing settings of same (account, sender) are updated.
+
+    records -- list of tuple (account, sender, active)
+
+    Returns (True, <number of imported settings>) or (False, <error>).
+    """
+    _values = {}
+    for (account, sender, active) in records:
+        account = str(account).lower()
+        sender = str(sender).lower()
+
+        if not (is_valid_sender(sender) and '@' in account):
+            continue
+
+        gl_setting = get_gl_base_setting(account=account, sender=sender)
+        gl_setting['active'] = int(bool(active))
+
+        # Last one wins.
+        _values[(account, sender)] = """(%s, %d, %s, %d, %d)""" % (sqlquote(gl_setting['account']),
+                                                                 gl_setting['priority'],
+                                                                 sqlquote(gl_setting['sender']),
+                                                                 gl_setting['sender_priority'],
+                                                                 gl_setting['active'])
+
+    if not _values:
+        return (True, 0)
+
+    try:
+        sql = """INSERT INTO greylisting (account, priority, sender, sender_priority, active)
+                      VALUES %s %s""" % (', '.join(_values.values()),
+                                          utils.get_sql_upsert_clause(['account', 'sender'],
+                                                                      ['priority', 'sender_priority', 'active']))
+        utils.execute_sql(engine_iredapd, sql)
+
+        return (True, len(_values))
+    except Exception as e:
+        return (False, repr(e))
+
+
 def add_whitelist_sender(engine_iredapd, account, sender, comment=None):
     if not is_valid_sender(sender):
         return (False, 'INVALID_SENDER')
@@ -126,6 +363,9 @@ def remove_whitelisted_domain(engine_iredapd, domain):
 
         sql = """DELETE FROM greylisting_whitelists WHERE COMMENT='AUTO-UPDATE: %s'""" % domain
         utils.execute_sql(engine_iredapd, sql)
+
+        sql = """DELETE FROM greylisting_whitelist_domain_spf WHERE comment='AUTO-UPDATE: %s'""" % domain
+        utils.execute_sql(engine_iredapd, sql)
     except Exception as e:
         error = str(e).lower()
         if 'duplicate key' in error or 'duplicate entry' in error:
@@ -134,3 +374,316 @@ def remove_whitelisted_domain(engine_iredapd, domain):
             return (False, str(e))
 
     return (True, )
+
+
+#
+# Greylisting whitelists generated from SPF/MX DNS records of domains listed
+# in SQL table `greylisting_whitelist_domains`.
+#
+# Number of values in one bulk SQL statement.
+_SQL_CHUNK_SIZE = 500
+
+_spf_refresh_thread = None
+
+
+def get_whitelist_domains(engine_iredapd):
+    sql = "SELECT domain FROM greylisting_whitelist_domains"
+    qr = utils.execute_sql(engine_iredapd, sql)
+    return [str(r[0]).lower() for r in qr.fetchall() if utils.is_domain(r[0])]
+
+
+def resolve_whitelist_domains(domains, max_workers=10):
+    """Resolve IP addresses/networks listed in SPF (or MX if no SPF) DNS
+    records of given domains concurrently.
+
+    Return a dict: {<domain>: (<set of ips>, <ttl>)}. `ttl` is 0 if failed to
+    query some DNS records.
+    """
+    if not domains:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        results = executor.map(lambda d: dnsspf.get_spf_ips(d, mx_fallback=True), domains)
+        return dict(zip(domains, results))
+
+
+def __chunks(values):
+    values = list(values)
+    for i in range(0, len(values), _SQL_CHUNK_SIZE):
+        yield values[i:i + _SQL_CHUNK_SIZE]
+
+
+def update_spf_whitelists(engine_iredapd, resolved, remove_other_domains=False, other_ips=None):
+    """Update SQL table `greylisting_whitelist_domain_spf` with resolved IP
+    addresses/networks, only new, removed and re-attributed ones are updated.
+
+    Same IP address/network may be listed by multiple domains, but it's
+    stored only once with the comment of one domain (`AUTO-UPDATE: <domain>`).
+    If that domain doesn't list it anymore, it's re-attributed to another
+    domain which still lists it instead of being removed.
+
+    @resolved -- returned by `resolve_whitelist_domains()`. Existing
+                 whitelists of domains which failed to resolve are kept.
+    @remove_other_domains -- remove whitelists of domains which are not in
+                             `resolved`.
+    @other_ips -- IP addresses/networks (last resolved) of other domains which
+                  are not in `resolved`: {<domain>: <set of ips>}. Whitelists
+                  still listed by them are not removed.
+
+    Return a tuple: (<number of added>, <number of removed>).
+    """
+    # All existing senders: {<sender>: <comment>}
+    existing = {}
+    sql = "SELECT sender, comment FROM greylisting_whitelist_domain_spf WHERE account='@.'"
+    qr = utils.execute_sql(engine_iredapd, sql)
+    for (_sender, _comment) in qr.fetchall():
+        existing[_sender] = _comment
+
+    # Comments of all domains which list the sender: {<sender>: [<comment>, ...]}
+    listed = {}
+
+    # Comments of domains whose IP addresses/networks are known, whitelists
+    # attributed to them but not listed by them anymore are outdated.
+    known_comments = set()
+
+    for (domain, (ips, ttl)) in resolved.items():
+        comment = 'AUTO-UPDATE: %s' % domain
+        if not ttl:
+            # Keep existing whitelists of this domain.
+            logger.info("[{}] Failed to query SPF/MX DNS records, keep existing whitelists.".format(domain))
+            for (k, v) in existing.items():
+                if v == comment:
+                    listed.setdefault(k, []).append(comment)
+            continue
+
+        known_comments.add(comment)
+        for ip in ips:
+            listed.setdefault(ip, []).append(comment)
+
+    for (domain, ips) in (other_ips or {}).items():
+        if domain in resolved:
+            continue
+
+        comment = 'AUTO-UPDATE: %s' % domain
+        known_comments.add(comment)
+        for ip in ips:
+            listed.setdefault(ip, []).append(comment)
+
+    removed = []
+    # {<sender>: <new comment>}
+    reattributed = {}
+    for (_sender, _comment) in existing.items():
+        _outdated = (_comment in known_comments) \
+            or (remove_other_domains and (_comment or '').startswith('AUTO-UPDATE: '))
+
+        if not _outdated:
+            continue
+
+        _comments = listed.get(_sender)
+        if not _comments:
+            removed.append(_sender)
+        elif _comment not in _comments:
+            reattributed[_sender] = _comments[0]
+
+    added = [(k, v[0]) for (k, v) in listed.items() if k not in existing]
+
+    for _senders in __chunks(removed):
+        sql = """DELETE FROM greylisting_whitelist_domain_spf
+                  WHERE account='@.' AND sender IN %s""" % sqlquote(_senders)
+        utils.execute_sql(engine_iredapd, sql)
+
+    for _comment in set(reattributed.values()):
+        _senders = [k for (k, v) in reattributed.items() if v == _comment]
+        for _chunk in __chunks(_senders):
+            sql = """UPDATE greylisting_whitelist_domain_spf
+                        SET comment=%s
+                      WHERE account='@.' AND sender IN %s""" % (sqlquote(_comment), sqlquote(_chunk))
+            utils.execute_sql(engine_iredapd, sql)
+
+    if reattributed:
+        logger.debug("[SPF] Re-attributed {} greylisting whitelists to other "
+                     "domains which still list them.".format(len(reattributed)))
+
+    for _rows in __chunks(added):
+        _values = ', '.join(["('@.', %s, %s)" % (sqlquote(k), sqlquote(v)) for (k, v) in _rows])
+        sql = """INSERT INTO greylisting_whitelist_domain_spf (account, sender, comment)
+                      VALUES %s""" % _values
+        utils.execute_sql(engine_iredapd, sql)
+
+        # Whitelisted, tracking data is not needed anymore.
+        sql = """DELETE FROM greylisting_tracking
+                  WHERE client_address IN %s""" % sqlquote([k for (k, v) in _rows])
+        utils.execute_sql(engine_iredapd, sql)
+
+    return (len(added), len(removed))
+
+
+def remove_spf_whitelists_of_other_domains(engine_iredapd, domains, domain_ips=None):
+    """Remove whitelists generated from SPF/MX DNS records of domains which
+    are not in given domains (e.g. removed from SQL table
+    `greylisting_whitelist_domains`).
+
+    @domain_ips -- IP addresses/networks (last resolved) of given domains:
+                   {<domain>: <set of ips>}. Whitelists still listed by them
+                   are re-attributed to them instead of being removed.
+
+    Return number of removed domains.
+    """
+    comments = set('AUTO-UPDATE: %s' % d for d in domains)
+
+    # {<ip>: <comment>}
+    listed = {}
+    for (domain, ips) in (domain_ips or {}).items():
+        if domain in domains:
+            for ip in ips:
+                listed.setdefault(ip, 'AUTO-UPDATE: %s' % domain)
+
+    sql = "SELECT sender, comment FROM greylisting_whitelist_domain_spf WHERE account='@.'"
+    qr = utils.execute_sql(engine_iredapd, sql)
+
+    removed_comments = set()
+    removed = []
+    # {<sender>: <new comment>}
+    reattributed = {}
+    for (_sender, _comment) in qr.fetchall():
+        if not (_comment and _comment.startswith('AUTO-UPDATE: ')) or _comment in comments:
+            continue
+
+        removed_comments.add(_comment)
+        if _sender in listed:
+            reattributed[_sender] = listed[_sender]
+        else:
+            removed.append(_sender)
+
+    for _senders in __chunks(removed):
+        sql = """DELETE FROM greylisting_whitelist_domain_spf
+                  WHERE account='@.' AND sender IN %s""" % sqlquote(_senders)
+        utils.execute_sql(engine_iredapd, sql)
+
+    for _comment in set(reattributed.values()):
+        _senders = [k for (k, v) in reattributed.items() if v == _comment]
+        for _chunk in __chunks(_senders):
+            sql = """UPDATE greylisting_whitelist_domain_spf
+                        SET comment=%s
+                      WHERE account='@.' AND sender IN %s""" % (sqlquote(_comment), sqlquote(_chunk))
+            utils.execute_sql(engine_iredapd, sql)
+
+    if removed_comments:
+        logger.info("[SPF] Removed greylisting whitelists of {} domains which are "
+                    "not whitelisted anymore.".format(len(removed_comments)))
+
+    return len(removed_comments)
+
+
+def refresh_spf_whitelists(engine_iredapd, domains, remove_other_domains=False, other_ips=None):
+    """Resolve SPF/MX DNS records of given domains and update whitelists.
+
+    @other_ips -- passed to `update_spf_whitelists()`.
+
+    Return resolved IP addresses/networks and TTL of each domain:
+    {<domain>: (<set of ips>, <ttl>)}.
+    """
+    resolved = resolve_whitelist_domains(domains, max_workers=settings.GREYLISTING_SPF_REFRESH_WORKERS)
+    (num_added, num_removed) = update_spf_whitelists(engine_iredapd=engine_iredapd,
+                                                     resolved=resolved,
+                                                     remove_other_domains=remove_other_domains,
+                                                     other_ips=other_ips)
+
+    if num_added or num_removed:
+        logger.info("[SPF] Refreshed greylisting whitelists of {} domains: "
+                    "{} added, {} removed.".format(len(resolved), num_added, num_removed))
+
+    return resolved
+
+
+class SPFWhitelistRefresher:
+    """Refresh SPF whitelists of each domain when TTL of its DNS records
+    expires, instead of all domains at once."""
+
+    def __init__(self, engine_iredapd):
+        self.engine_iredapd = engine_iredapd
+
+        # {<domain>: <next refresh time>}
+        self.schedule = {}
+        self.last_load_time = 0
+
+        # Last resolved IP addresses/networks: {<domain>: <set of ips>}. Used
+        # to keep whitelists listed by multiple domains while refreshing or
+        # removing one of them.
+        self.ips = {}
+
+        # All domains are refreshed on first run, whitelists of domains
+        # removed while iRedAPD is not running are removed then.
+        self.refreshed_all = False
+
+    def load_domains(self):
+        now = time.time()
+        domains = set(get_whitelist_domains(self.engine_iredapd))
+
+        _purge = False
+        for d in list(self.schedule):
+            if d not in domains:
+                self.schedule.pop(d)
+                self.ips.pop(d, None)
+                _purge = True
+
+        if _purge:
+            remove_spf_whitelists_of_other_domains(engine_iredapd=self.engine_iredapd,
+                                                   domains=domains,
+                                                   domain_ips=self.ips)
+
+        for d in domains:
+            # Refresh newly added domains immediately.
+            self.schedule.setdefault(d, now)
+
+        self.last_load_time = now
+
+    def run_once(self):
+        if time.time() - self.last_load_time >= settings.GREYLISTING_SPF_REFRESH_MIN_INTERVAL:
+            self.load_domains()
+
+        now = time.time()
+        due = [d for (d, t) in self.schedule.items() if t <= now]
+        if not due:
+            return None
+
+        other_ips = {d: v for (d, v) in self.ips.items() if d not in due}
+        resolved = refresh_spf_whitelists(engine_iredapd=self.engine_iredapd,
+                                          domains=due,
+                                          remove_other_domains=not self.refreshed_all,
+                                          other_ips=other_ips)
+        self.refreshed_all = True
+
+        for (d, (ips, ttl)) in resolved.items():
+            if ttl:
+                self.ips[d] = set(ips)
+
+            self.schedule[d] = now + max(ttl, settings.GREYLISTING_SPF_REFRESH_MIN_INTERVAL)
+
+    def run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error("[SPF] Error while refreshing greylisting whitelists: {}".format(repr(e)))
+
+            time.sleep(60)
+
+
+def start_spf_refresh(engine_iredapd):
+    """Start the thread used to refresh SPF whitelists. Must be called after
+    iRedAPD forked."""
+    global _spf_refresh_thread
+
+    if not engine_iredapd:
+        logger.error("[SPF] No connection to iredapd database, SPF whitelist refresh is disabled.")
+        return None
+
+    if _spf_refresh_thread and _spf_refresh_thread.is_alive():
+        return None
+
+    refresher = SPFWhitelistRefresher(engine_iredapd=engine_iredapd)
+    _spf_refresh_thread = threading.Thread(target=refresher.run, name='spf_refresh', daemon=True)
+    _spf_refresh_thread.start()
+
+    logger.info("Started background refresh of greylisting SPF whitelists.")
@@ -0,0 +1,124 @@
+"""Index of IPv4/IPv6 networks, used to find the network(s) which contains
+given IP address quickly.
+
+Networks are stored in one hash table per prefix length, keyed by the
+network address (as integer) shifted by host bits, so lookup costs one
+shift and one dict lookup for each prefix length used in the index, no
+matter how many networks are stored.
+"""
+
+import ipaddress
+
+
+class IPNetworkIndex:
+    def __init__(self):
+        # {<ip_version>: {<prefix_length>: {<network_key>: <value>}}}
+        self._tables = {4: {}, 6: {}}
+
+        # Prefix lengths used in each ip version, longest first.
+        self._prefixes = {4: [], 6: []}
+
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, ip):
+        return self.lookup(ip) is not None
+
+    def _update_prefixes(self, version):
+        self._prefixes[version] = sorted((k for (k, v) in self._tables[version].items() if v),
+                                         reverse=True)
+
+    def add(self, network, value=True) -> bool:
+        """Add network (string like '192.168.0.0/24', or an object of
+        `ipaddress.ip_network()`) with an optional value, returns False if
+        it's not a valid network."""
+        try:
+            if not isinstance(network, (ipaddress.IPv4Network, ipaddress.IPv6Network)):
+                network = ipaddress.ip_network(network, strict=False)
+        except ValueError:
+            return False
+
+        version = network.version
+        plen = network.prefixlen
+        key = int(network.network_address) >> (network.max_prefixlen - plen)
+
+        table = self._tables[version].setdefault(plen, {})
+        if key not in table:
+            self._count += 1
+
+        table[key] = value
+
+        if plen not in self._prefixes[version]:
+            self._update_prefixes(version)
+
+        return True
+
+    def remove(self, network) -> bool:
+        """Remove network, returns False if network doesn't exist."""
+        try:
+            if not isinstance(network, (ipaddress.IPv4Network, ipaddress.IPv6Network)):
+                network = ipaddress.ip_network(network, strict=False)
+        except ValueError:
+            return False
+
+        version = network.version
+        plen = network.prefixlen
+        key = int(network.network_address) >> (network.max_prefixlen - plen)
+
+        table = self._tables[version].get(plen)
+        if not table or key not in table:
+            return False
+
+        del table[key]
+        self._count -= 1
+
+        if not table:
+            self._update_prefixes(version)
+
+        return True
+
+    def lookup(self, ip, default=None):
+        """Return value of the longest network which contains given IP
+        address (string, or an object of `ipaddress.ip_address()`). Returns
+        `default` if no network matches or it's not a valid IP address."""
+        try:
+            if not isinstance(ip, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+                ip = ipaddress.ip_address(ip)
+        except ValueError:
+            return default
+
+        version = ip.version
+        tables = self._tables[version]
+        ip_int = int(ip)
+        max_plen = ip.max_prefixlen
+
+        for plen in self._prefixes[version]:
+            v = tables[plen].get(ip_int >> (max_plen - plen))
+            if v is not None:
+                return v
+
+        return default
+
+    def lookup_all(self, ip):
+        """Return values of all networks which contain given IP address,
+        longest network first."""
+        try:
+            if not isinstance(ip, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+                ip = ipaddress.ip_address(ip)
+        except ValueError:
+            return []
+
+        version = ip.version
+        tables = self._tables[version]
+        ip_int = int(ip)
+        max_plen = ip.max_prefixlen
+
+        values = []
+        for plen in self._prefixes[version]:
+            v = tables[plen].get(ip_int >> (max_plen - plen))
+            if v is not None:
+                values.append(v)
+
+        return values
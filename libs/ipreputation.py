@@ -0,0 +1,181 @@
+"""Read-only IP reputation list stored in a binary file, used by plugin
+`ip_reputation`. The file is compiled from text feeds with
+`tools/ip_reputation_compile.py`.
+
+File format (integers are little-endian):
+
+    - magic string: b'IRPL'
+    - version: uint32
+    - number of IPv4 ranges: uint64
+    - number of IPv6 ranges: uint64
+    - start addresses of IPv4 ranges (4 bytes each, big-endian, sorted)
+    - end addresses of IPv4 ranges
+    - start addresses of IPv6 ranges (16 bytes each, big-endian, sorted)
+    - end addresses of IPv6 ranges
+
+Ranges don't overlap, so the range which may contain an IP address is the
+last one whose start address is not larger than the IP address, found with
+binary search. Addresses are stored big-endian, comparing bytes is same as
+comparing integers.
+
+The file is memory-mapped, its pages are shared by all processes which
+load the same file and no Python object is created per range.
+"""
+
+import os
+import mmap
+import time
+import struct
+import ipaddress
+
+from libs.logger import logger
+
+MAGIC = b'IRPL'
+VERSION = 1
+
+_HEADER = struct.Struct('<4sIQQ')
+
+
+def merge_ranges(ranges):
+    """Sort and merge overlapping or adjacent (start, end) integer ranges."""
+    merged = []
+    for (start, end) in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+
+    return merged
+
+
+def write_file(path, ranges_v4, ranges_v6):
+    """Write IPv4 and IPv6 (start, end) integer ranges to given file.
+
+    Data is written to a temporary file first, then renamed to given path,
+    so that processes which are reading the file always see a complete one.
+    """
+    ranges_v4 = merge_ranges(ranges_v4)
+    ranges_v6 = merge_ranges(ranges_v6)
+
+    tmp_path = '%s.tmp.%d' % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(ranges_v4), len(ranges_v6)))
+
+        for (width, ranges) in [(4, ranges_v4), (16, ranges_v6)]:
+            for idx in [0, 1]:
+                f.write(b''.join(r[idx].to_bytes(width, 'big') for r in ranges))
+
+    os.replace(tmp_path, path)
+
+    return (len(ranges_v4), len(ranges_v6))
+
+
+class IPReputationFile:
+    """Memory-mapped IP reputation file."""
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, self.num_v4, self.num_v6) = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Invalid IP reputation file: {}".format(path))
+
+        offset = _HEADER.size
+
+        # {<ip version>: (<width>, <number of ranges>, <offset of starts>, <offset of ends>)}
+        self._tables = {}
+        for (ip_version, width, num) in [(4, 4, self.num_v4), (6, 16, self.num_v6)]:
+            self._tables[ip_version] = (width, num, offset, offset + width * num)
+            offset += width * num * 2
+
+        if offset != len(self._mm):
+            raise ValueError("Invalid IP reputation file (size mismatch): {}".format(path))
+
+    def __len__(self):
+        return self.num_v4 + self.num_v6
+
+    def lookup(self, ip) -> bool:
+        """Return True if given IP address (string or an object of
+        `ipaddress.ip_address()`) is listed."""
+        try:
+            if not isinstance(ip, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+                ip = ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+
+        (width, num, starts, ends) = self._tables[ip.version]
+        if not num:
+            return False
+
+        key = ip.packed
+        mm = self._mm
+
+        # Find the last range whose start <= key.
+        lo = 0
+        hi = num
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = starts + mid * width
+            if mm[pos:pos + width] <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        if not lo:
+            return False
+
+        pos = ends + (lo - 1) * width
+        return key <= mm[pos:pos + width]
+
+
+class IPReputationList:
+    """IP reputation file which is reloaded automatically after changed."""
+
+    def __init__(self, path, check_interval=60):
+        self.path = path
+        self.check_interval = check_interval
+
+        self.data = None
+        self._stat = None
+        self._last_check_time = 0
+
+    def _reload(self):
+        self._last_check_time = time.time()
+
+        try:
+            st = os.stat(self.path)
+        except OSError as e:
+            if self.data is None:
+                logger.error("[ip_reputation] Cannot read file {}: {}".format(self.path, repr(e)))
+            return None
+
+        _stat = (st.st_ino, st.st_size, st.st_mtime)
+        if _stat == self._stat:
+            return None
+
+        try:
+            data = IPReputationFile(self.path)
+        except Exception as e:
+            logger.error("[ip_reputation] Error while loading file {}: {}".format(self.path, repr(e)))
+            return None
+
+        # Swap in new data, old file is unmapped after last reference is
+        # gone.
+        self.data = data
+        self._stat = _stat
+
+        logger.info("[ip_reputation] Loaded {} IPv4 and {} IPv6 ranges from {}.".format(data.num_v4, data.num_v6, self.path))
+
+    def lookup(self, ip) -> bool:
+        if (time.time() - self._last_check_time) >= self.check_interval:
+            self._reload()
+
+        data = self.data
+        if data is None:
+            return False
+
+        return data.lookup(ip)
@@ -0,0 +1,221 @@
+# Send notification emails in a background thread, so that policy requests
+# never wait on mail delivery.
+#
+# Used by plugin: throttle
+
+import time
+import queue
+import threading
+
+from libs import utils
+from libs.logger import logger
+import settings  # type: ignore
+
+
+# Max number of queued (unsent) notification emails. New notification is
+# dropped if queue is full.
+QUEUE_SIZE = 1000
+
+# Max number of notification emails sent in one batch (with same smtp
+# connection).
+BATCH_SIZE = 100
+
+# Close the smtp connection if no notification email was sent in given
+# seconds. Postfix drops idle connection after 300 seconds by default
+# (`smtpd_timeout`).
+SMTP_IDLE_TIMEOUT = 60
+
+_queue = queue.Queue(maxsize=QUEUE_SIZE)
+
+# Worker thread is started on first notification. It must not be started
+# while loading plugins, because iRedAPD forks (daemonize) after that.
+_worker = None
+_worker_lock = threading.Lock()
+
+# Keys of queued notifications and their expire time, used to avoid sending
+# duplicate notifications in same period.
+# {<key>: <expire_time>}
+_notified = {}
+_notified_lock = threading.Lock()
+_notified_last_purge = 0
+
+
+class SMTPSender:
+    """Send emails with one persistent smtp connection, or with command
+    `sendmail` if smtp server is not configured."""
+    def __init__(self):
+        self.conn = None
+
+    def close(self):
+        if self.conn:
+            try:
+                self.conn.quit()
+            except Exception:
+                pass
+
+            self.conn = None
+
+    def get_conn(self):
+        if self.conn:
+            # Make sure connection is still alive.
+            try:
+                (code, _) = self.conn.noop()
+                if code == 250:
+                    return self.conn
+            except Exception:
+                pass
+
+            logger.debug('SMTP connection used to send notification email is dead, reconnecting.')
+            self.close()
+
+        self.conn = utils.get_notification_smtp_conn()
+        return self.conn
+
+    def send(self, subject, mail_body, from_address=None, recipients=None):
+        if not from_address:
+            from_address = settings.NOTIFICATION_SMTP_USER
+
+        if not recipients:
+            recipients = settings.NOTIFICATION_RECIPIENTS
+
+        message_text = utils.compose_mail(subject=subject,
+                                          mail_body=mail_body,
+                                          recipients=recipients)
+
+        try:
+            conn = self.get_conn()
+            if not conn:
+                return utils.sendmail_with_cmd(from_address=from_address,
+                                               recipients=recipients,
+                                               message_text=message_text)
+
+            conn.sendmail(from_address, recipients, message_text)
+            return (True, )
+        except Exception as e:
+            self.close()
+            return (False, repr(e))
+
+
+def __purge_notified(now):
+    global _notified_last_purge
+
+    if now - _notified_last_purge < 60:
+        return None
+
+    _notified_last_purge = now
+    for (k, v) in list(_notified.items()):
+        if v <= now:
+            _notified.pop(k, None)
+
+
+def __start_worker():
+    global _worker
+
+    with _worker_lock:
+        if _worker and _worker.is_alive():
+            return None
+
+        _worker = threading.Thread(target=__run_worker,
+                                   name='notification',
+                                   daemon=True)
+        _worker.start()
+
+
+def __run_worker():
+    sender = SMTPSender()
+
+    while True:
+        try:
+            item = _queue.get(timeout=SMTP_IDLE_TIMEOUT)
+        except queue.Empty:
+            sender.close()
+            continue
+
+        items = [item]
+        while len(items) < BATCH_SIZE:
+            try:
+                items.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        # {<callback>: [<callback_arg>, ...]}
+        sent = {}
+
+        for item in items:
+            qr = sender.send(subject=item['subject'], mail_body=item['mail_body'])
+
+            if qr[0]:
+                logger.info('Sent notification email: {}'.format(item['subject']))
+
+                if item['callback']:
+                    sent.setdefault(item['callback'], []).append(item['callback_arg'])
+            else:
+                logger.warning('Failed in sending notification email: {}, error={}'.format(item['subject'], qr[1]))
+
+                # Allow another notification in same period.
+                if item['key']:
+                    with _notified_lock:
+                        _notified.pop(item['key'], None)
+
+        for (callback, args) in list(sent.items()):
+            try:
+                callback(args)
+            except Exception as e:
+                logger.error('Error while running callback of notification email: {}'.format(repr(e)))
+
+
+def queue_mail(subject,
+               mail_body,
+               key=None,
+               expire_time=0,
+               callback=None,
+               callback_arg=None) -> bool:
+    """Queue a notification email, it will be sent in background thread.
+
+    Returns True if queued, False if duplicate or queue is full.
+
+    :param subject: mail subject.
+    :param mail_body: plain mail body.
+    :param key: a hashable object used to identify duplicate notifications.
+                Notification with same key is not queued again before
+                `expire_time`.
+    :param expire_time: a timestamp (in seconds).
+    :param callback: a function called after emails were sent, it takes one
+                     argument: a list of `callback_arg` of all sent emails
+                     in same batch. All emails of same batch are grouped by
+                     `callback`.
+    :param callback_arg: argument passed to `callback`.
+    """
+    now = int(time.time())
+
+    if key:
+        with _notified_lock:
+            __purge_notified(now)
+
+            if _notified.get(key, 0) > now:
+                logger.debug('Notification email was already sent or queued, skipped: {}'.format(subject))
+                return False
+
+            _notified[key] = expire_time
+
+    item = {
+        'subject': subject,
+        'mail_body': mail_body,
+        'key': key,
+        'callback': callback,
+        'callback_arg': callback_arg,
+    }
+
+    try:
+        _queue.put_nowait(item)
+    except queue.Full:
+        logger.warning('Notification queue is full, dropped email: {}'.format(subject))
+
+        if key:
+            with _notified_lock:
+                _notified.pop(key, None)
+
+        return False
+
+    __start_worker()
+    return True
@@ -320,6 +320,45 @@ def execute_sql(engine: Engine, sql: str, params=None):
             return conn.execute(sql, params or {})
 
 
+def get_sql_checksum_expr(columns):
+    """Return SQL expression of sum of a hash of given columns of each row.
+
+    It doesn't depend on order of rows, used to detect changes (including
+    updated rows) of a SQL table with one aggregate query.
+    """
+    _concat = "CONCAT_WS(':', {})".format(', '.join(columns))
+
+    if settings.backend == 'pgsql':
+        return 'SUM(hashtext({}))'.format(_concat)
+    else:
+        return 'SUM(CRC32({}))'.format(_concat)
+
+
+def get_sql_upsert_clause(unique_columns, update_columns):
+    """Return SQL clause appended to `INSERT INTO ... VALUES (...)` statement,
+    it updates given columns if record with same unique key already exists.
+
+    :param unique_columns: list of columns of the primary key or unique index.
+    :param update_columns: list of columns to update.
+    """
+    if settings.backend == 'pgsql':
+        return 'ON CONFLICT ({}) DO UPDATE SET {}'.format(
+            ', '.join(unique_columns),
+            ', '.join(['{0}=EXCLUDED.{0}'.format(c) for c in update_columns]))
+    else:
+        return 'ON DUPLICATE KEY UPDATE {}'.format(
+            ', '.join(['{0}=VALUES({0})'.format(c) for c in update_columns]))
+
+
+def sql_binary_literal(value: bytes) -> str:
+    """Return SQL literal of binary string, used with column type
+    `BINARY` (MySQL/MariaDB) or `BYTEA` (PostgreSQL)."""
+    if settings.backend == 'pgsql':
+        return "decode('%s', 'hex')" % value.hex()
+    else:
+        return "X'%s'" % value.hex()
+
+
 def wildcard_ipv4(s):
     ips = []
     if is_ipv4(s):
@@ -657,30 +696,14 @@ def sendmail_with_cmd(from_address, recipients, message_text):
         return (False, repr(e))
 
 
-def sendmail(subject, mail_body, from_address=None, recipients=None):
-    """Send email through smtp or with command `sendmail`.
+def compose_mail(subject, mail_body, recipients):
+    """Generate mail message used to send notification email, returns the
+    full email as a string.
 
     :param subject: mail subject.
     :param mail_body: plain mail body.
-    :param from_address: the address specified in `From:` header.
     :param recipients: a list/set/tuple of recipient email addresses.
     """
-    server = settings.NOTIFICATION_SMTP_SERVER
-    port = settings.NOTIFICATION_SMTP_PORT
-    user = settings.NOTIFICATION_SMTP_USER
-    password = settings.NOTIFICATION_SMTP_PASSWORD
-    starttls = settings.NOTIFICATION_SMTP_STARTTLS
-    debug_level = settings.NOTIFICATION_SMTP_DEBUG_LEVEL
-
-    if not from_address:
-        from_address = user
-
-    if not recipients:
-        recipients = settings.NOTIFICATION_RECIPIENTS
-
-    #
-    # Generate mail message
-    #
     msg = MIMEMultipart('alternative')
 
     _smtp_sender = settings.NOTIFICATION_SMTP_USER
@@ -698,21 +721,64 @@ def sendmail(subject, mail_body, from_address=None, recipients=None):
     msg_body_plain = MIMEText(mail_body, 'plain', 'utf-8')
     msg.attach(msg_body_plain)
 
+    return msg.as_string()
+
+
+def get_notification_smtp_conn():
+    """Connect and login to smtp server defined in `NOTIFICATION_SMTP_*`.
+
+    Returns `smtplib.SMTP` instance, or None if smtp server is not
+    configured (email should be sent with command `sendmail` instead).
+    """
+    server = settings.NOTIFICATION_SMTP_SERVER
+    port = settings.NOTIFICATION_SMTP_PORT
+    user = settings.NOTIFICATION_SMTP_USER
+    password = settings.NOTIFICATION_SMTP_PASSWORD
+    starttls = settings.NOTIFICATION_SMTP_STARTTLS
+    debug_level = settings.NOTIFICATION_SMTP_DEBUG_LEVEL
+
+    if not (server and port and user and password):
+        return None
+
+    s = smtplib.SMTP(server, port)
+    s.set_debuglevel(debug_level)
+
+    if starttls:
+        s.ehlo()
+        s.starttls()
+        s.ehlo()
+
+    s.login(user, password)
+    return s
+
+
+def sendmail(subject, mail_body, from_address=None, recipients=None):
+    """Send email through smtp or with command `sendmail`.
+
+    :param subject: mail subject.
+    :param mail_body: plain mail body.
+    :param from_address: the address specified in `From:` header.
+    :param recipients: a list/set/tuple of recipient email addresses.
+    """
+    if not from_address:
+        from_address = settings.NOTIFICATION_SMTP_USER
+
+    if not recipients:
+        recipients = settings.NOTIFICATION_RECIPIENTS
+
     # Get full email as a string.
-    message_text = msg.as_string()
+    message_text = compose_mail(subject=subject,
+                                mail_body=mail_body,
+                                recipients=recipients)
+
+    try:
+        s = get_notification_smtp_conn()
+    except Exception as e:
+        return (False, repr(e))
 
-    if server and port and user and password:
+    if s:
         # Send email through standard smtp protocol
         try:
-            s = smtplib.SMTP(server, port)
-            s.set_debuglevel(debug_level)
-
-            if starttls:
-                s.ehlo()
-                s.starttls()
-                s.ehlo()
-
-            s.login(user, password)
             s.sendmail(from_address, recipients, message_text)
             s.quit()
             return (True, )
@@ -858,9 +924,19 @@ def bytes2str(b: Union[bytes, str, List, Tuple, Set, Dict])\
     return s
 
 
+# Shared DNS resolver, created by `get_dns_resolver()`.
+_dns_resolver = None
+
+
 def get_dns_resolver():
-    resv = resolver.Resolver()
-    resv.timeout = settings.DNS_QUERY_TIMEOUT
-    resv.lifetime = settings.DNS_QUERY_TIMEOUT
+    """Return the shared DNS resolver, `/etc/resolv.conf` is read only once."""
+    global _dns_resolver
+
+    if _dns_resolver is None:
+        resv = resolver.Resolver()
+        resv.timeout = settings.DNS_QUERY_TIMEOUT
+        resv.lifetime = settings.DNS_QUERY_TIMEOUT
+
+        _dns_resolver = resv
 
-    return resv
+    return _dns_resolver
@@ -1,8 +1,111 @@
 # Used by plugin: amavisd_wblist
 
+import ipaddress
 from web import sqlquote
 from libs import utils
 from libs.logger import logger
+from libs.cache import SQLTableCache
+from libs.ipindex import IPNetworkIndex
+
+
+class AddressCache(SQLTableCache):
+    """Addresses stored in SQL table `users` or `mailaddr`.
+
+    Data structure:
+
+        {
+            'addresses': {<email>: (<id>, <priority>)},
+            'networks': <IPNetworkIndex of CIDR networks, value is (<id>, <priority>)>,
+        }
+    """
+    sql_columns = ['id', 'email', 'priority']
+    sql_checksum_columns = sql_columns
+
+    def __init__(self, sql_table, sql_where=None, **kwargs):
+        self.sql_table = sql_table
+        self.sql_where = sql_where
+        SQLTableCache.__init__(self, **kwargs)
+
+    def new_data(self):
+        return {'addresses': {}, 'networks': IPNetworkIndex()}
+
+    def add_row(self, data, row):
+        (_id, email, priority) = row
+        email = utils.bytes2str(email)
+        _v = (int(_id), int(priority or 0))
+
+        if '/' in email:
+            try:
+                data['networks'].add(ipaddress.ip_network(email), _v)
+            except ValueError:
+                pass
+        else:
+            data['addresses'][email] = _v
+
+
+class WblistCache(SQLTableCache):
+    """White/blacklists stored in SQL table `wblist` or `outbound_wblist`.
+
+    Data structure: {<rid>: {<sid>: <wb>}}
+
+    Table has no `id` column, changes are detected with number of rows and
+    sum of hashes of all rows (order-independent).
+    """
+    sql_columns = ['rid', 'sid', 'wb']
+    sql_where = "wb IN ('W', 'B')"
+    sql_checksum_columns = sql_columns
+    incremental = False
+
+    def __init__(self, sql_table, **kwargs):
+        self.sql_table = sql_table
+        SQLTableCache.__init__(self, **kwargs)
+
+    def _get_signature(self, engine, sql_where=None):
+        sql = "SELECT COUNT(*), {} FROM {}".format(utils.get_sql_checksum_expr(self.sql_checksum_columns),
+                                                   self.sql_table)
+        sql += self._get_sql_where(sql_where)
+
+        qr = utils.execute_sql(engine, sql)
+        return tuple(int(i or 0) for i in qr.fetchone())
+
+    def new_data(self):
+        return {}
+
+    def add_row(self, data, row):
+        (rid, sid, wb) = row
+        data.setdefault(int(rid), {})[int(sid)] = utils.bytes2str(wb)
+
+
+def get_ids_in_cache(data, addresses):
+    """Return list of id of given addresses, ordered by priority."""
+    _addresses = data['addresses']
+    records = [_addresses[i] for i in addresses if i in _addresses]
+    records.sort(key=lambda r: r[1], reverse=True)
+    return [r[0] for r in records]
+
+
+def get_id_of_cidr_networks_in_cache(data, client_address):
+    """Return list of id of CIDR networks which contain given IP address,
+    ordered by priority."""
+    records = data['networks'].lookup_all(client_address)
+    records.sort(key=lambda r: r[1], reverse=True)
+    return [r[0] for r in records]
+
+
+def get_wblist_in_cache(data, sender_ids, recipient_ids):
+    """Return set of (rid, sid, wb) of given sender and recipient ids."""
+    wblists = set()
+    for rid in recipient_ids:
+        _wb = data.get(rid)
+        if not _wb:
+            continue
+
+        for sid in sender_ids:
+            wb = _wb.get(sid)
+            if wb:
+                wblists.add((rid, sid, wb))
+
+    return wblists
 
 
 def create_mailaddr(engine_amavisd, addresses) -> bool:
@@ -467,3 +570,84 @@ def get_account_outbound_wblist(engine_amavisd,
         return (False, e)
 
     return (True, {'whitelist': wl, 'blacklist': bl})
+
+
+def get_mailaddr_ids(engine_amavisd, addresses, create_if_missing=True):
+    """Return dict of `mailaddr.id` of given addresses: {<email>: <id>}.
+
+    Missing addresses are inserted with one multi-row INSERT if
+    `create_if_missing=True`.
+    """
+    ids = {}
+    if not addresses:
+        return ids
+
+    sql = "SELECT id, email FROM mailaddr WHERE email IN %s" % sqlquote(list(addresses))
+    qr = utils.execute_sql(engine_amavisd, sql)
+    for (_id, _email) in qr.fetchall():
+        ids[utils.bytes2str(_email)] = int(_id)
+
+    missing = [i for i in addresses if i not in ids]
+    if not (missing and create_if_missing):
+        return ids
+
+    _values = []
+    for addr in missing:
+        addr_type = utils.is_valid_amavisd_address(addr)
+        if addr_type in utils.MAILADDR_PRIORITIES:
+            _values.append("(%s, %d)" % (sqlquote(addr), utils.MAILADDR_PRIORITIES[addr_type]))
+
+    if _values:
+        sql = "INSERT INTO mailaddr (email, priority) VALUES %s %s" % (
+            ', '.join(_values),
+            utils.get_sql_upsert_clause(['email'], ['priority']))
+        utils.execute_sql(engine_amavisd, sql)
+
+        ids.update(get_mailaddr_ids(engine_amavisd, missing, create_if_missing=False))
+
+    return ids
+
+
+def import_wblist(engine_amavisd, user_id, addresses, wb='W', outbound=False):
+    """Import white/blacklists for account with given `users.id`.
+
+    It's used to import a large amount of addresses in chunks, each chunk
+    is imported with one multi-row INSERT statement, existing records of
+    same address are replaced.
+
+    user_id -- `users.id` of local account
+    addresses -- list of sender (inbound) or recipient (outbound) addresses
+    wb -- 'W' for whitelist, 'B' for blacklist
+    outbound -- import outbound white/blacklists
+
+    Returns (True, <number of imported addresses>) or (False, <error>).
+    """
+    addresses = {str(i).lower() for i in addresses
+                 if utils.is_valid_amavisd_address(i)}
+
+    if not addresses:
+        return (True, 0)
+
+    try:
+        ids = get_mailaddr_ids(engine_amavisd, addresses)
+        if not ids:
+            return (True, 0)
+
+        if outbound:
+            # user_id = outbound_wblist.sid
+            table = 'outbound_wblist'
+            _values = ["(%d, %d, '%s')" % (user_id, i, wb) for i in ids.values()]
+        else:
+            # user_id = wblist.rid
+            table = 'wblist'
+            _values = ["(%d, %d, '%s')" % (i, user_id, wb) for i in ids.values()]
+
+        sql = "INSERT INTO %s (sid, rid, wb) VALUES %s %s" % (
+            table,
+            ', '.join(_values),
+            utils.get_sql_upsert_clause(['rid', 'sid'], ['wb']))
+        utils.execute_sql(engine_amavisd, sql)
+
+        return (True, len(ids))
+    except Exception as e:
+        return (False, repr(e))
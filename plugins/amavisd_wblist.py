@@ -44,10 +44,10 @@
 #                   'WBLIST_ENABLE_ALL_WILDCARD_IP = True' in
 #                   /opt/iredapd/settings.py.
 
-import ipaddress
 from web import sqlquote
 from libs.logger import logger
 from libs import SMTP_ACTIONS, utils
+from libs import wblist
 import settings  # type: ignore
 
 SMTP_PROTOCOL_STATE = ["RCPT"]
@@ -64,56 +64,58 @@ if settings.WBLIST_DISCARD_INSTEAD_OF_REJECT:
 else:
     reject_action = SMTP_ACTIONS["reject_blacklisted"]
 
+# Keep SQL tables `users`, `mailaddr`, `wblist` and `outbound_wblist` in
+# memory if `AMAVISD_WBLIST_IN_MEMORY = True`.
+_caches = {}
+if settings.AMAVISD_WBLIST_IN_MEMORY:
+    _caches = {
+        "users": wblist.AddressCache(sql_table="users",
+                                     check_interval=settings.AMAVISD_WBLIST_CACHE_CHECK_INTERVAL),
+        "mailaddr": wblist.AddressCache(sql_table="mailaddr",
+                                        check_interval=settings.AMAVISD_WBLIST_CACHE_CHECK_INTERVAL),
+        "wblist": wblist.WblistCache(sql_table="wblist",
+                                     check_interval=settings.AMAVISD_WBLIST_CACHE_CHECK_INTERVAL),
+        "outbound_wblist": wblist.WblistCache(sql_table="outbound_wblist",
+                                              check_interval=settings.AMAVISD_WBLIST_CACHE_CHECK_INTERVAL),
+    }
+
+
+# CIDR networks stored in SQL table `mailaddr`, used if whole table is not
+# kept in memory. Note: the WHERE clause can not use index, whole table is
+# scanned every `AMAVISD_WBLIST_CACHE_CHECK_INTERVAL` seconds.
+_cidr_networks = None
+if not settings.AMAVISD_WBLIST_IN_MEMORY:
+    _cidr_networks = wblist.AddressCache(sql_table="mailaddr",
+                                         sql_where="POSITION('/' IN email) > 0",
+                                         check_interval=settings.AMAVISD_WBLIST_CACHE_CHECK_INTERVAL)
+
+
+def _get_cached_data(engine_amavisd, name):
+    """Return cached data of given SQL table, or None if it's not cached."""
+    if name in _caches:
+        return _caches[name].get(engine_amavisd)
+
+    return None
+
 
 def get_id_of_possible_cidr_network(engine_amavisd, client_address):
-    """Return list of `mailaddr.id` which are CIDR network addresses."""
+    """Return list of `mailaddr.id` of CIDR networks which contain client
+    address, ordered by priority."""
     ids = []
 
     if not client_address:
         logger.debug("No client address.")
         return ids
 
-    try:
-        _ip = ipaddress.ip_address(client_address)
-        if _ip.version == 4:
-            first_field = client_address.split(".")[0]
-            sql_cidr = first_field + r".%%"
-        else:
-            return ids
-    except:
-        return ids
-
-    sql = """SELECT id, email
-               FROM mailaddr
-              WHERE email LIKE %s
-           ORDER BY priority DESC""" % sqlquote(sql_cidr)
-    logger.debug("[SQL] Query CIDR network: \n{}".format(sql))
+    if _cidr_networks:
+        data = _cidr_networks.get(engine_amavisd)
+    else:
+        data = _get_cached_data(engine_amavisd, "mailaddr")
 
-    try:
-        qr = utils.execute_sql(engine_amavisd, sql)
-        qr_cidr = qr.fetchall()
-    except Exception as e:
-        logger.error("Error while querying CIDR network: {}, SQL: \n{}".format(repr(e), sql))
+    if data is None:
         return ids
 
-    if qr_cidr:
-        _cidrs = [(int(r.id), utils.bytes2str(r.email)) for r in qr_cidr]
-
-        # Get valid CIDR.
-        _ip_networks = set()
-        for (_id, _cidr) in _cidrs:
-            # Verify whether client_address is in CIDR network
-            try:
-                _net = ipaddress.ip_network(_cidr)
-                _ip_networks.add((_id, _net))
-            except:
-                pass
-
-        if _ip_networks:
-            _ip = ipaddress.ip_address(client_address)
-            for (_id, _net) in _ip_networks:
-                if _ip in _net:
-                    ids.append(_id)
+    ids = wblist.get_id_of_cidr_networks_in_cache(data, client_address)
 
     logger.debug("IDs of CIDR network(s): {}".format(ids))
     return ids
@@ -127,6 +129,10 @@ def get_id_of_external_addresses(engine_amavisd, addresses):
         logger.debug("No addresses, return empty list of ids.")
         return ids
 
+    data = _get_cached_data(engine_amavisd, "mailaddr")
+    if data is not None:
+        return wblist.get_ids_in_cache(data, addresses)
+
     # Get `mailaddr.id` of external addresses, ordered by priority
     sql = """SELECT id, email
                FROM mailaddr
@@ -155,6 +161,9 @@ def get_id_of_external_addresses(engine_amavisd, addresses):
 
 def get_id_of_local_addresses(engine_amavisd, addresses):
     """Return list of `users.id` of local addresses."""
+    data = _get_cached_data(engine_amavisd, "users")
+    if data is not None:
+        return wblist.get_ids_in_cache(data, addresses)
 
     # Get `users.id` of local addresses
     sql = """SELECT id, email
@@ -188,13 +197,17 @@ def apply_inbound_wblist(engine_amavisd, client_address, sender_ids, recipient_i
         return SMTP_ACTIONS["default"]
 
     # Get wblist
-    sql = """SELECT rid, sid, wb
-               FROM wblist
-              WHERE sid IN %s
-                AND rid IN %s""" % (sqlquote(sender_ids), sqlquote(recipient_ids))
-    logger.debug("[SQL] Query inbound wblist (in `wblist`): \n{}".format(sql))
-    qr = utils.execute_sql(engine_amavisd, sql)
-    wblists = qr.fetchall()
+    data = _get_cached_data(engine_amavisd, "wblist")
+    if data is not None:
+        wblists = wblist.get_wblist_in_cache(data, sender_ids, recipient_ids)
+    else:
+        sql = """SELECT rid, sid, wb
+                   FROM wblist
+                  WHERE sid IN %s
+                    AND rid IN %s""" % (sqlquote(sender_ids), sqlquote(recipient_ids))
+        logger.debug("[SQL] Query inbound wblist (in `wblist`): \n{}".format(sql))
+        qr = utils.execute_sql(engine_amavisd, sql)
+        wblists = qr.fetchall()
 
     if not wblists:
         # no wblist
@@ -231,13 +244,17 @@ def apply_outbound_wblist(engine_amavisd, sender_ids, recipient_ids):
         return SMTP_ACTIONS["default"]
 
     # Get wblist
-    sql = """SELECT rid, sid, wb
-               FROM outbound_wblist
-              WHERE sid IN %s
-                AND rid IN %s""" % (sqlquote(sender_ids), sqlquote(recipient_ids))
-    logger.debug("[SQL] Query outbound wblist: \n{}".format(sql))
-    qr = utils.execute_sql(engine_amavisd, sql)
-    wblists = qr.fetchall()
+    data = _get_cached_data(engine_amavisd, "outbound_wblist")
+    if data is not None:
+        wblists = wblist.get_wblist_in_cache(data, sender_ids, recipient_ids)
+    else:
+        sql = """SELECT rid, sid, wb
+                   FROM outbound_wblist
+                  WHERE sid IN %s
+                    AND rid IN %s""" % (sqlquote(sender_ids), sqlquote(recipient_ids))
+        logger.debug("[SQL] Query outbound wblist: \n{}".format(sql))
+        qr = utils.execute_sql(engine_amavisd, sql)
+        wblists = qr.fetchall()
 
     if not wblists:
         # no wblist
@@ -0,0 +1,184 @@
+# Author: Zhang Huangbin <zhb _at_ iredmail.org>
+# Purpose: Lookup client IP address in multiple DNSBL/DNSWL zones.
+#
+#          All zones are queried concurrently within a time budget
+#          (`DNSBL_TIME_BUDGET`), score of client IP address is the sum of
+#          weights of the zones which list it (DNSWL zones should have
+#          negative weight). If score equals to or is larger than
+#          `DNSBL_REJECT_SCORE`, email will be rejected.
+#
+#          Sample settings in /opt/iredapd/settings.py:
+#
+#           DNSBL_ZONES = {
+#               'zen.spamhaus.org': 10,
+#               'bl.spamcop.net': 5,
+#               # Only count answer `127.0.0.2`.
+#               'b.barracudacentral.org=127.0.0.2': 5,
+#               # DNSWL
+#               'list.dnswl.org': -10,
+#           }
+#           DNSBL_REJECT_SCORE = 10
+
+import time
+import ipaddress
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from dns import resolver
+
+from libs.logger import logger
+from libs import SMTP_ACTIONS
+from libs import utils
+from libs import dnscache
+from libs.cache import LRUCache
+
+import settings  # type: ignore
+
+reject_score = settings.DNSBL_REJECT_SCORE
+
+# Results of client addresses: {<client_address>: (<score>, [<listed_zone>, ...])}
+_results = LRUCache(max_size=settings.DNSBL_CACHE_SIZE)
+
+# Thread pool used to query zones concurrently, created on first use (after
+# iRedAPD forked).
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.DNSBL_WORKERS,
+                                               thread_name_prefix='dnsbl')
+
+    return _executor
+
+
+def _get_zones():
+    """Return a list of (zone, required answer or None, weight)."""
+    zones = []
+    for (k, weight) in settings.DNSBL_ZONES.items():
+        if '=' in k:
+            (zone, answer) = k.split('=', 1)
+        else:
+            (zone, answer) = (k, None)
+
+        zones.append((zone.strip('.'), answer, weight))
+
+    return zones
+
+
+def _query_zone(reversed_ip, zone, answer):
+    """Return a tuple of (listed, ttl)."""
+    try:
+        qr = dnscache.query(reversed_ip + '.' + zone, 'A', lifetime=settings.DNSBL_TIME_BUDGET)
+        ttl = max(0, int(qr.expiration - time.time()))
+
+        for r in qr:
+            _ip = str(r)
+
+            # 127.255.255.x are error codes (e.g. query via public DNS
+            # resolver), not listed.
+            if not _ip.startswith('127.') or _ip.startswith('127.255.255.'):
+                continue
+
+            if answer is None or _ip == answer:
+                return (True, ttl)
+
+        return (False, ttl)
+    except (resolver.NoAnswer, resolver.NXDOMAIN):
+        return (False, settings.DNS_NEGATIVE_CACHE_TTL)
+
+
+def get_score(client_address):
+    """Query all zones concurrently, return a tuple of (score, listed zones).
+
+    Zones which didn't answer within `DNSBL_TIME_BUDGET` seconds are
+    ignored.
+    """
+    cached = _results.get(client_address)
+    if cached is not None:
+        return cached
+
+    _ip = ipaddress.ip_address(client_address)
+    reversed_ip = _ip.reverse_pointer.rsplit('.', 2)[0]
+
+    zones = _get_zones()
+    executor = _get_executor()
+    futures = {executor.submit(_query_zone, reversed_ip, zone, answer): (zone, weight)
+               for (zone, answer, weight) in zones}
+
+    (done, not_done) = wait(futures, timeout=settings.DNSBL_TIME_BUDGET)
+
+    score = 0
+    listed = []
+    ttl = settings.DNS_CACHE_MAX_TTL
+
+    for f in done:
+        (zone, weight) = futures[f]
+        try:
+            (_listed, _ttl) = f.result()
+        except Exception as e:
+            logger.debug("[{}] dnsbl -> {}: error: {}".format(client_address, zone, repr(e)))
+            ttl = 0
+            continue
+
+        ttl = min(ttl, _ttl)
+        if _listed:
+            score += weight
+            listed.append(zone)
+
+    if not_done:
+        logger.info("[{}] dnsbl -> no answer in {} seconds: {}".format(
+            client_address,
+            settings.DNSBL_TIME_BUDGET,
+            ', '.join(sorted(futures[f][0] for f in not_done))))
+        ttl = 0
+
+    result = (score, sorted(listed))
+
+    # Don't cache incomplete result.
+    _results.set(client_address, result, ttl=ttl)
+
+    return result
+
+
+def restriction(**kwargs):
+    # Bypass outgoing emails.
+    if kwargs['sasl_username']:
+        logger.debug('Found SASL username, bypass dnsbl checking.')
+        return SMTP_ACTIONS['default']
+
+    client_address = kwargs["client_address"]
+
+    if utils.is_trusted_client(client_address):
+        logger.debug('Client address is trusted, bypass dnsbl checking.')
+        return SMTP_ACTIONS['default']
+
+    try:
+        if not ipaddress.ip_address(client_address).is_global:
+            logger.debug('Client address is not a public IP address, bypass dnsbl checking.')
+            return SMTP_ACTIONS['default']
+    except ValueError:
+        return SMTP_ACTIONS['default']
+
+    if not settings.DNSBL_ZONES:
+        return SMTP_ACTIONS['default']
+
+    (score, listed) = get_score(client_address)
+
+    sender_domain = kwargs["sasl_username_domain"] or kwargs["sender_domain"]
+
+    log_msg = "[{}] [{}] dnsbl score: {}".format(client_address, sender_domain, score)
+    if listed:
+        log_msg += " (listed in: {})".format(', '.join(listed))
+
+    if score >= reject_score:
+        log_msg += " [REJECT (>= {})]".format(reject_score)
+        logger.info(log_msg)
+        return SMTP_ACTIONS["reject_dnsbl"] + ', '.join(listed)
+
+    logger.info(log_msg)
+    return SMTP_ACTIONS["default"]
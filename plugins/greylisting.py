@@ -12,12 +12,16 @@
 """
 
 import time
+import atexit
+import threading
 import ipaddress
 
 from web import sqlquote
 from libs.logger import logger
 from libs import SMTP_ACTIONS, ACCOUNT_PRIORITIES
-from libs import utils, dnsspf
+from libs import utils, dnsspf, cleanup
+from libs import greylisting as lib_gl
+from libs.cache import LRUCache
 import settings  # pyright: ignore[reportMissingImports]
 
 if settings.backend == 'ldap':
@@ -28,6 +32,96 @@ else:
 # Return 4xx with greylisting message to Postfix.
 action_greylisting = SMTP_ACTIONS['greylisting'] + ' ' + settings.GREYLISTING_MESSAGE
 
+# In-memory greylisting whitelists.
+_whitelist_caches = []
+if settings.GREYLISTING_CACHE_WHITELISTS:
+    _whitelist_caches = [
+        lib_gl.WhitelistCache(sql_table=tbl,
+                              check_interval=settings.GREYLISTING_CACHE_CHECK_INTERVAL)
+        for tbl in ['greylisting_whitelist_domain_spf', 'greylisting_whitelists']
+    ]
+
+
+# In-memory greylisting settings.
+_setting_cache = None
+if settings.GREYLISTING_CACHE_SETTINGS:
+    _setting_cache = lib_gl.SettingCache(check_interval=settings.GREYLISTING_CACHE_CHECK_INTERVAL)
+
+
+# Client addresses which passed greylisting.
+# {<client_address>: [<expire_at>, <last_sql_update_time>]}
+_passed_clients = LRUCache(max_size=settings.GREYLISTING_PASSED_CLIENTS_CACHE_SIZE)
+
+# Buffered updates of non-decision fields, flushed in batches by
+# `_flush_pending_updates()`.
+#
+# Increments of `greylisting_tracking.blocked_count`.
+# {(<sender>, <recipient>, <client_address>): <increment>}
+_pending_blocked_counts = {}
+
+# Passed clients which should have expire time extended.
+_pending_passed_clients = set()
+
+# Lock of pending updates, they're also updated or flushed by background
+# threads.
+_pending_lock = threading.Lock()
+
+_pending_last_flush = time.time()
+
+# Engine used to flush pending updates in background thread and while
+# exiting.
+_pending_engine = None
+
+# Thread which flushes pending updates periodically, so that they're not
+# delayed if there's no new policy request. Started on first use (after
+# iRedAPD forked).
+_flush_thread = None
+
+# Whether column `greylisting_tracking.triplet_hash` exists, checked on first
+# use. Hash is always stored if column exists, even if
+# `GREYLISTING_TRACKING_HASHED_KEY` is disabled, so that no record without
+# hash is created while migrating.
+_has_triplet_hash_column = None
+
+# Whether some tracking records don't have hash yet (created before hashed
+# key was enabled). Checked every `_HASH_MIGRATION_CHECK_INTERVAL` seconds
+# until all records have hash, no record without hash is created after
+# that, so it's not checked anymore.
+_tracking_without_hash = None
+_tracking_without_hash_check_time = 0
+_HASH_MIGRATION_CHECK_INTERVAL = 60
+
+
+def _is_whitelisted_in_cache(engine_iredapd,
+                             senders,
+                             recipients,
+                             client_address,
+                             ip_object):
+    """Check in-memory greylisting whitelists, returns True, False, or None
+    if whitelists are not (successfully) loaded."""
+    for c in _whitelist_caches:
+        data = c.get(engine_iredapd)
+        if data is None:
+            return None
+
+        (_matched, _wl) = lib_gl.is_whitelisted_in_cache(data=data,
+                                                         senders=senders,
+                                                         recipients=recipients,
+                                                         ip_object=ip_object)
+
+        if _matched:
+            if _wl == client_address:
+                logger.info('[%s] Client IP is explictly whitelisted for greylisting service.' % (client_address))
+            elif '/' in _wl:
+                logger.info('[{}] Client network is whitelisted: cidr={}'.format(client_address, _wl))
+            else:
+                logger.info('[{}] Sender address is explictly whitelisted for greylisting service: {}'.format(client_address, _wl))
+
+            return True
+
+    logger.debug('No whitelist found.')
+    return False
+
 
 def _is_whitelisted(engine_iredapd,
                     senders,
@@ -44,6 +138,14 @@ def _is_whitelisted(engine_iredapd,
     @client_address -- client IP address
     @ip_object -- object of IP address type (get by ipaddress.ip_address())
     """
+    if _whitelist_caches:
+        _result = _is_whitelisted_in_cache(engine_iredapd=engine_iredapd,
+                                           senders=senders,
+                                           recipients=recipients,
+                                           client_address=client_address,
+                                           ip_object=ip_object)
+        if _result is not None:
+            return _result
 
     whitelists = set()
 
@@ -104,23 +206,217 @@ def _is_whitelisted(engine_iredapd,
     return False
 
 
-def _client_address_passed_in_tracking(engine_iredapd, client_address):
-    sql = """SELECT id
-               FROM greylisting_tracking
-              WHERE client_address=%s AND passed=1
-              LIMIT 1""" % sqlquote(client_address)
+def _client_address_passed(engine_iredapd, client_address):
+    """Check whether client address passed greylisting (in memory, or SQL
+    table `greylisting_passed_clients`), and extend its expire time."""
+    now = int(time.time())
+    new_expire_at = now + settings.GREYLISTING_AUTH_TRIPLET_EXPIRE * 24 * 60 * 60
 
-    logger.debug('[SQL] check whether client address ({}) passed greylisting: \n{}'.format(client_address, sql))
-    qr = utils.execute_sql(engine_iredapd, sql)
-    sql_record = qr.fetchone()
+    _v = _passed_clients.get(client_address)
+    if not _v:
+        sql = """SELECT expire_at
+                   FROM greylisting_passed_clients
+                  WHERE client_address=%s
+                  LIMIT 1""" % sqlquote(client_address)
+
+        logger.debug('[SQL] check whether client address ({}) passed greylisting: \n{}'.format(client_address, sql))
+        qr = utils.execute_sql(engine_iredapd, sql)
+        sql_record = qr.fetchone()
 
-    if sql_record:
-        logger.debug('Client address (%s) passed greylisting.' % client_address)
+        if not sql_record or int(sql_record[0]) < now:
+            logger.debug("Client address (%s) didn't pass greylisting." % client_address)
+            return False
+
+        # [<expire_at>, <last_sql_update_time>]
+        _v = [int(sql_record[0]), now]
+
+    logger.debug('Client address (%s) passed greylisting.' % client_address)
+
+    # Extend expire time. Update SQL record at most once in
+    # GREYLISTING_PASSED_CLIENT_UPDATE_INTERVAL seconds.
+    _v[0] = new_expire_at
+    _passed_clients.set(client_address, _v, ttl=new_expire_at - now)
+    if now - _v[1] >= settings.GREYLISTING_PASSED_CLIENT_UPDATE_INTERVAL:
+        _v[1] = now
+        with _pending_lock:
+            _pending_passed_clients.add(client_address)
+
+    return True
+
+
+def _tracking_has_triplet_hash(engine_iredapd):
+    global _has_triplet_hash_column
+
+    if settings.GREYLISTING_TRACKING_HASHED_KEY:
         return True
-    else:
-        logger.debug("Client address (%s) didn't pass greylisting." % client_address)
+
+    if _has_triplet_hash_column is None:
+        sql = """SELECT triplet_hash FROM greylisting_tracking LIMIT 0"""
+        try:
+            utils.execute_sql(engine_iredapd, sql)
+            _has_triplet_hash_column = True
+        except Exception:
+            _has_triplet_hash_column = False
+
+    return _has_triplet_hash_column
+
+
+def _tracking_has_records_without_hash(engine_iredapd):
+    global _tracking_without_hash, _tracking_without_hash_check_time
+
+    if _tracking_without_hash is False:
         return False
 
+    now = time.time()
+    if _tracking_without_hash is None \
+       or (now - _tracking_without_hash_check_time) >= _HASH_MIGRATION_CHECK_INTERVAL:
+        _tracking_without_hash_check_time = now
+
+        sql = """SELECT id FROM greylisting_tracking WHERE triplet_hash IS NULL LIMIT 1"""
+        try:
+            qr = utils.execute_sql(engine_iredapd, sql)
+            _tracking_without_hash = bool(qr.fetchone())
+        except Exception as e:
+            logger.error('Error while checking greylisting tracking records without hash: %s' % repr(e))
+            return True
+
+        if not _tracking_without_hash:
+            logger.info('All greylisting tracking records have hash now.')
+
+    return _tracking_without_hash
+
+
+def _flush_pending_updates(engine_iredapd, force=False):
+    """Write buffered updates to SQL database if there're too many pending
+    updates, or last flush was long ago."""
+    global _pending_last_flush, _pending_engine
+
+    _pending_engine = engine_iredapd
+
+    if not (_pending_blocked_counts or _pending_passed_clients):
+        return None
+
+    now = time.time()
+    if not force \
+       and (now - _pending_last_flush) < settings.GREYLISTING_FLUSH_INTERVAL \
+       and (len(_pending_blocked_counts) + len(_pending_passed_clients)) < settings.GREYLISTING_FLUSH_SIZE:
+        return None
+
+    _pending_last_flush = now
+
+    # Group triplets by increment, so that one UPDATE per increment.
+    # {<increment>: [<triplet>, ...]}
+    _triplets = {}
+    with _pending_lock:
+        for (k, v) in _pending_blocked_counts.items():
+            _triplets.setdefault(v, []).append(k)
+
+        _pending_blocked_counts.clear()
+
+        _clients = list(_pending_passed_clients)
+        _pending_passed_clients.clear()
+
+    for (_increment, _keys) in list(_triplets.items()):
+        for i in range(0, len(_keys), 500):
+            if settings.GREYLISTING_TRACKING_HASHED_KEY:
+                _values = ','.join([utils.sql_binary_literal(lib_gl.get_triplet_hash(*k))
+                                    for k in _keys[i:i + 500]])
+                _sql_where = 'triplet_hash IN (%s)' % _values
+            else:
+                _values = ','.join(['(%s, %s, %s)' % (sqlquote(k[0]), sqlquote(k[1]), sqlquote(k[2]))
+                                    for k in _keys[i:i + 500]])
+                _sql_where = '(sender, recipient, client_address) IN (%s)' % _values
+
+            sql = """UPDATE greylisting_tracking
+                        SET blocked_count=blocked_count + %d
+                      WHERE %s""" % (_increment, _sql_where)
+
+            logger.debug('[SQL] Update blocked count of tracking records: \n%s' % sql)
+            try:
+                utils.execute_sql(engine_iredapd, sql)
+            except Exception as e:
+                logger.error('Error while updating greylisting tracking: %s' % repr(e))
+
+    # All passed clients seen since last flush get same new expire time.
+    _expire_at = int(now) + settings.GREYLISTING_AUTH_TRIPLET_EXPIRE * 24 * 60 * 60
+    # Insert missing records too, record may be removed by cleanup while its
+    # expire time was extended in memory only.
+    for i in range(0, len(_clients), 500):
+        sql = """INSERT INTO greylisting_passed_clients (client_address, expire_at)
+                      VALUES %s """ % ','.join(['(%s, %d)' % (sqlquote(c), _expire_at)
+                                                  for c in _clients[i:i + 500]])
+        sql += utils.get_sql_upsert_clause(unique_columns=['client_address'],
+                                           update_columns=['expire_at'])
+
+        logger.debug('[SQL] Update expire time of passed clients: \n%s' % sql)
+        try:
+            utils.execute_sql(engine_iredapd, sql)
+        except Exception as e:
+            logger.error('Error while updating expire time of passed clients: {}'.format(repr(e)))
+
+
+def __flush_pending_updates_at_exit():
+    if _pending_engine:
+        _flush_pending_updates(engine_iredapd=_pending_engine, force=True)
+
+
+# iRedAPD exits with `SystemExit` on SIGTERM, so it's called while stopping
+# the service.
+atexit.register(__flush_pending_updates_at_exit)
+
+
+def __flush_pending_updates_periodically():
+    while True:
+        time.sleep(max(settings.GREYLISTING_FLUSH_INTERVAL, 1))
+
+        try:
+            if _pending_engine:
+                _flush_pending_updates(engine_iredapd=_pending_engine)
+        except Exception as e:
+            logger.error('Error while flushing pending greylisting updates: {}'.format(repr(e)))
+
+
+def _start_flush_thread():
+    global _flush_thread
+
+    if _flush_thread is None:
+        _flush_thread = threading.Thread(target=__flush_pending_updates_periodically,
+                                         name='greylisting-flush',
+                                         daemon=True)
+        _flush_thread.start()
+
+
+def _invalidate_passed_clients(client_addresses):
+    """Called by background cleanup thread after expired passed clients
+    were removed from SQL table.
+
+    Client which is still cached in memory has its expire time extended
+    but not yet written to SQL, schedule an update to insert it again.
+    """
+    for client_address in client_addresses:
+        if _passed_clients.get(client_address):
+            with _pending_lock:
+                _pending_passed_clients.add(client_address)
+
+
+cleanup.register_invalidator('greylisting_passed_clients', _invalidate_passed_clients)
+
+
+def _add_passed_client(engine_iredapd, client_address, expire_at):
+    now = int(time.time())
+    _passed_clients.set(client_address, [expire_at, now], ttl=expire_at - now)
+
+    sql = """INSERT INTO greylisting_passed_clients (client_address, expire_at)
+                  VALUES (%s, %d) """ % (sqlquote(client_address), expire_at)
+    sql += utils.get_sql_upsert_clause(unique_columns=['client_address'],
+                                       update_columns=['expire_at'])
+
+    logger.debug('[SQL] Add passed client: \n%s' % sql)
+    try:
+        utils.execute_sql(engine_iredapd, sql)
+    except Exception as e:
+        logger.error('[{}] Error while adding passed client: {}'.format(client_address, repr(e)))
+
 
 def _should_be_greylisted_by_setting(engine_iredapd,
                                      recipients,
@@ -135,6 +431,27 @@ def _should_be_greylisted_by_setting(engine_iredapd,
     client_address -- client IP address
     ip_object   -- object of IP address type (get by ipaddress.ip_address())
     """
+    if _setting_cache:
+        data = _setting_cache.get(engine_iredapd)
+        if data is not None:
+            r = lib_gl.get_setting_in_cache(data=data,
+                                            senders=senders,
+                                            recipients=recipients,
+                                            ip_object=ip_object)
+            if not r:
+                logger.debug('No matched setting, fallback to turn off greylisting.')
+                return False
+
+            (_id, _account, _sender, _active) = r
+            if _active == 1:
+                logger.debug("Greylisting should be applied according to SQL "
+                             "record: (id={}, account='{}', sender='{}')".format(_id, _account, _sender))
+                return True
+            else:
+                logger.debug("Greylisting should NOT be applied according to "
+                             "SQL record: (id={}, account='{}', sender='{}')".format(_id, _account, _sender))
+                return False
+
     sql = """SELECT id, account, sender, sender_priority, active
                FROM greylisting
               WHERE account IN %s
@@ -204,21 +521,31 @@ def _should_be_greylisted_by_tracking(engine_iredapd,
     unauth_triplet_expire = now + int(settings.GREYLISTING_UNAUTH_TRIPLET_EXPIRE) * 24 * 60 * 60
     auth_triplet_expire = now + int(settings.GREYLISTING_AUTH_TRIPLET_EXPIRE) * 24 * 60 * 60
 
+    _sender = sender
+    _recipient = recipient
+
     sender = sqlquote(sender)
     recipient = sqlquote(recipient)
     recipient_domain = sqlquote(recipient_domain)
     client_address_sql = sqlquote(client_address)
 
+    triplet_hash_sql = utils.sql_binary_literal(lib_gl.get_triplet_hash(_sender, _recipient, client_address))
+
+    # SQL WHERE clause used to match the tracking record of this triplet.
+    sql_where_columns = 'sender=%s AND recipient=%s AND client_address=%s' % (sender, recipient, client_address_sql)
+    if settings.GREYLISTING_TRACKING_HASHED_KEY:
+        sql_where_triplet = 'triplet_hash=%s' % triplet_hash_sql
+    else:
+        sql_where_triplet = sql_where_columns
+
     #
     # Get existing tracking record
     #
     # Get passed IP address.
     sql = """SELECT init_time, blocked_count, block_expired, record_expired
                FROM greylisting_tracking
-              WHERE sender=%s
-                    AND recipient=%s
-                    AND client_address=%s
-              LIMIT 1""" % (sender, recipient, client_address_sql)
+              WHERE %s
+              LIMIT 1""" % sql_where_triplet
 
     logger.debug('[SQL] query greylisting tracking: \n%s' % sql)
     sql_record = None
@@ -228,22 +555,54 @@ def _should_be_greylisted_by_tracking(engine_iredapd,
     except Exception as e:
         logger.error('Error while querying greylisting tracking: {}. SQL: {}'.format(repr(e), sql))
 
+    if not sql_record \
+       and settings.GREYLISTING_TRACKING_HASHED_KEY \
+       and _tracking_has_records_without_hash(engine_iredapd):
+        # Record may be created before hashed key was enabled (or by an old
+        # iRedAPD) and doesn't have hash yet, look it up with 3 columns and
+        # fill up the hash.
+        sql = """SELECT init_time, blocked_count, block_expired, record_expired
+                   FROM greylisting_tracking
+                  WHERE %s AND triplet_hash IS NULL
+                  LIMIT 1""" % sql_where_columns
+
+        logger.debug('[SQL] query greylisting tracking without hash: \n%s' % sql)
+        try:
+            qr = utils.execute_sql(engine_iredapd, sql)
+            sql_record = qr.fetchone()
+        except Exception as e:
+            logger.error('Error while querying greylisting tracking: {}. SQL: {}'.format(repr(e), sql))
+
+        if sql_record:
+            sql = """UPDATE greylisting_tracking
+                        SET triplet_hash=%s
+                      WHERE %s AND triplet_hash IS NULL""" % (triplet_hash_sql, sql_where_columns)
+
+            logger.debug('[SQL] Fill up hash of greylisting tracking: \n%s' % sql)
+            try:
+                utils.execute_sql(engine_iredapd, sql)
+            except Exception as e:
+                logger.error('Error while filling up hash of greylisting tracking: %s' % repr(e))
+
     if not sql_record:
         # Not record found, insert a new one.
         logger.info('[{}] Client has not been seen before, greylisted ({}).'.format(client_address, sender_domain))
 
         sender_domain = sqlquote(sender_domain)
-        sql = """INSERT INTO greylisting_tracking (sender, sender_domain,
-                                                   recipient, rcpt_domain,
-                                                   client_address,
-                                                   init_time,
-                                                   block_expired, record_expired,
-                                                   blocked_count)
-                      VALUES (%s, %s, %s, %s, %s, %d, %d, %d, 1)""" % (sender, sender_domain,
-                                                                       recipient, recipient_domain,
-                                                                       client_address_sql,
-                                                                       now,
-                                                                       block_expired, unauth_triplet_expire)
+
+        _columns = 'sender, sender_domain, recipient, rcpt_domain, client_address, ' \
+                   'init_time, block_expired, record_expired, blocked_count'
+        _values = '%s, %s, %s, %s, %s, %d, %d, %d, 1' % (sender, sender_domain,
+                                                          recipient, recipient_domain,
+                                                          client_address_sql,
+                                                          now,
+                                                          block_expired, unauth_triplet_expire)
+
+        if _tracking_has_triplet_hash(engine_iredapd):
+            _columns += ', triplet_hash'
+            _values += ', ' + triplet_hash_sql
+
+        sql = """INSERT INTO greylisting_tracking (%s) VALUES (%s)""" % (_columns, _values)
         logger.debug('[SQL] New tracking: \n%s' % sql)
         try:
             utils.execute_sql(engine_iredapd, sql)
@@ -264,10 +623,7 @@ def _should_be_greylisted_by_tracking(engine_iredapd,
 
         sql = """UPDATE greylisting_tracking
                     SET blocked_count=1, init_time=%d, block_expired=%d, record_expired=%d
-                  WHERE     sender=%s
-                        AND recipient=%s
-                        AND client_address=%s""" % (now, block_expired, unauth_triplet_expire,
-                                                    sender, recipient, client_address_sql)
+                  WHERE %s""" % (now, block_expired, unauth_triplet_expire, sql_where_triplet)
         logger.debug('[SQL] Update expired tracking as first seen: \n%s' % sql)
         utils.execute_sql(engine_iredapd, sql)
         return True
@@ -276,19 +632,12 @@ def _should_be_greylisted_by_tracking(engine_iredapd,
     if now < _block_expired:
         # blocking not expired
         logger.info('[{}] Client retries too soon, greylisted again ({}).'.format(client_address, sender_domain))
-        sql = """UPDATE greylisting_tracking
-                    SET blocked_count=blocked_count + 1
-                  WHERE     sender=%s
-                        AND recipient=%s
-                        AND client_address=%s""" % (sender, recipient, client_address_sql)
 
-        logger.debug('[SQL] Update tracking record: \n%s' % sql)
-        try:
-            utils.execute_sql(engine_iredapd, sql)
-        except Exception as e:
-            logger.error('Error while updating greylisting tracking: %s' % repr(e))
-            utils.execute_sql(engine_iredapd, sql)
-            logger.error('Re-updated. It is safe to ignore above error message.')
+        # Buffer the update of `blocked_count`, it's not used to make any
+        # decision.
+        _key = (_sender, _recipient, client_address)
+        with _pending_lock:
+            _pending_blocked_counts[_key] = _pending_blocked_counts.get(_key, 0) + 1
         return True
     else:
         logger.info('[%s] Client has passed the greylisting, accept this email and whitelist client for %d days.' % (client_address, settings.GREYLISTING_AUTH_TRIPLET_EXPIRE))
@@ -298,12 +647,13 @@ def _should_be_greylisted_by_tracking(engine_iredapd,
             # Already updated expired date.
             pass
         else:
+            _add_passed_client(engine_iredapd=engine_iredapd,
+                               client_address=client_address,
+                               expire_at=auth_triplet_expire)
+
             sql = """UPDATE greylisting_tracking
                         SET record_expired=%d, passed=1
-                      WHERE     sender=%s
-                            AND recipient=%s
-                            AND client_address=%s""" % (auth_triplet_expire,
-                                                        sender, recipient, client_address_sql)
+                      WHERE %s""" % (auth_triplet_expire, sql_where_triplet)
 
             logger.debug('[SQL] Update expired date: \n%s' % sql)
             try:
@@ -354,12 +704,17 @@ def restriction(**kwargs):
 
     if utils.is_ipv4(client_address):
         # Add wildcard ip address: xx.xx.xx.*.
-        policy_senders += client_address.rsplit('.', 1)[0] + '.*'
+        policy_senders += [client_address.rsplit('.', 1)[0] + '.*']
 
     # Get object of IP address type
     _ip_object = ipaddress.ip_address(client_address)
 
     engine_iredapd = kwargs['engine_iredapd']
+
+    # Write buffered updates of previous requests.
+    _flush_pending_updates(engine_iredapd=engine_iredapd)
+    _start_flush_thread()
+
     # Check greylisting whitelists
     if _is_whitelisted(engine_iredapd=engine_iredapd,
                        senders=policy_senders,
@@ -387,16 +742,15 @@ def restriction(**kwargs):
             logger.info('[{}] Bypass greylisting due to SPF match ({})'.format(client_address, sender_domain))
             return SMTP_ACTIONS['default']
 
-    if _client_address_passed_in_tracking(engine_iredapd=engine_iredapd, client_address=client_address):
-        # Update expire time
-        _now = int(time.time())
-        _new_expire_time = _now + settings.GREYLISTING_AUTH_TRIPLET_EXPIRE * 24 * 60 * 60
-        _sql = """UPDATE greylisting_tracking
-                     SET record_expired=%d
-                   WHERE client_address=%s AND passed=1""" % (_new_expire_time, sqlquote(client_address))
-        logger.debug('[SQL] Update expire time of passed client: \n%s' % _sql)
-        utils.execute_sql(engine_iredapd, _sql)
+    # Client address (or network) used in greylisting tracking.
+    if settings.GREYLISTING_AGGREGATE_CLIENT_NETWORK:
+        tracking_client_address = lib_gl.get_tracking_client_address(client_address,
+                                                                     ipv4_prefix=settings.GREYLISTING_AGGREGATE_IPV4_PREFIX,
+                                                                     ipv6_prefix=settings.GREYLISTING_AGGREGATE_IPV6_PREFIX)
+    else:
+        tracking_client_address = client_address
 
+    if _client_address_passed(engine_iredapd=engine_iredapd, client_address=tracking_client_address):
         return SMTP_ACTIONS['default']
 
     # check greylisting tracking.
@@ -405,7 +759,7 @@ def restriction(**kwargs):
                                          sender_domain=sender_domain,
                                          recipient=recipient,
                                          recipient_domain=recipient_domain,
-                                         client_address=client_address):
+                                         client_address=tracking_client_address):
         if settings.GREYLISTING_TRAINING_MODE:
             logger.debug("Running in greylisting training mode, bypass.")
         else:
@@ -0,0 +1,50 @@
+# Author: Zhang Huangbin <zhb _at_ iredmail.org>
+# Purpose: Reject email if client IP address is listed in local IP
+#          reputation files (e.g. country blocks, abuse feeds).
+#
+#          Files are compiled from text feeds with
+#          `tools/ip_reputation_compile.py`, and listed in setting
+#          `IP_REPUTATION_FILES`. Files are memory-mapped, and reloaded
+#          automatically after changed (checked every
+#          `IP_REPUTATION_CHECK_INTERVAL` seconds).
+#
+#          Sample settings in /opt/iredapd/settings.py:
+#
+#           IP_REPUTATION_FILES = ['/opt/iredapd/ip_reputation.bin']
+
+import ipaddress
+
+from libs.logger import logger
+from libs import SMTP_ACTIONS
+from libs import utils
+from libs.ipreputation import IPReputationList
+
+import settings  # type: ignore
+
+_lists = [IPReputationList(path=f, check_interval=settings.IP_REPUTATION_CHECK_INTERVAL)
+          for f in settings.IP_REPUTATION_FILES]
+
+
+def restriction(**kwargs):
+    # Bypass outgoing emails.
+    if kwargs['sasl_username']:
+        logger.debug('Found SASL username, bypass ip reputation checking.')
+        return SMTP_ACTIONS['default']
+
+    client_address = kwargs["client_address"]
+
+    if utils.is_trusted_client(client_address):
+        logger.debug('Client address is trusted, bypass ip reputation checking.')
+        return SMTP_ACTIONS['default']
+
+    try:
+        _ip = ipaddress.ip_address(client_address)
+    except ValueError:
+        return SMTP_ACTIONS['default']
+
+    for _list in _lists:
+        if _list.lookup(_ip):
+            logger.info("[{}] Client IP address is listed in local IP reputation file: {}".format(client_address, _list.path))
+            return SMTP_ACTIONS['reject_ip_reputation']
+
+    return SMTP_ACTIONS['default']
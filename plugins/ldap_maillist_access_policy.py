@@ -2,6 +2,8 @@
 # Purpose: Restrict who can send email to mail list.
 # Note: Available access policy names are defined in file `libs/__init__.py`.
 
+from ldap.filter import escape_filter_chars
+
 from libs.logger import logger
 from libs import utils
 from libs import SMTP_ACTIONS
@@ -11,6 +13,7 @@ from libs import MAILLIST_POLICY_SUBDOMAIN
 from libs import MAILLIST_POLICY_MEMBERSONLY
 from libs import MAILLIST_POLICY_MODERATORS
 from libs import MAILLIST_POLICY_MEMBERSANDMODERATORSONLY
+from libs.cache import LRUCache
 
 from libs.ldaplib import conn_utils
 import settings # type: ignore
@@ -22,6 +25,94 @@ RECIPIENT_SEARCH_ATTRLIST = [
     'listModerator', 'listOwner',
 ]
 
+# Allowed senders (members, and moderators for policy
+# `membersAndModeratorsOnly`) of mailing lists, used if
+# `MAILLIST_MEMBERS_CACHE_TTL` is larger than 0.
+# {(<mail>, <policy>): frozenset([<address>, ...])}
+_cache = LRUCache(max_size=settings.MAILLIST_MEMBERS_CACHE_SIZE)
+
+
+def _search(conn, base_dn, scope, search_filter, search_attrs):
+    """Perform LDAP search and return list of (dn, ldif)."""
+    logger.debug('search base dn: %s' % base_dn)
+    logger.debug('search scope: %s' % {1: 'ONELEVEL', 2: 'SUBTREE'}.get(scope, scope))
+    logger.debug('search filter: %s' % search_filter)
+    logger.debug('search attributes: %s' % ', '.join(search_attrs))
+
+    qr = conn.search_s(base_dn, scope, search_filter, search_attrs)
+    logger.debug('search result: %s' % repr(qr))
+
+    return [(_dn, utils.bytes2str(_ldif)) for (_dn, _ldif) in qr]
+
+
+def _get_members_filter(mail, policy):
+    """Return LDAP filter used to search all allowed senders of mailing list
+    with access policy `membersOnly` or `membersAndModeratorsOnly`."""
+    mail = escape_filter_chars(mail)
+
+    if policy == MAILLIST_POLICY_MEMBERSONLY:
+        return '(&' + \
+               '(accountStatus=active)(memberOfGroup=%s)' % mail + \
+               '(|(objectclass=mailUser)(objectClass=mailExternalUser))' + \
+               ')'
+    else:
+        return '(|' + \
+               '(&(memberOfGroup=%s)(|(objectClass=mailUser)(objectClass=mailExternalUser)))' % mail + \
+               '(&(objectclass=mailList)(mail=%s))' % mail + \
+               ')'
+
+
+def get_members(conn, dn_rcpt_domain, mail, policy):
+    """Return all allowed senders of mailing list with access policy
+    `membersOnly` or `membersAndModeratorsOnly` as a frozenset."""
+    search_attrs = ['mail', 'shadowAddress']
+    if policy == MAILLIST_POLICY_MEMBERSANDMODERATORSONLY:
+        search_attrs.append('listAllowedUser')
+
+    qr = _search(conn, dn_rcpt_domain, 2, _get_members_filter(mail, policy), search_attrs)
+
+    members = set()
+    for (_dn, _ldif) in qr:
+        for k in search_attrs:
+            members.update(_ldif.get(k, []))
+
+    return frozenset(members)
+
+
+def is_member(conn, dn_rcpt_domain, mail, sender, policy):
+    """Check whether sender is allowed by access policy `membersOnly` or
+    `membersAndModeratorsOnly` of mailing list.
+
+    Only the account of sender is searched, so the cost doesn't depend on
+    the number of members. If `MAILLIST_MEMBERS_CACHE_TTL` is larger than
+    0, all allowed senders are cached instead.
+    """
+    if settings.MAILLIST_MEMBERS_CACHE_TTL > 0:
+        key = (mail, policy)
+        members = _cache.get(key)
+        if members is None:
+            members = get_members(conn, dn_rcpt_domain, mail, policy)
+            _cache.set(key, members, ttl=settings.MAILLIST_MEMBERS_CACHE_TTL)
+
+        return sender in members
+
+    _sender = escape_filter_chars(sender)
+
+    if policy == MAILLIST_POLICY_MEMBERSONLY:
+        _f = '(&%s(|(mail=%s)(shadowAddress=%s)))' % (_get_members_filter(mail, policy), _sender, _sender)
+    else:
+        _mail = escape_filter_chars(mail)
+        _f = '(|' + \
+             '(&(memberOfGroup=%s)(|(objectClass=mailUser)(objectClass=mailExternalUser))' % _mail + \
+             '(|(mail=%s)(shadowAddress=%s)))' % (_sender, _sender) + \
+             '(&(objectclass=mailList)(mail=%s)' % _mail + \
+             '(|(mail=%s)(shadowAddress=%s)(listAllowedUser=%s)))' % (_sender, _sender, _sender) + \
+             ')'
+
+    qr = _search(conn, dn_rcpt_domain, 2, _f, ['mail'])
+
+    return bool(qr)
+
 
 def restriction(**kwargs):
     sasl_username = kwargs['sasl_username']
@@ -126,59 +217,15 @@ def restriction(**kwargs):
         return SMTP_ACTIONS['reject_not_authorized']
 
     elif policy == MAILLIST_POLICY_MEMBERSONLY:
-        # Get all members of mailing list.
-        _f = '(&' + \
-             '(accountStatus=active)(memberOfGroup=%s)' % (recipient) + \
-             '(|(objectclass=mailUser)(objectClass=mailExternalUser))' + \
-             ')'
-
-        # Get both mail and shadowAddress.
-        search_attrs = ['mail', 'shadowAddress']
-
-        logger.debug('search base dn: %s' % dn_rcpt_domain)
-        logger.debug('search scope: SUBTREE')
-        logger.debug('search filter: %s' % _f)
-        logger.debug('search attributes: %s' % ', '.join(search_attrs))
-
-        qr = conn.search_s(dn_rcpt_domain, 2, _f, search_attrs)
-
-        allowed_senders = []
-        for (_dn, _ldif) in qr:
-            _ldif = utils.bytes2str(_ldif)
-            for k in search_attrs:
-                allowed_senders += _ldif.get(k, [])
-
-        if sender in allowed_senders:
+        if is_member(conn, dn_rcpt_domain, recipient, sender, policy):
             logger.info('Sender ({}) is allowed by access policy of mailing list: {}.'.format(sender, policy))
             return SMTP_ACTIONS['default']
 
         return SMTP_ACTIONS['reject_not_authorized']
 
     elif policy == MAILLIST_POLICY_MEMBERSANDMODERATORSONLY:
-        # Get both members and moderators.
-        _f = '(|' + \
-             '(&(memberOfGroup=%s)(|(objectClass=mailUser)(objectClass=mailExternalUser)))' % recipient + \
-             '(&(objectclass=mailList)(mail=%s))' % recipient + \
-             ')'
-        search_attrs = ['mail', 'shadowAddress', 'listAllowedUser']
-
-        logger.debug('search base dn: %s' % dn_rcpt_domain)
-        logger.debug('search scope: SUBTREE')
-        logger.debug('search filter: %s' % _f)
-        logger.debug('search attributes: %s' % ', '.join(search_attrs))
-
-        allowed_senders = []
         try:
-            qr = conn.search_s(dn_rcpt_domain, 2, _f, search_attrs)
-            logger.debug('search result: %s' % repr(qr))
-
-            # Collect values of all search attributes
-            for (_dn, _ldif) in qr:
-                _ldif = utils.bytes2str(_ldif)
-                for k in search_attrs:
-                    allowed_senders += _ldif.get(k, [])
-
-            if sender in allowed_senders:
+            if is_member(conn, dn_rcpt_domain, recipient, sender, policy):
                 logger.info('Sender ({}) is allowed by access policy of mailing list: {}.'.format(sender, policy))
                 return SMTP_ACTIONS['default']
         except Exception as e:
@@ -208,74 +255,46 @@ def restriction(**kwargs):
             if utils.is_email(_as):
                 if _as.endswith('@' + recipient_domain):
                     _users.append(_as)
-
-                    # We will add both `_as` and its shadowAddress back later.
-                    allowed_senders.remove(_as)
             else:
                 if _as.startswith('.'):
                     _domains.append(_as.lstrip('.'))
                 else:
                     _domains.append(_as)
 
-                # We will add both `_as` and its alias domains back later.
-                allowed_senders.remove(_as)
-
         logger.debug('Allowed users: %s' % ', '.join(_users))
         logger.debug('Allowed domains: %s' % ', '.join(_domains))
 
-        # Get per-user alias addresses.
+        # Check whether sender is a per-user alias address of allowed users.
         if _users:
-            logger.debug("[+] Getting per-account alias addresses of allowed senders.")
-
-            _basedn = 'ou=Users,' + dn_rcpt_domain
-            _f = '(&(objectClass=mailUser)(enabledService=shadowaddress)(|'
-            for i in _users:
-                _f += '(mail={})(shadowAddress={})'.format(i, i)
-            _f += '))'
+            logger.debug("[+] Getting per-account alias addresses of sender.")
 
+            _sender = escape_filter_chars(sender)
+            _f = '(&(objectClass=mailUser)(enabledService=shadowaddress)(|(mail=%s)(shadowAddress=%s)))' % (_sender, _sender)
             _search_attrs = ['mail', 'shadowAddress']
 
-            logger.debug('base dn: %s' % _basedn)
-            logger.debug('search scope: ONELEVEL')
-            logger.debug('search filter: %s' % _f)
-            logger.debug('search attributes: %s' % ', '.join(_search_attrs))
-
-            qr = conn.search_s(_basedn, 1, _f, _search_attrs)
-            logger.debug('query result: %s' % str(qr))
+            qr = _search(conn, 'ou=Users,' + dn_rcpt_domain, 1, _f, _search_attrs)
 
             for (_dn, _ldif) in qr:
-                _ldif = utils.bytes2str(_ldif)
                 for k in _search_attrs:
-                    allowed_senders += _ldif.get(k, [])
+                    if set(_ldif.get(k, [])) & set(_users):
+                        logger.info('Sender ({}) is allowed by access policy of mailing list: {}.'.format(sender, policy))
+                        return SMTP_ACTIONS['default']
 
+        # Check whether sender domain is an alias domain of allowed domains.
         if _domains:
-            logger.debug('[+] Getting alias domains of allowed sender (sub-)domains.')
-
-            _basedn = settings.ldap_basedn
-            _f = '(&(objectClass=mailDomain)(enabledService=domainalias)(|'
-            for i in _domains:
-                _f += '(domainName={})(domainAliasName={})'.format(i, i)
-            _f += '))'
+            logger.debug('[+] Getting alias domains of sender domain.')
 
+            _sender_domain = escape_filter_chars(sender_domain)
+            _f = '(&(objectClass=mailDomain)(enabledService=domainalias)(|(domainName=%s)(domainAliasName=%s)))' % (_sender_domain, _sender_domain)
             _search_attrs = ['domainName', 'domainAliasName']
 
-            logger.debug('base dn: %s' % _basedn)
-            logger.debug('search scope: ONELEVEL')
-            logger.debug('search filter: %s' % _f)
-            logger.debug('search attributes: %s' % ', '.join(_search_attrs))
-
-            qr = conn.search_s(_basedn, 1, _f, _search_attrs)
-            logger.debug('result: %s' % str(qr))
+            qr = _search(conn, settings.ldap_basedn, 1, _f, _search_attrs)
 
             for (_dn, _ldif) in qr:
-                _all_domains = []
                 for k in _search_attrs:
-                    _all_domains += _ldif.get(k, [])
-
-                for domain in _all_domains:
-                    if domain in _domains:
-                        # Add original domain and alias domains
-                        allowed_senders += [d for d in _all_domains]
+                    if set(_ldif.get(k, [])) & set(_domains):
+                        logger.info('Sender ({}) is allowed by access policy of mailing list: {}.'.format(sender, policy))
+                        return SMTP_ACTIONS['default']
 
         if sender in allowed_senders or sender_domain in allowed_senders:
             logger.info('Sender ({}) is allowed by access policy of mailing list: {}.'.format(sender, policy))
@@ -4,40 +4,113 @@
 #          than reject score (defaults to 30), email will be rejected.
 
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dns import resolver
 from web import sqlquote
 
 from libs.logger import logger
 from libs import SMTP_ACTIONS
 from libs import utils
-from libs.utils import get_dns_resolver
+from libs import dnscache
+from libs.cache import LRUCache
 
 import settings # type: ignore
 
 reject_score = settings.SENDERSCORE_REJECT_SCORE
 
+# Scores cached in memory: {<client_address>: (<score>, <cached time>)}
+_scores = LRUCache(max_size=settings.SENDERSCORE_MEMORY_CACHE_SIZE)
 
-def restriction(**kwargs):
-    # Bypass outgoing emails.
-    if kwargs['sasl_username']:
-        logger.debug('Found SASL username, bypass senderscore checking.')
-        return SMTP_ACTIONS['default']
+# Thread used to refresh scores which are going to expire.
+_refresh_executor = None
 
-    client_address = kwargs["client_address"]
-    if not utils.is_ipv4(client_address):
-        logger.debug('Client address is not IPv4, bypass senderscore checking.')
-        return SMTP_ACTIONS["default"]
+# Client addresses which are queued or being refreshed in background thread,
+# used to avoid queuing same address again while it's pending.
+_pending_refreshes = set()
+_pending_refreshes_lock = threading.Lock()
 
-    if utils.is_trusted_client(client_address):
-        logger.debug('Client address is trusted, bypass senderscore checking.')
-        return SMTP_ACTIONS['default']
+_cache_seconds = settings.SENDERSCORE_CACHE_DAYS * 86400
+
+
+def _query_dns(client_address):
+    """Query score with DNS, returns score (integer), or None if no valid
+    score. Raises `resolver.Timeout` and other errors."""
+    (o1, o2, o3, o4) = client_address.split(".")
+    lookup_domain = "{}.{}.{}.{}.score.senderscore.com".format(o4, o3, o2, o1)
+
+    try:
+        qr = dnscache.query(lookup_domain, "A", lifetime=settings.SENDERSCORE_DNS_TIMEOUT)
+        if not qr:
+            return None
+
+        ip = str(qr[0])
+        return int(ip.split(".")[-1])
+    except (resolver.NoAnswer):
+        logger.debug("[{}] senderscore -> NoAnswer".format(client_address))
+    except resolver.NXDOMAIN:
+        logger.debug("[{}] senderscore -> NXDOMAIN".format(client_address))
+
+    # No score, treat as good sender.
+    return 100
+
+
+def _cache_score(engine_iredapd, client_address, score):
+    now = int(time.time())
+    _scores.set(client_address, (score, now), ttl=_cache_seconds)
+
+    # Store the DNS query result as cache.
+    sql = """
+            INSERT INTO senderscore_cache (client_address, score, time)
+            VALUES (%s, %s, %d)
+        """ % (sqlquote(client_address), sqlquote(score), now)
+    sql += utils.get_sql_upsert_clause(unique_columns=['client_address'],
+                                       update_columns=['score', 'time'])
+
+    try:
+        utils.execute_sql(engine_iredapd,  sql)
+    except Exception as e:
+        logger.error("[{}] senderscore -> Error while caching score: {}".format(client_address, e))
+
+
+def _refresh_score(engine_iredapd, client_address):
+    try:
+        score = _query_dns(client_address)
+        if score is not None and 0 <= score <= 100:
+            _cache_score(engine_iredapd=engine_iredapd,
+                         client_address=client_address,
+                         score=score)
+            logger.debug("[{}] senderscore -> refreshed: {}".format(client_address, score))
+    except Exception as e:
+        logger.debug("[{}] senderscore -> Error while refreshing score: {}".format(client_address, repr(e)))
+    finally:
+        with _pending_refreshes_lock:
+            _pending_refreshes.discard(client_address)
+
+
+def _refresh_ahead(engine_iredapd, client_address):
+    """Refresh score in background thread."""
+    global _refresh_executor
+
+    with _pending_refreshes_lock:
+        if client_address in _pending_refreshes:
+            return None
+
+        _pending_refreshes.add(client_address)
+
+    if _refresh_executor is None:
+        _refresh_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='senderscore')
+
+    _refresh_executor.submit(_refresh_score,
+                             engine_iredapd=engine_iredapd,
+                             client_address=client_address)
 
-    score = 100
-    cache_the_score = False
-    cache_matched = False
-    engine_iredapd = kwargs['engine_iredapd']
 
-    # Check cached score from SQL db to speed it up.
+def _get_score(engine_iredapd, client_address):
+    """Return a tuple of (score, cache_matched), or None if no valid score."""
+    now = int(time.time())
+
+    # Check cached score in memory first, then SQL db.
     #
     # - Sometimes DNS query might be an issue due to slow reply or temporary
     #   network issue, caching the result will help avoid similar issue.
@@ -46,63 +119,81 @@ def restriction(**kwargs):
     # - It's normal that same sender server sends few emails in short period.
     # - Cached results will be cleaned up automatically by cron job
     #  (tools/cleanup_db.py).
+    cached = _scores.get(client_address)
 
-    sql = """
-        SELECT score
-        FROM senderscore_cache
-        WHERE client_address=%s
-        LIMIT 1
-        """ % sqlquote(client_address)
-
-    qr = utils.execute_sql(engine_iredapd,  sql)
-    row = qr.fetchone()
-
-    if row:
-        try:
-            score = int(row[0])
-            cache_matched = True
-        except Exception as e:
-            logger.error("[{}] senderscore -> Error while converting score "
-                         "to integer: {}".format(client_address, e))
-    else:
-        (o1, o2, o3, o4) = client_address.split(".")
-        lookup_domain = "{}.{}.{}.{}.score.senderscore.com".format(o4, o3, o2, o1)
-
-        try:
-            qr = get_dns_resolver().query(lookup_domain, "A")
-            if not qr:
-                return SMTP_ACTIONS["default"]
-
-            ip = str(qr[0])
-            score = int(ip.split(".")[-1])
-            cache_the_score = True
-        except (resolver.NoAnswer):
-            logger.debug("[{}] senderscore -> NoAnswer".format(client_address))
-            cache_the_score = True
-        except resolver.NXDOMAIN:
-            logger.debug("[{}] senderscore -> NXDOMAIN".format(client_address))
-            cache_the_score = True
-        except (resolver.Timeout):
-            logger.debug("[{}] senderscore -> Timeout".format(client_address))
-        except Exception as e:
-            logger.error("[{}] senderscore -> Error: {}".format(client_address, e))
-
-    if 0 <= score <= 100:
-        if cache_the_score:
-            # Store the DNS query result as cache.
-            sql = """
-                    INSERT INTO senderscore_cache (client_address, score, time)
-                    VALUES (%s, %s, %d)
-                """ % (sqlquote(client_address), sqlquote(score), int(time.time()))
+    if cached is None:
+        sql = """
+            SELECT score, time
+            FROM senderscore_cache
+            WHERE client_address=%s
+            LIMIT 1
+            """ % sqlquote(client_address)
 
+        qr = utils.execute_sql(engine_iredapd,  sql)
+        row = qr.fetchone()
+
+        if row:
             try:
-                utils.execute_sql(engine_iredapd,  sql)
+                cached = (int(row[0]), int(row[1]))
+                _scores.set(client_address, cached, ttl=int(row[1]) + _cache_seconds - now)
             except Exception as e:
-                logger.error("[{}] senderscore -> Error while caching score: {}".format(client_address, e))
-    else:
+                logger.error("[{}] senderscore -> Error while converting score "
+                             "to integer: {}".format(client_address, e))
+
+    if cached is not None:
+        (score, _cached_time) = cached
+
+        if _cached_time + _cache_seconds - now <= settings.SENDERSCORE_REFRESH_AHEAD:
+            _refresh_ahead(engine_iredapd=engine_iredapd, client_address=client_address)
+
+        return (score, True)
+
+    try:
+        score = _query_dns(client_address)
+    except (resolver.Timeout):
+        logger.debug("[{}] senderscore -> Timeout".format(client_address))
+        return None
+    except Exception as e:
+        logger.error("[{}] senderscore -> Error: {}".format(client_address, e))
+        return None
+
+    if score is None:
+        return None
+
+    if not (0 <= score <= 100):
         logger.error("Invalid sender score: %d (must between 0-100)" % score)
+        return None
+
+    _cache_score(engine_iredapd=engine_iredapd,
+                 client_address=client_address,
+                 score=score)
+
+    return (score, False)
+
+
+def restriction(**kwargs):
+    # Bypass outgoing emails.
+    if kwargs['sasl_username']:
+        logger.debug('Found SASL username, bypass senderscore checking.')
         return SMTP_ACTIONS['default']
 
+    client_address = kwargs["client_address"]
+    if not utils.is_ipv4(client_address):
+        logger.debug('Client address is not IPv4, bypass senderscore checking.')
+        return SMTP_ACTIONS["default"]
+
+    if utils.is_trusted_client(client_address):
+        logger.debug('Client address is trusted, bypass senderscore checking.')
+        return SMTP_ACTIONS['default']
+
+    engine_iredapd = kwargs['engine_iredapd']
+
+    qr = _get_score(engine_iredapd=engine_iredapd, client_address=client_address)
+    if not qr:
+        return SMTP_ACTIONS['default']
+
+    (score, cache_matched) = qr
+
     sender_domain = kwargs["sasl_username_domain"] or kwargs["sender_domain"]
 
     log_msg = "[{}] [{}] senderscore: {}".format(client_address, sender_domain, score)
@@ -19,26 +19,15 @@ from libs import MAILLIST_POLICY_SUBDOMAIN
 from libs import MAILLIST_POLICY_MEMBERSONLY
 from libs import MAILLIST_POLICY_MODERATORS
 from libs import MAILLIST_POLICY_MEMBERSANDMODERATORSONLY
+from libs.cache import LRUCache
+import settings  # type: ignore
 
 from libs.sql import get_access_policy, get_alias_target_domain
 
-
-def is_allowed_alias_domain_user(sender,
-                                 sender_username,
-                                 sender_domain,
-                                 recipient_domain,
-                                 rcpt_alias_domains,
-                                 restricted_members):
-    if sender_domain in rcpt_alias_domains:
-        policy_senders = [sender, sender_username + '@' + recipient_domain]
-        policy_senders += [sender_username + '@' + d for d in rcpt_alias_domains]
-
-        matched_senders = set(policy_senders) & set(restricted_members)
-        if matched_senders:
-            logger.debug('Matched alias domain user: %s' % str(matched_senders))
-            return True
-
-    return False
+# Members and moderators of mail alias accounts, used if
+# `MAILLIST_MEMBERS_CACHE_TTL` is larger than 0.
+# {(<mail>, <is_moderator>): frozenset([<address>, ...])}
+_cache = LRUCache(max_size=settings.MAILLIST_MEMBERS_CACHE_SIZE)
 
 
 def get_members(conn_vmail, mail):
@@ -85,6 +74,56 @@ def get_moderators(conn_vmail, mail):
     return _moderators
 
 
+def _get_cached_addresses(conn_vmail, mail, moderators=False):
+    """Return members (or moderators) of mail alias account as a frozenset,
+    cached for `MAILLIST_MEMBERS_CACHE_TTL` seconds."""
+    key = (mail, moderators)
+
+    addresses = _cache.get(key)
+    if addresses is None:
+        if moderators:
+            addresses = frozenset(get_moderators(conn_vmail=conn_vmail, mail=mail))
+        else:
+            addresses = frozenset(get_members(conn_vmail=conn_vmail, mail=mail))
+
+        _cache.set(key, addresses, ttl=settings.MAILLIST_MEMBERS_CACHE_TTL)
+
+    return addresses
+
+
+def is_member(conn_vmail, mail, addresses):
+    """Check whether one of given addresses is member of mail alias account."""
+    if settings.MAILLIST_MEMBERS_CACHE_TTL > 0:
+        return bool(_get_cached_addresses(conn_vmail, mail) & set(addresses))
+
+    sql = """SELECT 1
+               FROM forwardings
+              WHERE address=%s AND forwarding IN %s AND is_list=1
+              LIMIT 1""" % (sqlquote(mail), sqlquote(addresses))
+
+    logger.debug('[SQL] query alias member: \n%s' % sql)
+
+    qr = utils.execute_sql(conn_vmail, sql)
+    return bool(qr.fetchone())
+
+
+def is_moderator(conn_vmail, mail, addresses):
+    """Check whether one of given addresses is moderator of mail alias
+    account."""
+    if settings.MAILLIST_MEMBERS_CACHE_TTL > 0:
+        return bool(_get_cached_addresses(conn_vmail, mail, moderators=True) & set(addresses))
+
+    sql = """SELECT 1
+               FROM moderators
+              WHERE address=%s AND moderator IN %s
+              LIMIT 1""" % (sqlquote(mail), sqlquote(addresses))
+
+    logger.debug('[SQL] query moderator: \n%s' % sql)
+
+    qr = utils.execute_sql(conn_vmail, sql)
+    return bool(qr.fetchone())
+
+
 def restriction(**kwargs):
     conn_vmail = kwargs['conn_vmail']
     sender = kwargs['sender_without_ext']
@@ -146,15 +185,15 @@ def restriction(**kwargs):
     else:
         logger.debug('No alias domain.')
 
-    members = []
-    moderators = []
-    if policy in (MAILLIST_POLICY_MEMBERSONLY, MAILLIST_POLICY_MEMBERSANDMODERATORSONLY):
-        members = get_members(conn_vmail=conn_vmail, mail=real_recipient)
-        logger.debug('Members: %s' % ', '.join(members))
+    # Sender addresses used to check members and moderators: sender itself,
+    # and same username under recipient domain and its alias domains if
+    # sender domain is an alias domain of recipient domain.
+    policy_senders = [sender]
+    if sender_domain in rcpt_alias_domains:
+        policy_senders += [sender_username + '@' + recipient_domain]
+        policy_senders += [sender_username + '@' + d for d in rcpt_alias_domains]
 
-    if policy in (MAILLIST_POLICY_MODERATORS, MAILLIST_POLICY_MEMBERSANDMODERATORSONLY):
-        moderators = get_moderators(conn_vmail=conn_vmail, mail=real_recipient)
-        logger.debug('Moderators: %s' % ', '.join(moderators))
+    policy_moderators = policy_senders + ['*@' + sender_domain]
 
     if policy == MAILLIST_POLICY_DOMAIN:
         # Bypass all users under the same domain.
@@ -183,38 +222,21 @@ def restriction(**kwargs):
 
     elif policy == MAILLIST_POLICY_MODERATORS:
         # Bypass all moderators.
-        if sender in moderators \
-           or '*@' + sender_domain in moderators \
-           or is_allowed_alias_domain_user(sender,
-                                           sender_username,
-                                           sender_domain,
-                                           recipient_domain,
-                                           rcpt_alias_domains,
-                                           moderators):
+        if is_moderator(conn_vmail=conn_vmail, mail=real_recipient, addresses=policy_moderators):
+            logger.debug('Sender is a moderator.')
             return SMTP_ACTIONS['default']
 
     elif policy == MAILLIST_POLICY_MEMBERSONLY:
         # Bypass all members.
-        if sender in members \
-           or is_allowed_alias_domain_user(sender,
-                                           sender_username,
-                                           sender_domain,
-                                           recipient_domain,
-                                           rcpt_alias_domains,
-                                           members):
+        if is_member(conn_vmail=conn_vmail, mail=real_recipient, addresses=policy_senders):
+            logger.debug('Sender is a member.')
             return SMTP_ACTIONS['default']
 
     elif policy == MAILLIST_POLICY_MEMBERSANDMODERATORSONLY:
         # Bypass both members and moderators.
-        if sender in members \
-           or sender in moderators \
-           or '*@' + sender_domain in moderators \
-           or is_allowed_alias_domain_user(sender,
-                                           sender_username,
-                                           sender_domain,
-                                           recipient_domain,
-                                           rcpt_alias_domains,
-                                           members + moderators):
+        if is_member(conn_vmail=conn_vmail, mail=real_recipient, addresses=policy_senders) \
+           or is_moderator(conn_vmail=conn_vmail, mail=real_recipient, addresses=policy_moderators):
+            logger.debug('Sender is a member or moderator.')
             return SMTP_ACTIONS['default']
     else:
         # Bypass all if policy is not defined in this plugin.
@@ -40,6 +40,25 @@
 #
 #   *) If some recipients are rejected at RCPT state, Postfix will correctly
 #      store the count of final recipients in `recipient_count`.
+#
+#   *) Client may declare the message size in `MAIL FROM` command
+#      (`SIZE=xxx`), Postfix sends it as `size=` in RCPT state.
+#
+#   *) All policy requests of same mail transaction have same `instance=`.
+
+# Early check at RCPT state
+# -------------
+#
+# With `THROTTLE_CHECK_AT_RCPT = True` in settings.py, this plugin is applied
+# at RCPT state too, and rejects the recipient if:
+#
+#   *) declared message size (`size=`) is larger than `msg_size`.
+#   *) `max_msgs` or `max_quota` is already exhausted.
+#   *) recipients accepted in current mail transaction (tracked in memory,
+#      per `instance=`) exceed `max_rcpts`.
+#
+# Throttle tracking data is NOT updated at RCPT state, accounting is still
+# done at END-OF-MESSAGE state with the final `recipient_count` and `size`.
 
 # Technical details of throttle plugin
 # -------------
@@ -165,7 +184,7 @@ import time
 from web import sqlquote
 from libs.logger import logger
 import settings  # type: ignore
-from libs import SMTP_ACTIONS, utils
+from libs import SMTP_ACTIONS, utils, notification
 
 if settings.backend == 'ldap':
     from libs.ldaplib.conn_utils import get_alias_target_domain
@@ -174,10 +193,49 @@ else:
 
 SMTP_PROTOCOL_STATE = ['END-OF-MESSAGE']
 
+if settings.THROTTLE_CHECK_AT_RCPT:
+    SMTP_PROTOCOL_STATE = ['RCPT', 'END-OF-MESSAGE']
+
+# Recipients accepted at RCPT state in each mail transaction, used to check
+# `max_rcpts` before END-OF-MESSAGE.
+# {<instance>: [<recipient_count>, <last_seen_time>]}
+_rcpt_tally = {}
+
+# Remove tally of mail transactions which never reach END-OF-MESSAGE state
+# (e.g. client disconnected, or all recipients were rejected) after given
+# seconds.
+_RCPT_TALLY_EXPIRE = 3600
+_rcpt_tally_last_purge = 0
+
 # Connect to iredapd database
 REQUIRE_IREDAPD_DB = True
 
 
+def __update_last_notify_time(tracking_records):
+    """Update `throttle_tracking.last_notify_time` of given tracking records.
+
+    :param tracking_records: a list of tuple: (engine_iredapd, tracking_id).
+    """
+    _now = int(time.time())
+
+    # {engine_iredapd: [tracking_id, ...]}
+    _ids = {}
+    for (_engine, _id) in tracking_records:
+        _ids.setdefault(_engine, set()).add(_id)
+
+    for (_engine, ids) in list(_ids.items()):
+        _sql = """UPDATE throttle_tracking
+                     SET last_notify_time=%d
+                   WHERE id IN %s
+                   """ % (_now, sqlquote(list(ids)))
+
+        try:
+            utils.execute_sql(_engine, _sql)
+            logger.debug('Updated last notify time of throttle tracking records: {}'.format(ids))
+        except Exception as e:
+            logger.error('Error while updating last notify time of quota exceed: %s.' % (repr(e)))
+
+
 def __sendmail(engine_iredapd,
                user,
                client_address,
@@ -186,8 +244,9 @@ def __sendmail(engine_iredapd,
                throttle_value,
                throttle_kind,
                throttle_info,
-               throttle_value_unit=None):
-    """Construct and send notification email."""
+               throttle_value_unit=None,
+               expire_time=0):
+    """Construct notification email and queue it, it's sent in background."""
     # conn: SQL connection cursor
     # user: user email address
     # client_address: client IP address
@@ -198,6 +257,8 @@ def __sendmail(engine_iredapd,
     # throttle_info: detailed throttle setting
     # throttle_value_unit: unit of throttle setting. e.g 'bytes' for max_quota
     #                      and msg_size.
+    # expire_time: time the tracking record expires, no more notification
+    #              email for same user and throttle setting before it.
     if not throttle_value_unit:
         throttle_value_unit = ''
 
@@ -210,34 +271,51 @@ def __sendmail(engine_iredapd,
         _body += '- Limit: %d %s\n' % (throttle_value, throttle_value_unit)
         _body += '- Detailed setting: ' + throttle_info + '\n'
 
-        r = utils.sendmail(subject=_subject, mail_body=_body)
-        if r[0]:
-            logger.info('Sent notification email to admin(s) to report quota exceed: user=%s, %s=%d.' % (user, throttle_name, throttle_value))
-        else:
-            logger.warning('Failed in senting notification email to admin(s) to report quota exceed: user=%s, %s=%d, error=%s.' % (user, throttle_name, throttle_value, r[1]))
-
+        _callback = None
         if throttle_tracking_id:
-            _now = int(time.time())
+            _callback = __update_last_notify_time
 
-            # Update last_notify_time.
-            _sql = """UPDATE throttle_tracking
-                         SET last_notify_time=%d
-                       WHERE id=%d;
-                       """ % (_now, throttle_tracking_id)
+        queued = notification.queue_mail(subject=_subject,
+                                         mail_body=_body,
+                                         key=(throttle_kind, user, throttle_name),
+                                         expire_time=expire_time,
+                                         callback=_callback,
+                                         callback_arg=(engine_iredapd, throttle_tracking_id))
 
-            try:
-                utils.execute_sql(engine_iredapd, _sql)
-                logger.debug('Updated last notify time.')
-            except Exception as e:
-                logger.error('Error while updating last notify time of quota exceed: %s.' % (repr(e)))
+        if queued:
+            logger.info('Queued notification email to report quota exceed: user=%s, %s=%d.' % (user, throttle_name, throttle_value))
 
         return True,
     except Exception as e:
-        logger.error('Error while sending notification email: %s' % repr(e))
+        logger.error('Error while queuing notification email: %s' % repr(e))
         return False, repr(e)
 
 
+def __get_rcpt_tally(instance):
+    """Return number of recipients accepted in given mail transaction."""
+    global _rcpt_tally_last_purge
+
+    now = int(time.time())
+
+    if now - _rcpt_tally_last_purge > 60:
+        _rcpt_tally_last_purge = now
+
+        for (k, v) in list(_rcpt_tally.items()):
+            if now - v[1] > _RCPT_TALLY_EXPIRE:
+                _rcpt_tally.pop(k, None)
+
+    if instance in _rcpt_tally:
+        return _rcpt_tally[instance][0]
+
+    return 0
+
+
 # Apply throttle setting and return smtp action.
+#
+# With `protocol_state='RCPT'`, `size` is the size declared by client and
+# `recipient_count` is the number of recipients accepted so far (including
+# current one), throttle settings are checked but tracking data is not
+# updated.
 def apply_throttle(engine_iredapd,
                    conn_vmail,
                    user,
@@ -245,7 +323,8 @@ def apply_throttle(engine_iredapd,
                    size,
                    recipient_count,
                    is_sender_throttling=True,
-                   is_external_sender=False):
+                   is_external_sender=False,
+                   protocol_state='END-OF-MESSAGE'):
     possible_addrs = [client_address, '@ip']
 
     if user:
@@ -550,7 +629,8 @@ def apply_throttle(engine_iredapd,
                            throttle_name='max_msgs',
                            throttle_value=max_msgs,
                            throttle_kind=throttle_kind,
-                           throttle_info=throttle_info)
+                           throttle_info=throttle_info,
+                           expire_time=_init_time + _period)
 
             return SMTP_ACTIONS['reject_quota_exceeded']
         else:
@@ -577,6 +657,7 @@ def apply_throttle(engine_iredapd,
         _period = int(ts.get('period', 0))
         _init_time = int(ts.get('init_time', 0))
         _last_time = int(ts.get('last_time', 0))
+        _last_notify_time = int(ts.get('last_notify_time', 0))
 
         if _period and (_init_time > 0) and now > (_init_time + _period):
             # tracking record expired
@@ -603,7 +684,8 @@ def apply_throttle(engine_iredapd,
                            throttle_value=max_quota,
                            throttle_kind=throttle_kind,
                            throttle_info=throttle_info,
-                           throttle_value_unit='bytes')
+                           throttle_value_unit='bytes',
+                           expire_time=_init_time + _period)
 
             return SMTP_ACTIONS['reject_quota_exceeded']
         else:
@@ -620,6 +702,10 @@ def apply_throttle(engine_iredapd,
                                      _period,
                                      utils.pretty_left_seconds(_left_seconds)))
 
+    if protocol_state == 'RCPT':
+        logger.debug('[OK] Passed all {} throttle settings at RCPT state.'.format(throttle_type))
+        return SMTP_ACTIONS['default']
+
     # Update tracking record.
     #
     # SQL statements used to add or update tracking data if smtp session is not rejected:
@@ -671,16 +757,16 @@ def apply_throttle(engine_iredapd,
                     sql_updates[tracking_id]['cur_quota'] = 'cur_quota + %d' % size
             else:
                 # no tracking record. insert new one.
-                # (tid, account, cur_msgs, period, cur_quota, init_time, last_time)
+                # (tid, account, cur_msgs, period, cur_quota, init_time, last_time, expire_at)
                 if key not in sql_inserts:
-                    _sql = '(%d, %s, %d, %d, %d, %d, %d)' % (tid, sqlquote(k), recipient_count, ts['period'], size, now, now)
+                    _sql = '(%d, %s, %d, %d, %d, %d, %d, %d)' % (tid, sqlquote(k), recipient_count, ts['period'], size, now, now, now + ts['period'])
                     sql_inserts[key] = _sql
 
     if sql_inserts:
         try:
             values = set(sql_inserts.values())
             sql = """INSERT INTO throttle_tracking
-                                 (tid, account, cur_msgs, period, cur_quota, init_time, last_time)
+                                 (tid, account, cur_msgs, period, cur_quota, init_time, last_time, expire_at)
                           VALUES """
             sql += ','.join(values)
 
@@ -695,12 +781,14 @@ def apply_throttle(engine_iredapd,
                          last_time={},
                          init_time={},
                          cur_msgs={},
-                         cur_quota={}
+                         cur_quota={},
+                         expire_at={}
                    WHERE id={}""".format(_kv['period'],
                                          _kv['last_time'],
                                          _kv['init_time'],
                                          _kv['cur_msgs'],
                                          _kv['cur_quota'],
+                                         int(_kv['init_time']) + int(_kv['period']),
                                          _tracking_id)
 
         logger.debug('[SQL] Update tracking record: {}'.format(_sql))
@@ -727,16 +815,28 @@ def restriction(**kwargs):
     client_address = kwargs['client_address']
 
     smtp_session_data = kwargs['smtp_session_data']
-    size = smtp_session_data['size']
-    recipient_count = int(smtp_session_data['recipient_count'])
+    protocol_state = smtp_session_data['protocol_state'].upper()
+    instance = smtp_session_data.get('instance', '')
+    size = smtp_session_data.get('size')
 
     if size:
         size = int(size)
     else:
         size = 0
 
+    if protocol_state == 'RCPT':
+        # Count current recipient.
+        recipient_count = __get_rcpt_tally(instance) + 1
+    else:
+        recipient_count = int(smtp_session_data['recipient_count'])
+        _rcpt_tally.pop(instance, None)
+
     if sender_domain == recipient_domain and settings.THROTTLE_BYPASS_SAME_DOMAIN:
         logger.debug('Bypassed. Sender domain is same as recipient domain.')
+
+        if protocol_state == 'RCPT' and instance:
+            _rcpt_tally[instance] = [recipient_count, int(time.time())]
+
         return SMTP_ACTIONS['default']
 
     if settings.THROTTLE_BYPASS_MYNETWORKS:
@@ -765,7 +865,8 @@ def restriction(**kwargs):
                             size=size,
                             recipient_count=recipient_count,
                             is_sender_throttling=True,
-                            is_external_sender=is_external_sender)
+                            is_external_sender=is_external_sender,
+                            protocol_state=protocol_state)
 
     if not action.startswith('DUNNO'):
         return action
@@ -776,15 +877,28 @@ def restriction(**kwargs):
         logger.debug('Bypass recipient throttling (found sasl_username).')
     else:
         logger.debug('Check recipient throttling.')
+
+        # Recipient throttling applies to each recipient separately.
+        _recipient_count = recipient_count
+        if protocol_state == 'RCPT':
+            _recipient_count = 1
+
         action = apply_throttle(engine_iredapd=engine_iredapd,
                                 conn_vmail=conn_vmail,
                                 user=recipient,
                                 client_address=client_address,
                                 size=size,
-                                recipient_count=recipient_count,
-                                is_sender_throttling=False)
+                                recipient_count=_recipient_count,
+                                is_sender_throttling=False,
+                                protocol_state=protocol_state)
 
         if not action.startswith('DUNNO'):
             return action
 
+    if protocol_state == 'RCPT' and instance:
+        # Recipient is not rejected by throttle settings, count it.
+        # Note: it may be still rejected by other plugins or Postfix, the
+        #       final `recipient_count` is used at END-OF-MESSAGE state.
+        _rcpt_tally[instance] = [recipient_count, int(time.time())]
+
     return SMTP_ACTIONS['default']
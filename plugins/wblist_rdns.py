@@ -40,6 +40,7 @@ from web import sqlquote
 from libs import utils
 from libs.logger import logger
 from libs import SMTP_ACTIONS
+from libs.cache import SQLTableCache
 from libs.utils import is_trusted_client
 import settings # type: ignore
 
@@ -49,6 +50,45 @@ else:
     reject_action = SMTP_ACTIONS['reject_blacklisted']
 
 
+class RDNSCache(SQLTableCache):
+    """All rDNS names stored in SQL table `wblist_rdns`.
+
+    Data structure: {<rdns>: <wb>}
+    """
+    sql_table = 'wblist_rdns'
+    sql_columns = ['id', 'rdns', 'wb']
+    sql_checksum_columns = sql_columns
+
+    def new_data(self):
+        return {}
+
+    def add_row(self, data, row):
+        (_id, rdns, wb) = row
+        data[str(rdns).lower()] = str(wb).upper()
+
+
+_cache = None
+if settings.WBLIST_RDNS_CACHE:
+    _cache = RDNSCache(check_interval=settings.WBLIST_RDNS_CACHE_CHECK_INTERVAL)
+
+
+def _get_wb_in_cache(data, rdns_names):
+    """Return a tuple of ('W' or 'B', matched rDNS name), or (None, None) if
+    not listed. Whitelist has higher priority than blacklist."""
+    blacklisted = None
+    for name in rdns_names:
+        wb = data.get(name)
+        if wb == 'W':
+            return ('W', name)
+        elif wb == 'B' and not blacklisted:
+            blacklisted = name
+
+    if blacklisted:
+        return ('B', blacklisted)
+
+    return (None, None)
+
+
 def restriction(**kwargs):
     rdns_name = kwargs['smtp_session_data']['reverse_client_name']
     client_address = kwargs['smtp_session_data']['client_address']
@@ -77,6 +117,21 @@ def restriction(**kwargs):
 
     engine_iredapd = kwargs['engine_iredapd']
 
+    data = None
+    if _cache:
+        data = _cache.get(engine_iredapd)
+
+    if data is not None:
+        (wb, rdns) = _get_wb_in_cache(data, [i.lower() for i in _policy_rdns_names])
+        if wb == 'W':
+            logger.info("[{}] Reverse client hostname is whitelisted: {}.".format(client_address, rdns))
+            return SMTP_ACTIONS['default']
+        elif wb == 'B':
+            logger.info("[{}] Reverse client hostname is blacklisted: {}".format(client_address, rdns))
+            return reject_action
+
+        return SMTP_ACTIONS['default']
+
     # Query whitelist
     sql = """SELECT rdns
                FROM wblist_rdns
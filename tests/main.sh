@@ -16,11 +16,21 @@ plugins="
     reject_sender_login_mismatch
     wblist_rdns
     sql_alias_access_policy
+    greylisting
+    throttle
 "
 
+# Unit tests which don't require running iRedAPD service.
+py.test -x test_cache.py test_dnscache.py test_ipindex.py test_spf_whitelists.py test_dnsbl.py test_ipreputation.py test_ip_reputation.py
+
 # Add custom settings
 echo 'log_level = "debug"   # unittest' >> /opt/iredapd/settings.py
 echo 'ALLOWED_LOGIN_MISMATCH_LIST_MEMBER = True     # unittest' >> /opt/iredapd/settings.py
+echo 'WBLIST_RDNS_CACHE_CHECK_INTERVAL = 0     # unittest' >> /opt/iredapd/settings.py
+echo 'GREYLISTING_CACHE_CHECK_INTERVAL = 0     # unittest' >> /opt/iredapd/settings.py
+echo 'GREYLISTING_BYPASS_SPF = False     # unittest' >> /opt/iredapd/settings.py
+echo 'GREYLISTING_FLUSH_INTERVAL = 2     # unittest' >> /opt/iredapd/settings.py
+echo 'THROTTLE_CHECK_AT_RCPT = True     # unittest' >> /opt/iredapd/settings.py
 
 for p in ${plugins}; do
     echo "plugins = ['${p}'] # unittest" >> /opt/iredapd/settings.py
@@ -34,6 +44,18 @@ for p in ${plugins}; do
     py.test -s -x test_${p}.py
 done
 
+# Greylisting with clients tracked by network.
+echo "plugins = ['greylisting'] # unittest" >> /opt/iredapd/settings.py
+echo 'GREYLISTING_AGGREGATE_CLIENT_NETWORK = True     # unittest' >> /opt/iredapd/settings.py
+service iredapd restart
+py.test -s -x test_greylisting_network.py
+
+# Greylisting with hashed tracking key. It must start with tracking records
+# without hash, so restart iRedAPD before running it.
+echo 'GREYLISTING_TRACKING_HASHED_KEY = True     # unittest' >> /opt/iredapd/settings.py
+service iredapd restart
+py.test -s -x test_greylisting_hashed_key.py
+
 # Cleanup SQL records generated during testing
 py.test test_cleanup.py
 
@@ -27,6 +27,23 @@ sql_vars = {
 rdns_subdomain_name = '.rdns.com'
 rdns_exact_name = 'test' + rdns_subdomain_name
 
+# Client addresses used to test greylisting (TEST-NET, not listed in SPF
+# records of any domain).
+gl_client = '192.0.2.10'
+gl_client_v6 = '2001:db8::10'
+
+# Client address which passes greylisting, it's cached in memory by iRedAPD
+# and not greylisted anymore, don't use it in other tests.
+gl_passed_client = '192.0.2.20'
+
+# Client addresses used to test greylisting tracked by network (/24), each
+# network is used by one test file only.
+gl_net_client = '198.51.100.10'
+gl_net_client2 = '198.51.100.11'
+gl_net = '198.51.100.0/24'
+gl_hashed_client = '203.0.113.10'
+gl_hashed_net = '203.0.113.0/24'
+
 #########################################
 # DO NOT TOUCH LINES BELOW
 #########################################
@@ -0,0 +1,213 @@
+import zlib
+
+import pytest
+from sqlalchemy import create_engine, event
+
+from libs import utils
+from libs import cache
+from libs.cache import SQLTableCache, LRUCache
+
+
+class _Clock:
+    """Replaces `time.time()` used in `libs.cache`."""
+    def __init__(self):
+        self.now = 1000000.0
+
+    def time(self):
+        return self.now
+
+
+class _AccountCache(SQLTableCache):
+    sql_table = 'accounts'
+    sql_columns = ['id', 'email']
+
+    def new_data(self):
+        return {}
+
+    def add_row(self, data, row):
+        data[row[1]] = row[0]
+
+
+class _ChecksumAccountCache(_AccountCache):
+    sql_checksum_columns = ['id', 'email']
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = _Clock()
+    monkeypatch.setattr(cache, 'time', c)
+    return c
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    # Checksum is calculated with MySQL functions, define them in SQLite.
+    monkeypatch.setattr(utils.settings, 'backend', 'mysql')
+
+    e = create_engine('sqlite://')
+
+    @event.listens_for(e, 'connect')
+    def _add_functions(dbapi_conn, conn_record):
+        dbapi_conn.create_function('CRC32', 1, lambda s: zlib.crc32(str(s).encode()))
+        dbapi_conn.create_function('CONCAT_WS', -1, lambda sep, *args: sep.join(str(i) for i in args if i is not None))
+
+    utils.execute_sql(e, "CREATE TABLE accounts (id INTEGER PRIMARY KEY, email VARCHAR(255))")
+    return e
+
+
+def _add(engine, *emails):
+    for e in emails:
+        utils.execute_sql(engine, "INSERT INTO accounts (email) VALUES ('%s')" % e)
+
+
+def test_abstract():
+    with pytest.raises(TypeError):
+        SQLTableCache()
+
+
+def test_sql_table_cache(clock, engine):
+    _add(engine, 'a@x.com', 'b@x.com')
+
+    c = _AccountCache(check_interval=60, max_age=3600)
+    assert c.get(engine) == {'a@x.com': 1, 'b@x.com': 2}
+    assert c.signature == (2, 2)
+
+    # Not checked again before `check_interval`.
+    _add(engine, 'c@x.com')
+    assert 'c@x.com' not in c.get(engine)
+
+    # New rows are loaded incrementally, without reloading all rows.
+    _last_load_time = c.last_load_time
+    clock.now += 60
+    assert c.get(engine) == {'a@x.com': 1, 'b@x.com': 2, 'c@x.com': 3}
+    assert c.signature == (3, 3)
+    assert c.last_load_time == _last_load_time
+
+    # Removed rows cause a full reload.
+    utils.execute_sql(engine, "DELETE FROM accounts WHERE id=1")
+    clock.now += 60
+    assert c.get(engine) == {'b@x.com': 2, 'c@x.com': 3}
+    assert c.signature == (2, 3)
+    assert c.last_load_time == clock.now
+
+    # Row removed and new rows added: not all new rows are loaded
+    # incrementally.
+    utils.execute_sql(engine, "DELETE FROM accounts WHERE id=2")
+    _add(engine, 'd@x.com', 'e@x.com')
+    clock.now += 60
+    assert c.get(engine) == {'c@x.com': 3, 'd@x.com': 4, 'e@x.com': 5}
+
+    # Updated rows are not detected without checksum until `max_age`.
+    utils.execute_sql(engine, "UPDATE accounts SET email='f@x.com' WHERE id=3")
+    clock.now += 60
+    assert 'c@x.com' in c.get(engine)
+
+    clock.now += 3600
+    assert c.get(engine) == {'f@x.com': 3, 'd@x.com': 4, 'e@x.com': 5}
+
+
+def test_sql_table_cache_checksum(clock, engine):
+    _add(engine, 'a@x.com', 'b@x.com')
+
+    c = _ChecksumAccountCache(check_interval=60)
+    assert c.get(engine) == {'a@x.com': 1, 'b@x.com': 2}
+    assert len(c.signature) == 3
+
+    # Updated row is detected.
+    utils.execute_sql(engine, "UPDATE accounts SET email='c@x.com' WHERE id=1")
+    clock.now += 60
+    assert c.get(engine) == {'c@x.com': 1, 'b@x.com': 2}
+
+    # New rows are loaded incrementally.
+    _last_load_time = c.last_load_time
+    _add(engine, 'd@x.com')
+    clock.now += 60
+    assert c.get(engine) == {'c@x.com': 1, 'b@x.com': 2, 'd@x.com': 3}
+    assert c.last_load_time == _last_load_time
+
+    # Row updated and new row added: all rows are reloaded.
+    utils.execute_sql(engine, "UPDATE accounts SET email='e@x.com' WHERE id=2")
+    _add(engine, 'f@x.com')
+    clock.now += 60
+    assert c.get(engine) == {'c@x.com': 1, 'e@x.com': 2, 'd@x.com': 3, 'f@x.com': 4}
+    assert c.last_load_time == clock.now
+
+    # Signature doesn't change if nothing changed.
+    _signature = c.signature
+    clock.now += 60
+    c.get(engine)
+    assert c.signature == _signature
+
+
+def test_sql_table_cache_error():
+    engine = create_engine('sqlite://')
+
+    # Table doesn't exist.
+    c = _AccountCache(check_interval=0)
+    assert c.get(engine) is None
+
+
+def test_lru_cache_ttl(clock):
+    c = LRUCache(max_size=10)
+    c.set('a', 1, ttl=10)
+    c.set('b', 2, ttl=20)
+
+    # Items with zero or negative ttl are not cached.
+    c.set('c', 3, ttl=0)
+
+    assert c.get('a') == 1
+    assert c.get('c') is None
+
+    clock.now += 10
+    assert c.get('a') is None
+    assert c.get('a', default=0) == 0
+    assert c.get('b') == 2
+    assert len(c) == 1
+
+    clock.now += 10
+    assert c.get('b') is None
+    assert len(c) == 0
+
+    assert c.hits == 2
+    assert c.misses == 4
+
+
+def test_lru_cache_eviction():
+    c = LRUCache(max_size=3)
+    for k in ['a', 'b', 'c']:
+        c.set(k, k, ttl=60)
+
+    # 'a' becomes most recently used, 'b' is evicted.
+    assert c.get('a') == 'a'
+    c.set('d', 'd', ttl=60)
+    assert len(c) == 3
+    assert c.get('b') is None
+    assert c.get('a') == 'a'
+    assert c.get('c') == 'c'
+    assert c.get('d') == 'd'
+
+    # Updating existing item doesn't evict others.
+    c.set('a', 'A', ttl=60)
+    assert len(c) == 3
+    assert c.get('a') == 'A'
+
+    c.delete('a')
+    assert c.get('a') is None
+
+    c.clear()
+    assert len(c) == 0
+
+    # Nothing is cached if size is 0.
+    c = LRUCache(max_size=0)
+    c.set('a', 'a', ttl=60)
+    assert c.get('a') is None
+
+
+def test_lru_cache_hit_ratio():
+    c = LRUCache()
+    assert c.hit_ratio() == 0.0
+
+    c.set('a', 1, ttl=60)
+    c.get('a')
+    c.get('b')
+    assert c.hit_ratio() == 50.0
@@ -0,0 +1,117 @@
+import time
+
+import pytest
+from dns import resolver
+
+from libs import SMTP_ACTIONS
+from libs import dnscache
+from plugins import dnsbl
+
+client_address = '11.22.33.44'
+reversed_ip = '44.33.22.11'
+
+
+class _Answer(list):
+    def __init__(self, values, ttl=300):
+        list.__init__(self, values)
+        self.expiration = time.time() + ttl
+
+
+class _Zones:
+    """Fake DNSBL/DNSWL zones."""
+    def __init__(self):
+        # {<query name>: <list of answers>}
+        self.records = {}
+        self.queries = []
+
+    def query(self, qname, rdtype, lifetime=None):
+        self.queries.append(qname)
+
+        if qname.endswith('.slow.test'):
+            time.sleep(dnsbl.settings.DNSBL_TIME_BUDGET + 0.5)
+
+        if qname not in self.records:
+            raise resolver.NXDOMAIN()
+
+        return _Answer(self.records[qname])
+
+
+@pytest.fixture
+def zones(monkeypatch):
+    z = _Zones()
+    monkeypatch.setattr(dnscache, 'query', z.query)
+    monkeypatch.setattr(dnsbl.settings, 'DNSBL_ZONES', {'bl.test': 10,
+                                                       'bl2.test=127.0.0.2': 5,
+                                                       'wl.test': -10})
+    monkeypatch.setattr(dnsbl.settings, 'DNSBL_TIME_BUDGET', 0.5)
+    monkeypatch.setattr(dnsbl, 'reject_score', 10)
+
+    dnsbl._results.clear()
+    yield z
+    dnsbl._results.clear()
+
+
+def _check(client_address=client_address):
+    return dnsbl.restriction(sasl_username='',
+                             sasl_username_domain='',
+                             sender_domain='example.com',
+                             client_address=client_address)
+
+
+def test_not_listed(zones):
+    assert _check() == SMTP_ACTIONS['default']
+    assert len(zones.queries) == 3
+
+
+def test_listed(zones):
+    zones.records[reversed_ip + '.bl.test'] = ['127.0.0.2']
+    assert _check() == SMTP_ACTIONS['reject_dnsbl'] + 'bl.test'
+
+    # Result is cached.
+    assert _check() == SMTP_ACTIONS['reject_dnsbl'] + 'bl.test'
+    assert len(zones.queries) == 3
+
+
+def test_whitelisted(zones):
+    zones.records[reversed_ip + '.bl.test'] = ['127.0.0.2']
+    zones.records[reversed_ip + '.wl.test'] = ['127.0.0.2']
+    assert _check() == SMTP_ACTIONS['default']
+
+
+def test_required_answer(zones):
+    zones.records[reversed_ip + '.bl2.test'] = ['127.0.0.3']
+    assert dnsbl.get_score(client_address) == (0, [])
+
+    dnsbl._results.clear()
+    zones.records[reversed_ip + '.bl2.test'] = ['127.0.0.2']
+    assert dnsbl.get_score(client_address) == (5, ['bl2.test'])
+
+    # Error code returned by DNSBL is not listed.
+    dnsbl._results.clear()
+    zones.records[reversed_ip + '.bl.test'] = ['127.255.255.254']
+    assert dnsbl.get_score(client_address) == (5, ['bl2.test'])
+
+
+def test_time_budget(zones, monkeypatch):
+    monkeypatch.setitem(dnsbl.settings.DNSBL_ZONES, 'slow.test', 10)
+    zones.records[reversed_ip + '.slow.test'] = ['127.0.0.2']
+
+    t = time.time()
+    assert _check() == SMTP_ACTIONS['default']
+    assert time.time() - t < 1
+
+    # Incomplete result is not cached.
+    assert len(dnsbl._results) == 0
+
+
+def test_bypass(zones):
+    # Private IP address.
+    assert _check(client_address='192.168.1.1') == SMTP_ACTIONS['default']
+
+    # Outgoing email.
+    assert dnsbl.restriction(sasl_username='user@example.com',
+                             sasl_username_domain='example.com',
+                             sender_domain='example.com',
+                             client_address=client_address) == SMTP_ACTIONS['default']
+
+    assert zones.queries == []
@@ -0,0 +1,76 @@
+import time
+
+import pytest
+from dns import resolver
+
+from libs import dnscache
+
+
+class _Answer(list):
+    def __init__(self, values, ttl):
+        list.__init__(self, values)
+        self.expiration = time.time() + ttl
+
+
+class _Resolver:
+    """Fake DNS resolver, returns answers of given records."""
+    def __init__(self, records):
+        # {(<qname>, <rdtype>): <list of values>}
+        self.records = records
+        self.queries = []
+
+    def resolve(self, qname, rdtype, lifetime=None):
+        self.queries.append((qname, rdtype))
+
+        if (qname, rdtype) not in self.records:
+            raise resolver.NXDOMAIN()
+
+        return _Answer(self.records[(qname, rdtype)], ttl=300)
+
+
+@pytest.fixture
+def resv(monkeypatch):
+    r = _Resolver({('example.com', 'A'): ['192.0.2.1']})
+    monkeypatch.setattr(dnscache, 'get_dns_resolver', lambda: r)
+
+    dnscache._answers.clear()
+    dnscache._negatives.clear()
+    yield r
+    dnscache._answers.clear()
+    dnscache._negatives.clear()
+
+
+def test_answer_cached(resv):
+    assert dnscache.query('example.com', 'A') == ['192.0.2.1']
+
+    # Query name is case-insensitive.
+    assert dnscache.query('EXAMPLE.com', 'A') == ['192.0.2.1']
+    assert resv.queries == [('example.com', 'A')]
+
+    # Different record type is queried separately.
+    with pytest.raises(resolver.NXDOMAIN):
+        dnscache.query('example.com', 'MX')
+
+    assert len(resv.queries) == 2
+
+
+def test_negative_answer_cached(resv):
+    for _ in range(3):
+        with pytest.raises(resolver.NXDOMAIN):
+            dnscache.query('nx.example.com', 'A')
+
+    assert resv.queries == [('nx.example.com', 'A')]
+
+
+def test_error_not_cached(resv, monkeypatch):
+    def _timeout(qname, rdtype, lifetime=None):
+        resv.queries.append((qname, rdtype))
+        raise resolver.Timeout()
+
+    monkeypatch.setattr(resv, 'resolve', _timeout)
+
+    for _ in range(2):
+        with pytest.raises(resolver.Timeout):
+            dnscache.query('example.com', 'A')
+
+    assert len(resv.queries) == 2
@@ -0,0 +1,239 @@
+import time
+
+from libs import SMTP_ACTIONS
+import settings
+from tests import utils
+from tests import tdata
+
+action_greylisting = SMTP_ACTIONS['greylisting'] + ' ' + settings.GREYLISTING_MESSAGE
+
+
+def _send(client_address=tdata.gl_client, sender=tdata.ext_user, recipient=tdata.user):
+    d = {
+        'sender': sender,
+        'recipient': recipient,
+        'client_address': client_address,
+    }
+    s = utils.set_smtp_session(**d)
+    return utils.send_policy(s)
+
+
+def _prepare(client_address=tdata.gl_client):
+    utils.add_domain()
+    utils.add_user()
+    utils.add_greylisting_setting()
+    utils.delete_greylisting_tracking(client_address=client_address)
+
+
+def test_greylisted():
+    _prepare()
+
+    assert _send() == action_greylisting
+
+    # Retries too soon.
+    assert _send() == action_greylisting
+
+    utils.delete_greylisting_tracking(client_address=tdata.gl_client)
+
+
+def test_whitelisted_client_address():
+    _prepare()
+
+    utils.add_greylisting_whitelist(sender=tdata.gl_client)
+    assert _send() == SMTP_ACTIONS['default']
+
+    # Whitelist removed.
+    utils.remove_greylisting_whitelist(sender=tdata.gl_client)
+    assert _send() == action_greylisting
+
+    utils.delete_greylisting_tracking(client_address=tdata.gl_client)
+
+
+def test_whitelisted_sender():
+    _prepare()
+
+    for sender in [tdata.ext_user, '@' + tdata.ext_domain]:
+        utils.add_greylisting_whitelist(sender=sender)
+        assert _send() == SMTP_ACTIONS['default']
+        utils.remove_greylisting_whitelist(sender=sender)
+
+    # Whitelisted for another recipient.
+    utils.add_greylisting_whitelist(sender=tdata.ext_user, account='@' + tdata.ext_domain)
+    assert _send() == action_greylisting
+    utils.remove_greylisting_whitelist(sender=tdata.ext_user, account='@' + tdata.ext_domain)
+
+    # Whitelisted for recipient domain.
+    utils.add_greylisting_whitelist(sender=tdata.ext_user, account='@' + tdata.domain)
+    assert _send() == SMTP_ACTIONS['default']
+    utils.remove_greylisting_whitelist(sender=tdata.ext_user, account='@' + tdata.domain)
+
+    utils.delete_greylisting_tracking(client_address=tdata.gl_client)
+
+
+def test_whitelisted_network():
+    for (client_address, networks, other_network) in [
+        (tdata.gl_client, ['192.0.2.0/24', '192.0.0.0/16'], '192.0.3.0/24'),
+        (tdata.gl_client_v6, ['2001:db8::/64', '2001:db8::/32'], '2001:db9::/32'),
+    ]:
+        _prepare(client_address=client_address)
+
+        for net in networks:
+            utils.add_greylisting_whitelist(sender=net)
+            assert _send(client_address=client_address) == SMTP_ACTIONS['default']
+            utils.remove_greylisting_whitelist(sender=net)
+
+        utils.add_greylisting_whitelist(sender=other_network)
+        assert _send(client_address=client_address) == action_greylisting
+        utils.remove_greylisting_whitelist(sender=other_network)
+
+        utils.delete_greylisting_tracking(client_address=client_address)
+
+
+def test_whitelisted_by_spf_of_whitelisted_domain():
+    _prepare()
+
+    table = 'greylisting_whitelist_domain_spf'
+    utils.add_greylisting_whitelist(sender='192.0.2.0/24', table=table)
+    assert _send() == SMTP_ACTIONS['default']
+
+    utils.remove_greylisting_whitelist(sender='192.0.2.0/24', table=table)
+    assert _send() == action_greylisting
+
+    utils.delete_greylisting_tracking(client_address=tdata.gl_client)
+
+
+def test_updated_whitelist():
+    _prepare()
+
+    # Cached whitelists notice updated records.
+    utils.add_greylisting_whitelist(sender=tdata.gl_client)
+    assert _send() == SMTP_ACTIONS['default']
+
+    utils.conn_iredapd.update('greylisting_whitelists',
+                              vars={'sender': tdata.gl_client},
+                              where='sender=$sender',
+                              sender='192.0.2.254')
+    assert _send() == action_greylisting
+
+    utils.remove_greylisting_whitelist(sender='192.0.2.254')
+    utils.delete_greylisting_tracking(client_address=tdata.gl_client)
+
+
+def test_no_setting():
+    _prepare()
+    utils.remove_greylisting_setting()
+
+    assert _send() == SMTP_ACTIONS['default']
+
+    utils.delete_greylisting_tracking(client_address=tdata.gl_client)
+
+
+def test_setting_priority():
+    _prepare()
+
+    # Disabled for recipient domain.
+    utils.add_greylisting_setting(account='@' + tdata.domain, active=0)
+    assert _send() == SMTP_ACTIONS['default']
+
+    # Enabled for recipient, it has higher priority.
+    utils.add_greylisting_setting(account=tdata.user, active=1)
+    assert _send() == action_greylisting
+
+    # Disabled for sender domain, sender has lower priority than recipient.
+    utils.add_greylisting_setting(account=tdata.user, sender='@' + tdata.ext_domain, active=0)
+    assert _send() == SMTP_ACTIONS['default']
+
+    utils.remove_greylisting_setting(account=tdata.user, sender='@' + tdata.ext_domain)
+    utils.remove_greylisting_setting(account=tdata.user)
+    utils.remove_greylisting_setting(account='@' + tdata.domain)
+    utils.delete_greylisting_tracking(client_address=tdata.gl_client)
+
+
+def test_setting_of_network():
+    _prepare()
+
+    utils.add_greylisting_setting(sender='192.0.2.0/24', active=0)
+    assert _send() == SMTP_ACTIONS['default']
+    utils.remove_greylisting_setting(sender='192.0.2.0/24')
+
+    # Network with host bits set and IPv6 networks are not matched.
+    utils.add_greylisting_setting(sender='192.0.2.1/24', active=0)
+    assert _send() == action_greylisting
+    utils.remove_greylisting_setting(sender='192.0.2.1/24')
+
+    # Client address is in multiple networks with same priority, the longest
+    # one wins with cached settings (SQL lookup picks a random one).
+    utils.add_greylisting_setting(sender='192.0.0.0/16', active=1)
+    utils.add_greylisting_setting(sender='192.0.2.0/24', active=0)
+    assert _send() == SMTP_ACTIONS['default']
+    utils.remove_greylisting_setting(sender='192.0.0.0/16')
+    utils.remove_greylisting_setting(sender='192.0.2.0/24')
+
+    _prepare(client_address=tdata.gl_client_v6)
+    utils.add_greylisting_setting(sender='2001:db8::/32', active=0)
+    assert _send(client_address=tdata.gl_client_v6) == action_greylisting
+    utils.remove_greylisting_setting(sender='2001:db8::/32')
+
+    utils.delete_greylisting_tracking(client_address=tdata.gl_client)
+    utils.delete_greylisting_tracking(client_address=tdata.gl_client_v6)
+
+
+def test_updated_setting():
+    _prepare()
+
+    utils.add_greylisting_setting(account='@' + tdata.domain, active=0)
+    assert _send() == SMTP_ACTIONS['default']
+
+    # Cached settings notice updated records.
+    utils.conn_iredapd.update('greylisting',
+                              vars={'account': '@' + tdata.domain},
+                              where="account=$account AND sender='@.'",
+                              active=1)
+    assert _send() == action_greylisting
+
+    utils.remove_greylisting_setting(account='@' + tdata.domain)
+    utils.delete_greylisting_tracking(client_address=tdata.gl_client)
+
+
+def test_passed_client():
+    client = tdata.gl_passed_client
+    _prepare(client_address=client)
+
+    assert _send(client_address=client) == action_greylisting
+
+    # Client retries after blocking expired.
+    utils.conn_iredapd.update('greylisting_tracking',
+                              vars={'client_address': client},
+                              where='client_address=$client_address',
+                              block_expired=0)
+    assert _send(client_address=client) == SMTP_ACTIONS['default']
+
+    rows = list(utils.conn_iredapd.select('greylisting_passed_clients',
+                                          vars={'client_address': client},
+                                          what='expire_at',
+                                          where='client_address=$client_address'))
+    assert rows
+    assert rows[0].expire_at > time.time()
+
+    # Other triplets of passed client are not greylisted.
+    assert _send(client_address=client, sender='other@' + tdata.ext_domain) == SMTP_ACTIONS['default']
+
+
+def test_buffered_blocked_count():
+    # Wait for pending updates of previous tests.
+    time.sleep(settings.GREYLISTING_FLUSH_INTERVAL + 1)
+    _prepare()
+
+    for _ in range(3):
+        assert _send() == action_greylisting
+
+    # Increments of `blocked_count` are written in background.
+    time.sleep(settings.GREYLISTING_FLUSH_INTERVAL + 1)
+
+    rows = list(utils.conn_iredapd.select('greylisting_tracking',
+                                          vars={'client_address': tdata.gl_client},
+                                          what='blocked_count',
+                                          where='client_address=$client_address'))
+    assert rows[0].blocked_count == 3
+
+    utils.delete_greylisting_tracking(client_address=tdata.gl_client)
@@ -0,0 +1,81 @@
+# Requires `GREYLISTING_TRACKING_HASHED_KEY = True` and
+# `GREYLISTING_AGGREGATE_CLIENT_NETWORK = True`.
+
+import time
+
+from libs import SMTP_ACTIONS
+from libs import greylisting as lib_gl
+import settings
+from tests import utils
+from tests import tdata
+
+action_greylisting = SMTP_ACTIONS['greylisting'] + ' ' + settings.GREYLISTING_MESSAGE
+
+
+def _send(sender=tdata.ext_user, recipient=tdata.user):
+    d = {
+        'sender': sender,
+        'recipient': recipient,
+        'client_address': tdata.gl_hashed_client,
+    }
+    s = utils.set_smtp_session(**d)
+    return utils.send_policy(s)
+
+
+def _get_hash(sender=tdata.ext_user, recipient=tdata.user):
+    rows = list(utils.conn_iredapd.select('greylisting_tracking',
+                                          vars={'sender': sender,
+                                                'recipient': recipient,
+                                                'client_address': tdata.gl_hashed_net},
+                                          what='triplet_hash',
+                                          where='sender=$sender AND recipient=$recipient AND client_address=$client_address'))
+    assert len(rows) == 1
+
+    if rows[0].triplet_hash is None:
+        return None
+
+    return bytes(rows[0].triplet_hash)
+
+
+def test_record_without_hash():
+    # Must be the first test: record without hash is created by old iRedAPD
+    # and must be found before iRedAPD knows all records have hash.
+    utils.add_domain()
+    utils.add_user()
+    utils.add_greylisting_setting()
+    utils.delete_greylisting_tracking(client_address=tdata.gl_hashed_net)
+
+    now = int(time.time())
+    utils.conn_iredapd.insert('greylisting_tracking',
+                              sender=tdata.ext_user,
+                              recipient=tdata.user,
+                              client_address=tdata.gl_hashed_net,
+                              sender_domain=tdata.ext_domain,
+                              rcpt_domain=tdata.domain,
+                              init_time=now - 3600,
+                              block_expired=0,
+                              record_expired=now + 3600)
+
+    # Block expired, passed.
+    assert _send() == SMTP_ACTIONS['default']
+
+    # Hash filled up.
+    assert _get_hash() == lib_gl.get_triplet_hash(tdata.ext_user,
+                                                  tdata.user,
+                                                  tdata.gl_hashed_net)
+
+
+def test_new_record_has_hash():
+    # Network passed greylisting in previous test.
+    utils.delete_greylisting_tracking(client_address=tdata.gl_hashed_net)
+
+    sender = 'hashed@' + tdata.ext_domain
+    assert _send(sender=sender) == action_greylisting
+    assert _get_hash(sender=sender) == lib_gl.get_triplet_hash(sender,
+                                                               tdata.user,
+                                                               tdata.gl_hashed_net)
+
+    # Retries too soon.
+    assert _send(sender=sender) == action_greylisting
+
+    utils.delete_greylisting_tracking(client_address=tdata.gl_hashed_net)
@@ -0,0 +1,53 @@
+# Requires `GREYLISTING_AGGREGATE_CLIENT_NETWORK = True` (IPv4 /24).
+
+from libs import SMTP_ACTIONS
+import settings
+from tests import utils
+from tests import tdata
+
+action_greylisting = SMTP_ACTIONS['greylisting'] + ' ' + settings.GREYLISTING_MESSAGE
+
+
+def _send(client_address, sender=tdata.ext_user, recipient=tdata.user):
+    d = {
+        'sender': sender,
+        'recipient': recipient,
+        'client_address': client_address,
+    }
+    s = utils.set_smtp_session(**d)
+    return utils.send_policy(s)
+
+
+def test_retry_from_same_network():
+    utils.add_domain()
+    utils.add_user()
+    utils.add_greylisting_setting()
+    utils.delete_greylisting_tracking(client_address=tdata.gl_net)
+
+    assert _send(client_address=tdata.gl_net_client) == action_greylisting
+
+    # Tracked by network.
+    rows = list(utils.conn_iredapd.select('greylisting_tracking',
+                                          vars={'client_address': tdata.gl_net},
+                                          what='id',
+                                          where='client_address=$client_address'))
+    assert len(rows) == 1
+
+    # Retry from another server of same network, too soon.
+    assert _send(client_address=tdata.gl_net_client2) == action_greylisting
+
+    # Retry after blocking expired.
+    utils.conn_iredapd.update('greylisting_tracking',
+                              vars={'client_address': tdata.gl_net},
+                              where='client_address=$client_address',
+                              block_expired=0)
+    assert _send(client_address=tdata.gl_net_client2) == SMTP_ACTIONS['default']
+
+    # Whole network passed greylisting.
+    rows = list(utils.conn_iredapd.select('greylisting_passed_clients',
+                                          vars={'client_address': tdata.gl_net},
+                                          what='expire_at',
+                                          where='client_address=$client_address'))
+    assert rows
+
+    assert _send(client_address=tdata.gl_net_client, sender='other@' + tdata.ext_domain) == SMTP_ACTIONS['default']
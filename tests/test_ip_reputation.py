@@ -0,0 +1,49 @@
+import ipaddress
+
+import pytest
+
+from libs import SMTP_ACTIONS
+from libs import ipreputation
+from plugins import ip_reputation
+
+
+def _range(network):
+    net = ipaddress.ip_network(network)
+    return (int(net.network_address), int(net.broadcast_address))
+
+
+@pytest.fixture
+def path(tmp_path, monkeypatch):
+    path = str(tmp_path / 'ip_reputation.bin')
+    ipreputation.write_file(path, [_range('192.0.2.0/24')], [_range('2001:db8::/32')])
+
+    monkeypatch.setattr(ip_reputation,
+                        '_lists',
+                        [ipreputation.IPReputationList(path=path, check_interval=0)])
+    return path
+
+
+def _check(client_address, sasl_username=''):
+    return ip_reputation.restriction(sasl_username=sasl_username,
+                                     client_address=client_address)
+
+
+def test_listed(path):
+    assert _check('192.0.2.1') == SMTP_ACTIONS['reject_ip_reputation']
+    assert _check('2001:db8::1') == SMTP_ACTIONS['reject_ip_reputation']
+
+
+def test_not_listed(path):
+    assert _check('198.51.100.1') == SMTP_ACTIONS['default']
+    assert _check('2001:db9::1') == SMTP_ACTIONS['default']
+
+
+def test_outgoing(path):
+    assert _check('192.0.2.1', sasl_username='user@example.com') == SMTP_ACTIONS['default']
+
+
+def test_file_updated(path):
+    ipreputation.write_file(path, [_range('198.51.100.0/24')], [])
+
+    assert _check('192.0.2.1') == SMTP_ACTIONS['default']
+    assert _check('198.51.100.1') == SMTP_ACTIONS['reject_ip_reputation']
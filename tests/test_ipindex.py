@@ -0,0 +1,78 @@
+import ipaddress
+
+from libs.ipindex import IPNetworkIndex
+
+
+def test_longest_prefix_match():
+    idx = IPNetworkIndex()
+    assert idx.add('10.0.0.0/8', '/8')
+    assert idx.add('10.1.0.0/16', '/16')
+    assert idx.add('10.1.2.0/24', '/24')
+    assert idx.add('10.1.2.3/32', '/32')
+
+    assert len(idx) == 4
+    assert idx.lookup('10.1.2.3') == '/32'
+    assert idx.lookup('10.1.2.4') == '/24'
+    assert idx.lookup('10.1.3.4') == '/16'
+    assert idx.lookup('10.2.3.4') == '/8'
+    assert idx.lookup('11.0.0.1') is None
+    assert idx.lookup(ipaddress.ip_address('10.1.2.3')) == '/32'
+
+    assert idx.lookup_all('10.1.2.3') == ['/32', '/24', '/16', '/8']
+    assert idx.lookup_all('10.2.3.4') == ['/8']
+    assert idx.lookup_all('11.0.0.1') == []
+
+
+def test_ipv6():
+    idx = IPNetworkIndex()
+    idx.add('2001:db8::/32', '/32')
+    idx.add('2001:db8:1::/48', '/48')
+
+    assert idx.lookup('2001:db8:1::1') == '/48'
+    assert idx.lookup('2001:db8:2::1') == '/32'
+    assert idx.lookup('2001:db9::1') is None
+
+    # IPv4 networks don't match IPv6 addresses, and vice versa.
+    idx.add('0.0.0.0/0', 'any4')
+    assert idx.lookup('2001:db9::1') is None
+    assert idx.lookup('192.0.2.1') == 'any4'
+
+
+def test_non_strict_network():
+    idx = IPNetworkIndex()
+
+    # Host bits are ignored.
+    assert idx.add('192.0.2.10/24')
+    assert '192.0.2.200' in idx
+    assert '192.0.3.1' not in idx
+
+
+def test_invalid():
+    idx = IPNetworkIndex()
+    assert not idx.add('not-a-network')
+    assert not idx.add('10.0.0.0/33')
+    assert len(idx) == 0
+
+    idx.add('10.0.0.0/8')
+    assert idx.lookup('not-an-ip') is None
+    assert idx.lookup('not-an-ip', default=False) is False
+    assert idx.lookup_all('not-an-ip') == []
+
+
+def test_replace_and_remove():
+    idx = IPNetworkIndex()
+    idx.add('10.0.0.0/8', 'old')
+    idx.add('10.0.0.0/8', 'new')
+    assert len(idx) == 1
+    assert idx.lookup('10.0.0.1') == 'new'
+
+    idx.add('10.1.0.0/16', '/16')
+    assert idx.remove('10.1.0.0/16')
+    assert not idx.remove('10.1.0.0/16')
+    assert not idx.remove('invalid')
+    assert len(idx) == 1
+    assert idx.lookup('10.1.0.1') == 'new'
+
+    assert idx.remove('10.0.0.0/8')
+    assert len(idx) == 0
+    assert idx.lookup('10.1.0.1') is None
@@ -0,0 +1,90 @@
+import ipaddress
+
+import pytest
+
+from libs import ipreputation
+
+
+def _range(network):
+    net = ipaddress.ip_network(network)
+    return (int(net.network_address), int(net.broadcast_address))
+
+
+def test_merge_ranges():
+    assert ipreputation.merge_ranges([]) == []
+    assert ipreputation.merge_ranges([(10, 20), (1, 5), (6, 8), (15, 30), (40, 50)]) == [[1, 8], [10, 30], [40, 50]]
+    assert ipreputation.merge_ranges([(1, 100), (10, 20)]) == [[1, 100]]
+
+
+def test_lookup(tmp_path):
+    path = str(tmp_path / 'ip_reputation.bin')
+
+    ranges_v4 = [_range('192.0.2.0/24'),
+                 _range('198.51.100.7/32'),
+                 _range('203.0.113.0/25'),
+                 # Adjacent, merged with previous one.
+                 _range('203.0.113.128/25')]
+    ranges_v6 = [_range('2001:db8::/48')]
+
+    assert ipreputation.write_file(path, ranges_v4, ranges_v6) == (3, 1)
+
+    f = ipreputation.IPReputationFile(path)
+    assert len(f) == 4
+
+    # Boundaries of ranges.
+    assert f.lookup('192.0.2.0')
+    assert f.lookup('192.0.2.255')
+    assert not f.lookup('192.0.1.255')
+    assert not f.lookup('192.0.3.0')
+
+    assert f.lookup('198.51.100.7')
+    assert not f.lookup('198.51.100.6')
+    assert not f.lookup('198.51.100.8')
+
+    assert f.lookup('203.0.113.127')
+    assert f.lookup('203.0.113.128')
+    assert f.lookup('203.0.113.255')
+
+    # Before first range and after last range.
+    assert not f.lookup('0.0.0.0')
+    assert not f.lookup('255.255.255.255')
+
+    assert f.lookup('2001:db8::1')
+    assert f.lookup(ipaddress.ip_address('2001:db8:0:ffff::1'))
+    assert not f.lookup('2001:db8:1::1')
+    assert not f.lookup('::1')
+
+    assert not f.lookup('invalid')
+
+
+def test_empty_file(tmp_path):
+    path = str(tmp_path / 'ip_reputation.bin')
+    ipreputation.write_file(path, [], [])
+
+    f = ipreputation.IPReputationFile(path)
+    assert len(f) == 0
+    assert not f.lookup('192.0.2.1')
+    assert not f.lookup('2001:db8::1')
+
+
+def test_invalid_file(tmp_path):
+    path = tmp_path / 'ip_reputation.bin'
+    path.write_bytes(b'not a reputation file' * 2)
+
+    with pytest.raises(ValueError):
+        ipreputation.IPReputationFile(str(path))
+
+
+def test_reload(tmp_path):
+    path = str(tmp_path / 'ip_reputation.bin')
+    lst = ipreputation.IPReputationList(path, check_interval=0)
+
+    # File doesn't exist yet.
+    assert not lst.lookup('192.0.2.1')
+
+    ipreputation.write_file(path, [_range('192.0.2.0/24')], [])
+    assert lst.lookup('192.0.2.1')
+
+    ipreputation.write_file(path, [_range('198.51.100.0/24'), _range('203.0.113.0/24')], [])
+    assert not lst.lookup('192.0.2.1')
+    assert lst.lookup('203.0.113.1')
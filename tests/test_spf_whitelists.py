@@ -0,0 +1,108 @@
+import pytest
+from sqlalchemy import create_engine
+
+from libs import utils
+from libs import greylisting as lib_gl
+
+
+@pytest.fixture
+def engine():
+    e = create_engine('sqlite://')
+    utils.execute_sql(e, "CREATE TABLE greylisting_whitelist_domains (domain VARCHAR(255))")
+    utils.execute_sql(e, """CREATE TABLE greylisting_whitelist_domain_spf (account VARCHAR(255),
+                                                                            sender VARCHAR(255),
+                                                                            comment VARCHAR(255))""")
+    utils.execute_sql(e, """CREATE TABLE greylisting_tracking (sender VARCHAR(255),
+                                                                recipient VARCHAR(255),
+                                                                client_address VARCHAR(40))""")
+    return e
+
+
+@pytest.fixture
+def dns(monkeypatch):
+    # {<domain>: (<set of ips>, <ttl>)}
+    records = {}
+    monkeypatch.setattr(lib_gl,
+                        'resolve_whitelist_domains',
+                        lambda domains, max_workers=10: {d: records[d] for d in domains})
+    return records
+
+
+def _add_domains(engine, *domains):
+    for d in domains:
+        utils.execute_sql(engine, "INSERT INTO greylisting_whitelist_domains (domain) VALUES ('%s')" % d)
+
+
+def _get_whitelists(engine):
+    qr = utils.execute_sql(engine, "SELECT sender, comment FROM greylisting_whitelist_domain_spf")
+    return {r[0]: r[1] for r in qr.fetchall()}
+
+
+def test_refresh_domains_listing_same_ip(engine, dns):
+    _add_domains(engine, 'a.com', 'b.com')
+    dns['a.com'] = ({'192.0.2.1', '192.0.2.2'}, 300)
+    dns['b.com'] = ({'192.0.2.1'}, 300)
+
+    r = lib_gl.SPFWhitelistRefresher(engine_iredapd=engine)
+    r.run_once()
+
+    wl = _get_whitelists(engine)
+    assert sorted(wl) == ['192.0.2.1', '192.0.2.2']
+
+    # Domain which the whitelist is attributed to doesn't list it anymore,
+    # but the other one still lists it.
+    _owner = wl['192.0.2.1']
+    _domain = _owner.split(' ')[-1]
+    dns[_domain] = (dns[_domain][0] - {'192.0.2.1'}, 300)
+    r.schedule[_domain] = 0
+    r.run_once()
+
+    wl = _get_whitelists(engine)
+    assert '192.0.2.1' in wl
+    assert wl['192.0.2.1'] != _owner
+
+    # None of them lists it.
+    _domain = wl['192.0.2.1'].split(' ')[-1]
+    dns[_domain] = (dns[_domain][0] - {'192.0.2.1'}, 300)
+    r.schedule[_domain] = 0
+    r.run_once()
+
+    assert sorted(_get_whitelists(engine)) == ['192.0.2.2']
+
+
+def test_remove_domain_listing_same_ip(engine, dns):
+    _add_domains(engine, 'a.com', 'b.com')
+    dns['a.com'] = ({'192.0.2.1'}, 300)
+    dns['b.com'] = ({'192.0.2.1', '192.0.2.2'}, 300)
+
+    r = lib_gl.SPFWhitelistRefresher(engine_iredapd=engine)
+    r.run_once()
+
+    _domain = _get_whitelists(engine)['192.0.2.1'].split(' ')[-1]
+    _other = ({'a.com', 'b.com'} - {_domain}).pop()
+
+    utils.execute_sql(engine, "DELETE FROM greylisting_whitelist_domains WHERE domain='%s'" % _domain)
+    r.last_load_time = 0.1
+    r.run_once()
+
+    wl = _get_whitelists(engine)
+    assert wl['192.0.2.1'] == 'AUTO-UPDATE: ' + _other
+    assert set(wl.values()) == {'AUTO-UPDATE: ' + _other}
+
+
+def test_failed_domain_kept(engine, dns):
+    _add_domains(engine, 'a.com')
+    utils.execute_sql(engine, """INSERT INTO greylisting_whitelist_domain_spf (account, sender, comment)
+                                      VALUES ('@.', '192.0.2.1', 'AUTO-UPDATE: a.com'),
+                                             ('@.', '192.0.2.9', 'AUTO-UPDATE: removed.com'),
+                                             ('@.', '192.0.2.10', 'manual')""")
+
+    # Failed to query DNS records, whitelists of domains removed while
+    # iRedAPD is not running are removed on first run.
+    dns['a.com'] = (set(), 0)
+
+    r = lib_gl.SPFWhitelistRefresher(engine_iredapd=engine)
+    r.run_once()
+
+    assert _get_whitelists(engine) == {'192.0.2.1': 'AUTO-UPDATE: a.com',
+                                       '192.0.2.10': 'manual'}
@@ -0,0 +1,73 @@
+# Requires `THROTTLE_CHECK_AT_RCPT = True`.
+
+from libs import SMTP_ACTIONS
+from tests import utils
+from tests import tdata
+
+
+def _send(instance, protocol_state='RCPT', size=100, recipient_count=0):
+    d = {
+        'sasl_username': tdata.user,
+        'sender': tdata.user,
+        'recipient': tdata.ext_user,
+        'protocol_state': protocol_state,
+        'instance': instance,
+        'size': size,
+        'recipient_count': recipient_count,
+    }
+    s = utils.set_smtp_session(**d)
+    return utils.send_policy(s)
+
+
+def _prepare(**kw):
+    utils.add_domain()
+    utils.add_user()
+    utils.add_throttle(**kw)
+
+
+def test_msg_size_at_rcpt():
+    _prepare(msg_size=1000)
+
+    # Declared message size is checked at RCPT state.
+    assert _send(instance='throttle.1', size=1001) == SMTP_ACTIONS['reject_msg_size_exceeded']
+    assert _send(instance='throttle.2', size=1000) == SMTP_ACTIONS['default']
+
+    utils.remove_throttle()
+
+
+def test_max_rcpts_at_rcpt():
+    _prepare(max_rcpts=2)
+
+    # Recipients accepted in same mail transaction are counted.
+    assert _send(instance='throttle.3') == SMTP_ACTIONS['default']
+    assert _send(instance='throttle.3') == SMTP_ACTIONS['default']
+    assert _send(instance='throttle.3') == SMTP_ACTIONS['reject_max_rcpts_exceeded']
+
+    # Other mail transactions are not affected.
+    assert _send(instance='throttle.4') == SMTP_ACTIONS['default']
+
+    # Count is reset after END-OF-MESSAGE.
+    assert _send(instance='throttle.3',
+                 protocol_state='END-OF-MESSAGE',
+                 recipient_count=2) == SMTP_ACTIONS['default']
+    assert _send(instance='throttle.3') == SMTP_ACTIONS['default']
+
+    utils.remove_throttle()
+
+
+def test_max_msgs_at_rcpt():
+    _prepare(max_msgs=1)
+
+    # Tracking data is not updated at RCPT state.
+    assert _send(instance='throttle.5') == SMTP_ACTIONS['default']
+    assert _send(instance='throttle.6') == SMTP_ACTIONS['default']
+
+    # Accounted at END-OF-MESSAGE state.
+    assert _send(instance='throttle.6',
+                 protocol_state='END-OF-MESSAGE',
+                 recipient_count=1) == SMTP_ACTIONS['default']
+
+    # Quota is exhausted, rejected at RCPT state.
+    assert _send(instance='throttle.7') == SMTP_ACTIONS['reject_quota_exceeded']
+
+    utils.remove_throttle()
@@ -84,3 +84,33 @@ def test_blacklist_subdomain_match():
     assert action == SMTP_ACTIONS['reject_blacklisted_rdns'] + ' (' + rdns + ')'
 
     utils.remove_wblist_rdns_blacklist(rdns=rdns)
+
+
+def test_updated_whitelist():
+    utils.add_domain()
+    utils.add_user()
+
+    rdns = tdata.rdns_exact_name
+    utils.add_wblist_rdns_whitelist(rdns=rdns)
+
+    d = {
+        'sender': tdata.ext_user,
+        'recipient': tdata.user,
+        'reverse_client_name': rdns,
+    }
+
+    s = utils.set_smtp_session(**d)
+    action = utils.send_policy(s)
+
+    assert action == SMTP_ACTIONS['default']
+
+    # Whitelist changed to blacklist, cached rDNS names must be reloaded.
+    utils.conn_iredapd.update('wblist_rdns',
+                              vars={'rdns': rdns},
+                              where='rdns=$rdns',
+                              wb='B')
+
+    action = utils.send_policy(s)
+    assert action != SMTP_ACTIONS['default']
+
+    utils.remove_wblist_rdns_blacklist(rdns=rdns)
@@ -4,6 +4,7 @@ import web
 import settings
 from libs.logger import logger
 from libs import MAILLIST_POLICY_PUBLIC
+from libs import greylisting as lib_gl
 from tests import tdata
 
 web.config.debug = False
@@ -83,11 +84,14 @@ def send_policy(d):
     """Send smtp session data to Postfix policy server. Return policy action."""
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     s.connect(('127.0.0.1', 7777))
-    s.sendall(d)
+    s.sendall(d.encode())
     reply = s.recv(1024)
     s.close()
 
-    reply = reply.strip().lstrip(b'action=')
+    reply = reply.decode().strip()
+    if reply.startswith('action='):
+        reply = reply[len('action='):]
+
     return reply
 
 
@@ -241,3 +245,67 @@ def remove_wblist_rdns_blacklist(rdns):
     conn_iredapd.delete('wblist_rdns',
                         vars={'rdns': rdns},
                         where="rdns=$rdns AND wb='B'")
+
+
+def add_greylisting_setting(account='@.', sender='@.', active=1):
+    remove_greylisting_setting(account=account, sender=sender)
+
+    gl_setting = lib_gl.get_gl_base_setting(account=account, sender=sender)
+    gl_setting['active'] = active
+    conn_iredapd.insert('greylisting', **gl_setting)
+
+
+def remove_greylisting_setting(account='@.', sender='@.'):
+    conn_iredapd.delete('greylisting',
+                        vars={'account': account, 'sender': sender},
+                        where='account=$account AND sender=$sender')
+
+
+def add_greylisting_whitelist(sender, account='@.', table='greylisting_whitelists'):
+    remove_greylisting_whitelist(sender=sender, account=account, table=table)
+    conn_iredapd.insert(table,
+                        account=account,
+                        sender=sender,
+                        comment='unittest')
+
+
+def remove_greylisting_whitelist(sender, account='@.', table='greylisting_whitelists'):
+    conn_iredapd.delete(table,
+                        vars={'account': account, 'sender': sender},
+                        where='account=$account AND sender=$sender')
+
+
+def delete_greylisting_tracking(client_address):
+    conn_iredapd.delete('greylisting_tracking',
+                        vars={'client_address': client_address},
+                        where='client_address=$client_address')
+
+    conn_iredapd.delete('greylisting_passed_clients',
+                        vars={'client_address': client_address},
+                        where='client_address=$client_address')
+
+
+def add_throttle(account=tdata.user, kind='outbound', period=60, **kw):
+    remove_throttle(account=account, kind=kind)
+    conn_iredapd.insert('throttle',
+                        account=account,
+                        kind=kind,
+                        period=period,
+                        **kw)
+
+
+def remove_throttle(account=tdata.user, kind='outbound'):
+    qr = conn_iredapd.select('throttle',
+                             vars={'account': account, 'kind': kind},
+                             what='id',
+                             where='account=$account AND kind=$kind')
+    ids = [r.id for r in qr]
+
+    if ids:
+        conn_iredapd.delete('throttle_tracking',
+                            vars={'ids': ids},
+                            where='tid IN $ids')
+
+        conn_iredapd.delete('throttle',
+                            vars={'ids': ids},
+                            where='id IN $ids')
@@ -82,6 +82,151 @@ def sql_count_id(conn, table, column='id', where=None):
     return total
 
 
+def estimate_sql_table_rows(conn, sql_table):
+    """Return estimated number of rows in given sql table.
+
+    It reads table statistics maintained by SQL server instead of scanning
+    the whole table with `COUNT()`, so it's fast but not accurate.
+    """
+    if sql_dbn == 'mysql':
+        qr = conn.query("""SELECT TABLE_ROWS AS total
+                             FROM information_schema.TABLES
+                            WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME=$table
+                            LIMIT 1""",
+                        vars={'table': sql_table})
+    else:
+        # Partitioned table doesn't have statistics itself, sum up all
+        # partitions.
+        qr = conn.query("""SELECT SUM(GREATEST(c.reltuples, 0))::BIGINT AS total
+                             FROM pg_class c
+                            WHERE c.relname=$table
+                               OR c.oid IN (SELECT i.inhrelid
+                                              FROM pg_inherits i
+                                              JOIN pg_class p ON p.oid = i.inhparent
+                                             WHERE p.relname=$table)""",
+                        vars={'table': sql_table})
+
+    qr = list(qr)
+    if qr:
+        return int(qr[0].total or 0)
+
+    return 0
+
+
+def get_partition_column(conn, sql_table):
+    """Return name of the column used as partition key of given sql table
+    partitioned by RANGE, or None if table is not partitioned by RANGE on a
+    single column."""
+    if sql_dbn == 'mysql':
+        qr = conn.query("""SELECT DISTINCT PARTITION_EXPRESSION AS expr
+                             FROM information_schema.PARTITIONS
+                            WHERE TABLE_SCHEMA=DATABASE()
+                                  AND TABLE_NAME=$table
+                                  AND PARTITION_METHOD IN ('RANGE', 'RANGE COLUMNS')""",
+                        vars={'table': sql_table})
+        exprs = [str(r.expr or '').strip().strip('`').strip() for r in qr]
+    else:
+        qr = conn.query("""SELECT a.attname AS expr
+                             FROM pg_partitioned_table pt
+                             JOIN pg_class c ON c.oid = pt.partrelid
+                             JOIN pg_attribute a ON a.attrelid = pt.partrelid
+                                                AND a.attnum = ANY(pt.partattrs::int2[])
+                            WHERE c.relname=$table
+                                  AND pt.partstrat='r'
+                                  AND pt.partnatts=1""",
+                        vars={'table': sql_table})
+        exprs = [str(r.expr) for r in qr]
+
+    if len(exprs) == 1 and exprs[0].isidentifier():
+        return exprs[0]
+
+    return None
+
+
+def get_expired_partitions(conn, sql_table, column, max_value):
+    """Return names of partitions of given sql table which store only rows
+    with value of `column` smaller than `max_value`.
+
+    Only tables partitioned by RANGE on given integer column are supported.
+    Returns an empty list if table is not partitioned, or partitioned on
+    another column.
+    """
+    partitions = []
+
+    _column = get_partition_column(conn=conn, sql_table=sql_table)
+    if not _column:
+        return partitions
+
+    if _column.lower() != column.lower():
+        logger.info("* {:20}: partitioned by column `{}` instead of `{}`, "
+                    "expired partitions are not dropped.".format(sql_table, _column, column))
+        return partitions
+
+    if sql_dbn == 'mysql':
+        qr = conn.query("""SELECT PARTITION_NAME AS name,
+                                  PARTITION_DESCRIPTION AS upper_bound
+                             FROM information_schema.PARTITIONS
+                            WHERE TABLE_SCHEMA=DATABASE()
+                                  AND TABLE_NAME=$table
+                                  AND PARTITION_METHOD='RANGE'""",
+                        vars={'table': sql_table})
+
+        for r in qr:
+            # Partition defined with `VALUES LESS THAN (<upper_bound>)`.
+            # `MAXVALUE` partition is never dropped.
+            try:
+                if int(r.upper_bound) <= max_value:
+                    partitions.append(r.name)
+            except (TypeError, ValueError):
+                pass
+    else:
+        qr = conn.query("""SELECT c.relname AS name,
+                                  pg_get_expr(c.relpartbound, c.oid) AS bound
+                             FROM pg_inherits i
+                             JOIN pg_class c ON c.oid = i.inhrelid
+                             JOIN pg_class p ON p.oid = i.inhparent
+                            WHERE p.relname=$table""",
+                        vars={'table': sql_table})
+
+        for r in qr:
+            # Partition defined with `FOR VALUES FROM (...) TO (<upper_bound>)`.
+            _bound = (r.bound or '').split(' TO ', 1)
+            if len(_bound) != 2:
+                continue
+
+            try:
+                if int(_bound[1].strip("()' ")) <= max_value:
+                    partitions.append(r.name)
+            except ValueError:
+                pass
+
+    return partitions
+
+
+def drop_expired_partitions(conn, sql_table, column, max_value):
+    """Drop partitions of given sql table which store only expired rows,
+    all rows have value of `column` smaller than `max_value`.
+
+    It's much cheaper than deleting expired rows one by one. Table must be
+    partitioned by RANGE on the column used to expire rows (`column`),
+    otherwise nothing is dropped and expired rows are deleted one by one.
+    """
+    partitions = get_expired_partitions(conn=conn,
+                                        sql_table=sql_table,
+                                        column=column,
+                                        max_value=max_value)
+
+    for p in partitions:
+        if sql_dbn == 'mysql':
+            conn.query("ALTER TABLE {} DROP PARTITION {}".format(sql_table, p))
+        else:
+            conn.query("DROP TABLE {}".format(p))
+
+        logger.info("* {:20}: dropped expired partition: {}.".format(sql_table, p))
+
+    return partitions
+
+
 # Removing limited records each time from single table.
 def cleanup_sql_table(conn,
                       sql_table,
@@ -117,7 +262,5 @@ def cleanup_sql_table(conn,
         loops += 1
 
     if print_left_rows:
-        _qr = conn.select(sql_table, what="COUNT({}) AS total".format(unique_index_column))
-        total = _qr[0].total or 0
-
-        logger.info("* {:20}: {} left.".format(sql_table, total))
+        total = estimate_sql_table_rows(conn=conn, sql_table=sql_table)
+        logger.info("* {:20}: about {} left.".format(sql_table, total))
@@ -16,28 +16,53 @@ import web
 web.config.debug = False
 
 import settings
-from tools import get_db_conn, cleanup_sql_table
+from tools import logger, get_db_conn, cleanup_sql_table, drop_expired_partitions
 
 backend = settings.backend
 now = int(time.time())
 conn_iredapd = get_db_conn('iredapd')
 
+
+def drop_partitions(sql_table, column, max_value):
+    if not settings.CLEANUP_DROP_EXPIRED_PARTITIONS:
+        return None
+
+    try:
+        drop_expired_partitions(conn=conn_iredapd,
+                                sql_table=sql_table,
+                                column=column,
+                                max_value=max_value)
+    except Exception as e:
+        logger.error("* {:20}: failed in dropping expired partitions: {}".format(sql_table, repr(e)))
+
+
 #
 # Throttling
 #
+drop_partitions(sql_table='throttle_tracking', column='expire_at', max_value=now)
 cleanup_sql_table(conn=conn_iredapd,
                   sql_table='throttle_tracking',
-                  sql_where='(init_time + period) < %d' % now,
+                  sql_where='expire_at < %d' % now,
                   print_left_rows=True)
 
 #
 # Greylisting tracking records.
 #
+drop_partitions(sql_table='greylisting_tracking', column='record_expired', max_value=now)
 cleanup_sql_table(conn=conn_iredapd,
                   sql_table='greylisting_tracking',
                   sql_where='record_expired < %d' % now,
                   print_left_rows=True)
 
+#
+# Client addresses which passed greylisting.
+#
+cleanup_sql_table(conn=conn_iredapd,
+                  sql_table='greylisting_passed_clients',
+                  unique_index_column='client_address',
+                  sql_where='expire_at < %d' % now,
+                  print_left_rows=True)
+
 #
 # Clean up cached senderscore results.
 #
@@ -52,6 +77,7 @@ cleanup_sql_table(conn=conn_iredapd,
 # Clean up `smtp_sessions`
 #
 expire_seconds = int(time.time()) - (settings.LOG_SMTP_SESSIONS_EXPIRE_DAYS * 86400)
+drop_partitions(sql_table='smtp_sessions', column='time_num', max_value=expire_seconds)
 cleanup_sql_table(conn=conn_iredapd,
                   sql_table='smtp_sessions',
                   sql_where='time_num < %d' % expire_seconds,
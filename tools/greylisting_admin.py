@@ -4,6 +4,7 @@
 
 import os
 import sys
+import time
 
 os.environ['LC_ALL'] = 'C'
 
@@ -64,6 +65,22 @@ USAGE = """Usage:
     --add-whitelist
         Whitelist specified sender for greylisting service.
 
+    --import <file>
+        Import greylisting settings from given file. Each line contains
+        sender, recipient and status (enable or disable) separated by
+        whitespace, empty lines and lines start with '#' are ignored. Use
+        '-' to read from stdin. For example:
+
+            @. @example.com enable
+            @gmail.com user@example.com disable
+
+        Settings are imported in batches, existing setting of same sender
+        and recipient is replaced.
+
+    --export <file>
+        Export ALL greylisting settings to given file, in same format as
+        `--import`.
+
 Sample usages:
 
     * List all existing greylisting settings:
@@ -109,8 +126,15 @@ Sample usages:
       from anyone to local domain `test.com`:
 
         # python greylisting_admin.py --delete --to '@test.com'
+
+    * Import greylisting settings from a file:
+
+        # python greylisting_admin.py --import /path/to/greylisting.txt
 """
 
+# Number of settings imported with one SQL statement.
+IMPORT_BATCH_SIZE = 1000
+
 if len(sys.argv) == 1:
     print(USAGE)
     sys.exit()
@@ -149,6 +173,21 @@ elif '--list-whitelists' in args:
 elif '--add-whitelist' in args:
     action = 'add-whitelist'
     args.remove('--add-whitelist')
+elif '--import' in args or '--export' in args:
+    if '--import' in args:
+        action = 'import'
+    else:
+        action = 'export'
+
+    index = args.index('--' + action)
+    if index + 1 >= len(args):
+        sys.exit('<<< ERROR >>> No file specified for --{}.'.format(action))
+
+    gl_file = args[index + 1]
+
+    # Remove them.
+    args.pop(index)
+    args.pop(index)
 else:
     sys.exit('<<< ERROR >>> No valid operation specified. Exit.')
 
@@ -318,3 +357,70 @@ elif action == 'add-whitelist':
 
     except Exception as e:
         logger.info(repr(e))
+elif action == 'import':
+    if gl_file == '-':
+        f = sys.stdin
+    else:
+        f = open(gl_file, encoding='utf-8', errors='ignore')
+
+    _start = time.time()
+    num_imported = 0
+    num_lines = 0
+    batch = []
+
+    def _import_batch(batch):
+        qr = lib_gl.import_settings(engine_iredapd=engine_iredapd, records=batch)
+        if not qr[0]:
+            sys.exit('<<< ERROR >>> {}'.format(qr[1]))
+
+        return qr[1]
+
+    for line in f:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+
+        num_lines += 1
+
+        _fields = line.split()
+        if len(_fields) != 3 or _fields[2].lower() not in ['enable', 'disable']:
+            continue
+
+        batch.append((_fields[1], _fields[0], _fields[2].lower() == 'enable'))
+
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            num_imported += _import_batch(batch)
+            batch = []
+
+            logger.info("* Imported {} settings ({:.0f} settings/second).".format(
+                num_imported, num_imported / max(time.time() - _start, 0.001)))
+
+    if batch:
+        num_imported += _import_batch(batch)
+
+    if f is not sys.stdin:
+        f.close()
+
+    logger.info("* Imported {} settings in {:.2f} seconds, {} duplicate or invalid lines ignored.".format(
+        num_imported, time.time() - _start, num_lines - num_imported))
+
+elif action == 'export':
+    try:
+        qr = conn.select('greylisting',
+                         what='account, sender, active',
+                         order='priority DESC, sender_priority DESC')
+
+        num = 0
+        with open(gl_file, 'w', encoding='utf-8') as f:
+            for r in qr:
+                if r.active:
+                    _status = 'enable'
+                else:
+                    _status = 'disable'
+
+                f.write("{} {} {}\n".format(r.sender, r.account, _status))
+                num += 1
+
+        logger.info("* Exported {} settings to {}.".format(num, gl_file))
+    except Exception as e:
+        logger.info(repr(e))
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+# Author: Zhang Huangbin <zhb@iredmail.org>
+# Purpose: Fill up column `greylisting_tracking.triplet_hash` of existing
+#          tracking records, required before setting
+#          `GREYLISTING_TRACKING_HASHED_KEY = True` in iRedAPD config file.
+#
+# Usage:
+#
+#   python3 greylisting_tracking_hash.py [--drop-triplet-index]
+#
+#   --drop-triplet-index
+#       Drop the unique index on columns (sender, recipient, client_address)
+#       after all records have hash, it's not used with hashed key and
+#       takes much more space than index on `triplet_hash`.
+#
+#       It refuses to drop the index unless
+#       `GREYLISTING_TRACKING_HASHED_KEY = True` and all records have hash.
+#       Please restart iRedAPD service after enabling the setting, so that
+#       no iRedAPD process still looks up records without hash.
+#
+#       WARNING: Don't drop it if you may set
+#       `GREYLISTING_TRACKING_HASHED_KEY = False` again later.
+
+import os
+import sys
+
+os.environ['LC_ALL'] = 'C'
+
+rootdir = os.path.abspath(os.path.dirname(__file__)) + '/../'
+sys.path.insert(0, rootdir)
+
+import web
+web.config.debug = False
+
+import settings
+from libs import utils
+from libs.greylisting import get_triplet_hash
+from tools import logger, get_db_conn
+
+# Number of records updated in one SQL transaction.
+BATCH_SIZE = 1000
+
+if '--drop-triplet-index' in sys.argv and not settings.GREYLISTING_TRACKING_HASHED_KEY:
+    logger.error("* Please set `GREYLISTING_TRACKING_HASHED_KEY = True` and "
+                 "restart iRedAPD service before dropping the index.")
+    sys.exit(255)
+
+conn = get_db_conn('iredapd')
+
+logger.info("* Generating hash of greylisting tracking records.")
+
+total = 0
+last_id = 0
+while True:
+    qr = conn.select('greylisting_tracking',
+                     vars={'last_id': last_id},
+                     what='id, sender, recipient, client_address',
+                     where='triplet_hash IS NULL AND id > $last_id',
+                     order='id',
+                     limit=BATCH_SIZE)
+    rows = list(qr)
+    if not rows:
+        break
+
+    with conn.transaction():
+        for r in rows:
+            _hash = get_triplet_hash(r.sender, r.recipient, r.client_address)
+            conn.query("UPDATE greylisting_tracking SET triplet_hash=%s WHERE id=%d" % (utils.sql_binary_literal(_hash), r.id))
+
+    total += len(rows)
+    last_id = rows[-1].id
+    logger.info("  - {} records updated.".format(total))
+
+qr = conn.select('greylisting_tracking',
+                 what='COUNT(id) AS total',
+                 where='triplet_hash IS NULL')
+left = qr[0].total
+
+if left:
+    logger.info("* {} records don't have hash (probably created during update), please run this script again.".format(left))
+    sys.exit(255)
+
+logger.info("* All tracking records have hash now.")
+
+if '--drop-triplet-index' in sys.argv:
+    logger.info("* Dropping unique index on (sender, recipient, client_address).")
+
+    if settings.backend == 'pgsql':
+        conn.query("DROP INDEX IF EXISTS idx_greylisting_tracking_key")
+    else:
+        # Name of the index created by `UNIQUE INDEX (sender, ...)` is
+        # `sender` (first column).
+        qr = conn.query("SHOW INDEX FROM greylisting_tracking WHERE Key_name='sender'")
+        if qr:
+            conn.query("ALTER TABLE greylisting_tracking DROP INDEX sender")
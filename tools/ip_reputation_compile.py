@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# Author: Zhang Huangbin <zhb@iredmail.org>
+# Purpose: Compile text IP feeds into binary file used by plugin
+#          `ip_reputation`.
+#
+# Usage:
+#
+#   python3 ip_reputation_compile.py <output_file> <feed_file> [<feed_file> ...]
+#
+#   Feed file is a text file with one IP address, network or range per
+#   line, empty lines and comments (starting with `#` or `;`) are ignored.
+#   Text after the first whitespace or `;` of each line is ignored too. For
+#   example:
+#
+#       # Comment
+#       192.0.2.1
+#       198.51.100.0/24 ; SBL12345
+#       203.0.113.10-203.0.113.20
+#       2001:db8::/32
+#
+#   Use `-` as feed file to read from stdin.
+#
+#   Output file is replaced atomically, iRedAPD reloads it automatically.
+#
+# Sample cron job (run daily):
+#
+#   1 3 * * * curl -s https://www.spamhaus.org/drop/drop.txt -o /tmp/drop.txt && python3 /opt/iredapd/tools/ip_reputation_compile.py /opt/iredapd/ip_reputation.bin /tmp/drop.txt
+
+import os
+import sys
+import time
+import ipaddress
+
+os.environ['LC_ALL'] = 'C'
+
+rootdir = os.path.abspath(os.path.dirname(__file__)) + '/../'
+sys.path.insert(0, rootdir)
+
+from tools import logger
+from libs import ipreputation
+
+
+def parse_line(line):
+    """Return (ip_version, start, end) of given line, or None if it's not
+    valid."""
+    line = line.split(';', 1)[0].split('#', 1)[0].strip()
+    if not line:
+        return None
+
+    v = line.split()[0]
+
+    try:
+        if '-' in v:
+            (start, end) = v.split('-', 1)
+            start = ipaddress.ip_address(start.strip())
+            end = ipaddress.ip_address(end.strip())
+
+            if start.version != end.version or start > end:
+                return None
+
+            return (start.version, int(start), int(end))
+
+        net = ipaddress.ip_network(v, strict=False)
+        return (net.version, int(net.network_address), int(net.broadcast_address))
+    except ValueError:
+        return None
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Usage: python3 {} <output_file> <feed_file> [<feed_file> ...]".format(sys.argv[0]))
+        sys.exit(255)
+
+    output_file = sys.argv[1]
+    feed_files = sys.argv[2:]
+
+    _start = time.time()
+
+    ranges = {4: [], 6: []}
+    num_invalid = 0
+
+    for feed in feed_files:
+        logger.info("* Reading {}".format(feed))
+
+        if feed == '-':
+            f = sys.stdin
+        else:
+            f = open(feed, encoding='utf-8', errors='ignore')
+
+        for line in f:
+            r = parse_line(line)
+            if r:
+                ranges[r[0]].append((r[1], r[2]))
+            elif line.strip() and line.lstrip()[0] not in '#;':
+                num_invalid += 1
+
+        if f is not sys.stdin:
+            f.close()
+
+    if num_invalid:
+        logger.info("* Ignored {} invalid lines.".format(num_invalid))
+
+    (num_v4, num_v6) = ipreputation.write_file(path=output_file,
+                                               ranges_v4=ranges[4],
+                                               ranges_v6=ranges[6])
+
+    logger.info("* Wrote {} IPv4 and {} IPv6 ranges to {} ({:.2f} seconds).".format(num_v4, num_v6, output_file, time.time() - _start))
+
+
+if __name__ == '__main__':
+    main()
@@ -66,8 +66,10 @@ sys.path.insert(0, rootdir)
 import web
 web.config.debug = False
 
-from tools import logger, get_db_conn
-from libs import utils, dnsspf
+from tools import logger
+from libs import utils
+from libs import greylisting as lib_gl
+import settings
 
 if '--debug' in sys.argv:
     logger.setLevel(logging.DEBUG)
@@ -82,118 +84,46 @@ if '--submit' in sys.argv:
     sys.argv.remove('--submit')
 
 
-conn = get_db_conn('iredapd')
+engine = utils.create_db_engine('iredapd')
+if not engine:
+    sys.exit("Error: Failed to connect to iredapd database.")
+
+# Update whitelists of all domains, remove whitelists of domains which are
+# not listed in `greylisting_whitelist_domains` anymore.
+refresh_all = False
 
 if len(sys.argv) == 1:
     logger.info('* Query SQL server to get mail domain names.')
-
-    domains = []
-
-    qr = conn.select('greylisting_whitelist_domains', what='domain')
-    for r in qr:
-        domains.append(r.domain)
+    domains = lib_gl.get_whitelist_domains(engine)
+    refresh_all = True
 else:
     domains = sys.argv[1:]
 
-domains = [str(d).lower() for d in domains if utils.is_domain(d)]
+domains = sorted({str(d).lower() for d in domains if utils.is_domain(d)})
 if not domains:
     logger.info('* No valid domain names. Abort.')
     sys.exit()
 
 logger.info("* {} mail domains in total.".format(len(domains)))
 
-all_ips = set()
-domain_ips = {}
-queried_domains = set()
-returned_ips = set()
+# Query DNS records concurrently.
+resolved = lib_gl.resolve_whitelist_domains(domains, max_workers=settings.GREYLISTING_SPF_REFRESH_WORKERS)
 
 for domain in domains:
-    if 'spf:' + domain in queried_domains:
-        continue
-
-    logger.info("\t+ [{}]".format(domain))
-
-    # Query SPF record
-    qr = dnsspf.query_spf(domain, queried_domains=queried_domains)
-    spf = qr['spf']
-    queried_domains = qr['queried_domains']
-
-    if spf:
-        logger.debug("\t\t+ SPF -> {}".format(spf))
+    (ips, ttl) = resolved[domain]
+    logger.debug("\t+ [{}] {}".format(domain, ', '.join(sorted(ips))))
 
-        # Parse returned SPF record
-        qr = dnsspf.parse_spf(domain, spf, queried_domains=queried_domains, returned_ips=returned_ips)
-    else:
-        # Whitelist hosts listed in MX records.
-        qr = dnsspf.query_mx([domain], queried_domains=queried_domains, returned_ips=returned_ips)
-
-    ips = qr['ips']
-    queried_domains = qr['queried_domains']
-    returned_ips = qr['returned_ips']
-
-    domain_ips[domain] = ips
-    all_ips.update(ips)
-
-    logger.debug("\t\t+ Result: {}".format(ips))
-
-if not all_ips:
-    logger.info('* No IP address/network found. Exit.')
-    sys.exit()
+# Import IP addresses/networks as greylisting whitelists, only new and
+# removed ones are updated.
+(num_added, num_removed) = lib_gl.update_spf_whitelists(engine_iredapd=engine,
+                                                        resolved=resolved,
+                                                        remove_other_domains=refresh_all)
 
-# Import IP addresses/networks as greylisting whitelists.
-for domain in domain_ips:
-    comment = 'AUTO-UPDATE: %s' % domain
-    sql_vars = {'domain': domain,
-                'account': '@.',
-                'comment': comment}
-
-    # Delete old records
-    try:
-        conn.delete('greylisting_whitelist_domain_spf',
-                    vars=sql_vars,
-                    where="comment=$comment")
-
-        # in iRedAPD-2.0 and earlier releases, results were stored in
-        # sql table `greylisting_whitelists`
-        conn.delete('greylisting_whitelists',
-                    vars=sql_vars,
-                    where="comment=$comment")
-    except Exception as e:
-        logger.info("* <<< ERROR >>> Cannot delete old record for domain {}: {}".format(domain, repr(e)))
-
-    # Insert new records
-    for ip in domain_ips[domain]:
-        try:
-            # Check whether we already have this sender. used to avoid annoying
-            # warning message in PostgreSQL log file due to duplicate key.
-            qr = conn.select('greylisting_whitelist_domain_spf',
-                             vars={'account': '@.', 'sender': ip},
-                             what='id',
-                             where='account=$account AND sender=$sender',
-                             limit=1)
-
-            if not qr:
-                # Insert new whitelist
-                conn.insert('greylisting_whitelist_domain_spf',
-                            account='@.',
-                            sender=ip,
-                            comment=comment)
-
-                # Clean up `greylisting_tracking` table
-                conn.delete('greylisting_tracking',
-                            vars={'ip': ip},
-                            where='client_address=$ip')
-
-        except Exception as e:
-            if e.__class__.__name__ == 'IntegrityError':
-                pass
-            else:
-                logger.error("* <<< ERROR >>> Cannot insert new record for domain {}: {}".format(domain, repr(e)))
+logger.info("* Greylisting whitelists: {} added, {} removed.".format(num_added, num_removed))
 
 if submit_to_sql_db:
     logger.info('* Store domain names in SQL database as greylisting whitelists.')
     for d in domains:
-        try:
-            conn.insert('greylisting_whitelist_domains', domain=d)
-        except Exception as e:
-            logger.error("<<< ERROR >>> {}".format(repr(e)))
+        qr = lib_gl.add_whitelist_domain(engine_iredapd=engine, domain=d)
+        if not qr[0]:
+            logger.error("<<< ERROR >>> {}".format(qr[1]))
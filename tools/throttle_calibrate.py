@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# Author: Zhang Huangbin <zhb@iredmail.org>
+# Purpose: Suggest throttle settings (`max_msgs` of given periods) based on
+#          historical smtp sessions stored in SQL table
+#          `iredapd.smtp_sessions`.
+#
+# Notes:
+#
+#   *) Requires `LOG_SMTP_SESSIONS = True` in iRedAPD config file, and
+#      Python module `numpy`.
+#   *) Only accepted messages are analyzed (`smtp_sessions.action` is
+#      `DUNNO` or `OK`, e.g. whitelisted senders). `OK` returned at RCPT
+#      state is logged once per recipient and the message is logged again
+#      at END-OF-MESSAGE state, so records are grouped by Postfix attribute
+#      `instance` (`smtp_sessions.instance`) to count each message once.
+#      Note: `OK` is not logged if `LOG_SMTP_SESSIONS_BYPASS_WHITELIST = True`.
+#   *) `smtp_sessions` doesn't store recipient count, every message is
+#      counted as one, but throttle plugin increases `max_msgs` tracking by
+#      the number of recipients. Please consider it while using suggested
+#      values.
+#   *) Messages are counted in fixed time windows (`time // period`), it's
+#      close to but not exactly same as throttle tracking which starts a new
+#      period with the first message after previous period expired.
+
+import os
+import sys
+import math
+import time
+
+os.environ['LC_ALL'] = 'C'
+
+rootdir = os.path.abspath(os.path.dirname(__file__)) + '/../'
+sys.path.insert(0, rootdir)
+
+try:
+    import numpy as np
+except ImportError:
+    sys.exit("Error: Python module 'numpy' is required by this script, please install it first.")
+
+from sqlalchemy import text
+
+import web
+from web import sqlquote
+from tools import logger
+from libs import utils
+
+web.config.debug = False
+
+USAGE = """Usage:
+
+    --outbound
+        Analyze messages sent by authenticated users (throttle kind
+        'outbound'), identified by SMTP AUTH username. This is the default.
+
+    --external
+        Analyze messages sent by unauthenticated senders (throttle kind
+        'external'), identified by sender address.
+
+    --domain
+        Analyze messages per sender domain instead of per sender address.
+
+    --days <number>
+        Analyze smtp sessions of last given days. Defaults to all.
+
+    --periods <seconds>[,<seconds>,...]
+        Candidate throttle periods, in seconds. Defaults to:
+        60,300,3600,86400
+
+    --percentile <number>
+        Suggest `max_msgs` which is not exceeded by given percentage of
+        senders (or domains). Defaults to 99.
+
+    --headroom <number>
+        Multiply the percentile by given number. Defaults to 1.2.
+
+    --top <number>
+        Show given number of senders (or domains) which would be rejected
+        most with suggested settings. Defaults to 10.
+
+    --sql-per-account
+        Also print SQL statements to set per-account `max_msgs` for senders
+        (or domains) listed with `--top`, so that they're not rejected.
+
+Sample usage:
+
+    python3 throttle_calibrate.py --outbound --days 30 --periods 300,3600
+"""
+
+# Number of rows fetched from SQL server each time.
+CHUNK_SIZE = 100000
+
+
+def get_arg_value(args, name, default=None):
+    if name in args:
+        idx = args.index(name)
+        if idx + 1 < len(args):
+            return args[idx + 1]
+
+        print("Missing value of argument: {}".format(name))
+        print(USAGE)
+        sys.exit()
+
+    return default
+
+
+def load_sessions(engine, kind='outbound', since=0):
+    """Stream accepted messages from `smtp_sessions` with server side cursor.
+
+    Returns a tuple of (times, sender_ids, senders):
+
+        - times: numpy array of epoch seconds.
+        - sender_ids: numpy array of index in `senders`.
+        - senders: list of sender (or SMTP AUTH username) addresses.
+    """
+    if kind == 'outbound':
+        sql = """SELECT MIN(time_num), sasl_username
+                   FROM smtp_sessions
+                  WHERE action IN ('DUNNO', 'OK') AND sasl_username <> '' AND time_num >= %d
+               GROUP BY instance, sasl_username""" % since
+    else:
+        sql = """SELECT MIN(time_num), sender
+                   FROM smtp_sessions
+                  WHERE action IN ('DUNNO', 'OK') AND sasl_username = '' AND sender <> '' AND time_num >= %d
+               GROUP BY instance, sender""" % since
+
+    # {<sender>: <index>}
+    sender_index = {}
+    times = []
+    sender_ids = []
+
+    total = 0
+    with engine.connect() as conn:
+        qr = conn.execution_options(stream_results=True).execute(text(sql))
+
+        while True:
+            rows = qr.fetchmany(CHUNK_SIZE)
+            if not rows:
+                break
+
+            times.append(np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows)))
+            sender_ids.append(np.fromiter((sender_index.setdefault(r[1].lower(), len(sender_index)) for r in rows),
+                                          dtype=np.int64,
+                                          count=len(rows)))
+
+            total += len(rows)
+            logger.info("* Loaded {} smtp sessions.".format(total))
+
+    if not times:
+        return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), [])
+
+    senders = [None] * len(sender_index)
+    for (k, v) in sender_index.items():
+        senders[v] = k
+
+    return (np.concatenate(times), np.concatenate(sender_ids), senders)
+
+
+def group_by_domain(sender_ids, senders):
+    """Convert sender ids to domain ids, returns (domain_ids, domains)."""
+    domain_index = {}
+    mapping = np.fromiter((domain_index.setdefault(s.split('@', 1)[-1], len(domain_index)) for s in senders),
+                          dtype=np.int64,
+                          count=len(senders))
+
+    domains = [None] * len(domain_index)
+    for (k, v) in domain_index.items():
+        domains[v] = k
+
+    return (mapping[sender_ids], domains)
+
+
+def count_windows(times, keys, period):
+    """Count messages of each account in each time window.
+
+    Returns a tuple of (counts, starts, accounts):
+
+        - counts: number of messages of each (account, window), grouped by
+          account.
+        - starts: index of first window of each account in `counts`.
+        - accounts: account id of each group.
+    """
+    buckets = times // period
+    buckets -= buckets.min()
+    num_buckets = int(buckets.max()) + 1
+
+    combined = keys * num_buckets + buckets
+    (windows, counts) = np.unique(combined, return_counts=True)
+
+    window_keys = windows // num_buckets
+    starts = np.flatnonzero(np.r_[True, window_keys[1:] != window_keys[:-1]])
+
+    return (counts, starts, window_keys[starts])
+
+
+def analyze_period(times, keys, period, percentile, headroom):
+    (counts, starts, accounts) = count_windows(times, keys, period)
+
+    # Busiest window of each account.
+    peaks = np.maximum.reduceat(counts, starts)
+
+    pcts = np.percentile(peaks, [50, 90, 99, 99.9, 100])
+    max_msgs = max(1, int(math.ceil(np.percentile(peaks, percentile) * headroom)))
+
+    # Simulate: messages exceeding `max_msgs` in each window are rejected.
+    over = np.clip(counts - max_msgs, 0, None)
+    rejected = np.add.reduceat(over, starts)
+
+    return {
+        'period': period,
+        'percentiles': pcts,
+        'max_msgs': max_msgs,
+        'rejected_msgs': int(over.sum()),
+        'rejected_accounts': int(np.count_nonzero(rejected)),
+        'accounts': accounts,
+        'peaks': peaks,
+        'rejected': rejected,
+    }
+
+
+def main():
+    args = [v for v in sys.argv[1:]]
+
+    if '--help' in args or '-h' in args:
+        print(USAGE)
+        sys.exit()
+
+    kind = 'outbound'
+    if '--external' in args:
+        kind = 'external'
+
+    per_domain = ('--domain' in args)
+
+    try:
+        days = int(get_arg_value(args, '--days', 0))
+        periods = [int(i) for i in get_arg_value(args, '--periods', '60,300,3600,86400').split(',') if i]
+        percentile = float(get_arg_value(args, '--percentile', 99))
+        headroom = float(get_arg_value(args, '--headroom', 1.2))
+        top = int(get_arg_value(args, '--top', 10))
+    except ValueError:
+        print("Invalid argument value.")
+        print(USAGE)
+        sys.exit()
+
+    if not periods or min(periods) <= 0 or not (0 < percentile <= 100):
+        print("Invalid argument value.")
+        print(USAGE)
+        sys.exit()
+
+    since = 0
+    if days:
+        since = int(time.time()) - days * 86400
+
+    engine = utils.create_db_engine('iredapd')
+    if not engine:
+        sys.exit("Error: Failed to connect to iredapd database.")
+
+    _start = time.time()
+    (times, keys, accounts) = load_sessions(engine=engine, kind=kind, since=since)
+
+    if not len(times):
+        logger.info("No smtp sessions found, please make sure `LOG_SMTP_SESSIONS = True` in iRedAPD config file.")
+        sys.exit()
+
+    if per_domain:
+        (keys, accounts) = group_by_domain(sender_ids=keys, senders=accounts)
+        accounts = ['@' + d for d in accounts]
+
+    logger.info("* Analyzing {} messages of {} {}, {:.2f} seconds used to load data.".format(
+        len(times),
+        len(accounts),
+        'domains' if per_domain else 'senders',
+        time.time() - _start))
+
+    results = []
+    for period in periods:
+        r = analyze_period(times=times,
+                           keys=keys,
+                           period=period,
+                           percentile=percentile,
+                           headroom=headroom)
+        results.append(r)
+
+        (p50, p90, p99, p999, pmax) = r['percentiles']
+
+        logger.info("")
+        logger.info("* Period: {} seconds".format(period))
+        logger.info("  - Max messages in one period (percentiles of all accounts): "
+                    "p50={:.0f}, p90={:.0f}, p99={:.0f}, p99.9={:.0f}, max={:.0f}".format(p50, p90, p99, p999, pmax))
+        logger.info("  - Suggested max_msgs: {} (p{} x {})".format(r['max_msgs'], percentile, headroom))
+        logger.info("  - Would reject {} messages ({:.4f}%) of {} accounts.".format(
+            r['rejected_msgs'],
+            r['rejected_msgs'] * 100.0 / len(times),
+            r['rejected_accounts']))
+
+        if top and r['rejected_accounts']:
+            logger.info("  - Top accounts would be rejected:")
+
+            idx = np.argsort(r['rejected'])[::-1][:top]
+            for i in idx:
+                if not r['rejected'][i]:
+                    break
+
+                logger.info("    {}: {} rejected, max {} messages in one period.".format(
+                    accounts[r['accounts'][i]],
+                    r['rejected'][i],
+                    r['peaks'][i]))
+
+    # Print SQL statements.
+    print("")
+    print("-- Suggested throttle settings (kind: {}).".format(kind))
+    print("-- Note: only one setting of same account and kind is used, please pick")
+    print("--       one of them, and remove or update existing setting first.")
+    for r in results:
+        print("INSERT INTO throttle (account, kind, priority, period, max_msgs, max_quota, msg_size, max_rcpts) "
+              "VALUES ('@.', %s, %d, %d, %d, -1, -1, -1);" % (sqlquote(kind),
+                                                             utils.get_account_priority('@.'),
+                                                             r['period'],
+                                                             r['max_msgs']))
+
+    if '--sql-per-account' in args and top:
+        print("")
+        print("-- Per-account settings for accounts which would be rejected.")
+        for r in results:
+            idx = np.argsort(r['rejected'])[::-1][:top]
+            for i in idx:
+                if not r['rejected'][i]:
+                    break
+
+                _account = accounts[r['accounts'][i]]
+                _max_msgs = int(math.ceil(r['peaks'][i] * headroom))
+                print("INSERT INTO throttle (account, kind, priority, period, max_msgs, max_quota, msg_size, max_rcpts) "
+                      "VALUES (%s, %s, %d, %d, %d, -1, -1, -1);" % (sqlquote(_account),
+                                                                   sqlquote(kind),
+                                                                   utils.get_account_priority(_account),
+                                                                   r['period'],
+                                                                   _max_msgs))
+
+
+if __name__ == '__main__':
+    main()
@@ -765,6 +765,29 @@ EOF
     # iRedAPD-5.0: new column `throttle.max_rcpts`
     update_sql_based_on_missing_column throttle max_rcpts 5.0-max_rcpts.mysql
 
+    # iRedAPD-6.2: new column `throttle_tracking.expire_at`
+    update_sql_based_on_missing_column throttle_tracking expire_at 6.2-throttle_tracking_expire_at.mysql
+
+    # iRedAPD-6.2: new table `greylisting_passed_clients` (created with
+    # iredapd.mysql above), migrate passed clients from `greylisting_tracking`.
+    echo "${existing_sql_tables}" | grep '\<greylisting_passed_clients\>' &>/dev/null
+    if [ X"$?" != X'0' ]; then
+        ${mysql_conn} < ${ROOTDIR}/../SQL/update/6.2-greylisting_passed_clients.mysql
+    fi
+
+    # iRedAPD-6.2: INDEX on `greylisting_tracking`: (record_expired)
+    (${mysql_conn} <<EOF
+SHOW INDEX FROM greylisting_tracking \G
+EOF
+) | grep 'Key_name: record_expired$' &>/dev/null
+
+    if [ X"$?" != X'0' ]; then
+        ${mysql_conn} -e "CREATE INDEX record_expired ON greylisting_tracking (record_expired);"
+    fi
+
+    # iRedAPD-6.2: new column `greylisting_tracking.triplet_hash`
+    update_sql_based_on_missing_column greylisting_tracking triplet_hash 6.2-greylisting_tracking_triplet_hash.mysql
+
 elif egrep '^backend.*pgsql' ${IREDAPD_CONF_PY} &>/dev/null; then
     export PGPASSWORD="${iredapd_db_password}"
 
@@ -796,6 +819,22 @@ elif egrep '^backend.*pgsql' ${IREDAPD_CONF_PY} &>/dev/null; then
 
     # v5.0: new column: `throttle.max_rcpts`.
     update_sql_based_on_missing_column throttle max_rcpts 5.0-max_rcpts.pgsql
+
+    # v6.2: new column: `throttle_tracking.expire_at`.
+    update_sql_based_on_missing_column throttle_tracking expire_at 6.2-throttle_tracking_expire_at.pgsql
+
+    # v6.2: new table: `greylisting_passed_clients`.
+    add_new_pgsql_tables 6.2-greylisting_passed_clients.pgsql "SELECT client_address FROM greylisting_passed_clients LIMIT 1"
+
+    # v6.2: INDEX on `greylisting_tracking`: (record_expired)
+    ${psql_conn} -c "SELECT indexname FROM pg_indexes WHERE indexname='idx_greylisting_tracking_record_expired'" | grep 'idx_greylisting_tracking_record_expired' &>/dev/null
+
+    if [ X"$?" != X'0' ]; then
+        ${psql_conn} -c "CREATE INDEX idx_greylisting_tracking_record_expired ON greylisting_tracking (record_expired);"
+    fi
+
+    # v6.2: new column: `greylisting_tracking.triplet_hash`.
+    update_sql_based_on_missing_column greylisting_tracking triplet_hash 6.2-greylisting_tracking_triplet_hash.pgsql
 fi
 
 #
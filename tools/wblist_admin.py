@@ -4,6 +4,7 @@
 
 import os
 import sys
+import time
 
 os.environ['LC_ALL'] = 'C'
 
@@ -46,6 +47,18 @@ USAGE = """Usage:
         Show existing white/blacklists for specified (local) account. If no
         account specified, defaults to manage server-wide white/blacklists.
 
+    --import <file>
+        Import white/blacklists from given file for specified (local)
+        account. File contains one address per line, empty lines and lines
+        start with '#' are ignored. Use '-' to read from stdin.
+
+        Addresses are imported in batches, existing whitelist or blacklist of
+        same address is replaced.
+
+    --export <file>
+        Export white/blacklists of specified (local) account to given file,
+        one address per line.
+
     --whitelist sender1 [sender2 sender3 ...]
         Whitelist specified sender(s). Multiple senders must be separated by a space.
 
@@ -70,8 +83,16 @@ Sample usage:
         python3 wblist_admin.py --account user@mydomain.com --add --blacklist 172.16.1.10 baduser@example.com
         python3 wblist_admin.py --account user@mydomain.com --list --whitelist
         python3 wblist_admin.py --account user@mydomain.com --list --blacklist
+
+    * Import and export server-wide blacklists:
+
+        python3 wblist_admin.py --import /path/to/blacklist.txt --blacklist
+        python3 wblist_admin.py --export /path/to/blacklist.txt --blacklist
 """
 
+# Number of addresses imported with one SQL statement.
+IMPORT_BATCH_SIZE = 1000
+
 if len(sys.argv) == 1:
     print(USAGE)
     sys.exit()
@@ -124,7 +145,23 @@ else:
     sys.exit('No --whitelist or --blacklist specified. Exit.')
 
 # Get action.
-if '--add' in args:
+if '--import' in args or '--export' in args:
+    if '--import' in args:
+        action = 'import'
+    else:
+        action = 'export'
+
+    index = args.index('--' + action)
+    if index + 1 >= len(args):
+        sys.exit('<<< ERROR >>> No file specified for --{}.'.format(action))
+
+    wb_file = args[index + 1]
+
+    # Remove them.
+    args.pop(index)
+    args.pop(index)
+    logger.info("* {} {} {} for account: {}".format(action.title(), inout_type, wblist_type, account))
+elif '--add' in args:
     action = 'add'
     args.remove('--add')
     logger.info("* Add {} {} for account: {}".format(inout_type, wblist_type, account))
@@ -141,7 +178,7 @@ elif '--list' in args:
     args.remove('--list')
     logger.info("* List all {} {} for account: {}".format(inout_type, wblist_type, account))
 else:
-    sys.exit('No --add, --delete or --list specified. Exit.')
+    sys.exit('No --add, --delete, --list, --import or --export specified. Exit.')
 
 # Get specified white/blacklists
 wl = []
@@ -179,6 +216,89 @@ if action == 'add':
     except Exception as e:
         logger.info(repr(e))
 
+elif action == 'import':
+    qr = wblist.get_user_record(engine_amavisd=engine_amavisd, account=wb_account)
+    if not qr[0]:
+        sys.exit('<<< ERROR >>> {}'.format(qr[1]))
+
+    user_id = qr[1]['id']
+
+    if for_whitelist:
+        wb = 'W'
+    else:
+        wb = 'B'
+
+    if wb_file == '-':
+        f = sys.stdin
+    else:
+        f = open(wb_file, encoding='utf-8', errors='ignore')
+
+    _start = time.time()
+    num_imported = 0
+    num_lines = 0
+    batch = []
+
+    def _import_batch(batch):
+        qr = wblist.import_wblist(engine_amavisd=engine_amavisd,
+                                  user_id=user_id,
+                                  addresses=batch,
+                                  wb=wb,
+                                  outbound=(inout_type == 'outbound'))
+        if not qr[0]:
+            sys.exit('<<< ERROR >>> {}'.format(qr[1]))
+
+        return qr[1]
+
+    for line in f:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+
+        num_lines += 1
+        batch.append(line)
+
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            num_imported += _import_batch(batch)
+            batch = []
+
+            logger.info("* Imported {} addresses ({:.0f} addresses/second).".format(
+                num_imported, num_imported / max(time.time() - _start, 0.001)))
+
+    if batch:
+        num_imported += _import_batch(batch)
+
+    if f is not sys.stdin:
+        f.close()
+
+    logger.info("* Imported {} addresses in {:.2f} seconds, {} duplicate or invalid addresses ignored.".format(
+        num_imported, time.time() - _start, num_lines - num_imported))
+
+elif action == 'export':
+    if inout_type == 'inbound':
+        qr = wblist.get_account_wblist(engine_amavisd=engine_amavisd,
+                                       account=wb_account,
+                                       whitelist=for_whitelist,
+                                       blacklist=for_blacklist)
+    else:
+        qr = wblist.get_account_outbound_wblist(engine_amavisd=engine_amavisd,
+                                                account=wb_account,
+                                                whitelist=for_whitelist,
+                                                blacklist=for_blacklist)
+
+    if not qr[0]:
+        sys.exit('<<< ERROR >>> {}'.format(qr[1]))
+
+    if for_whitelist:
+        _wb = qr[1]['whitelist']
+    else:
+        _wb = qr[1]['blacklist']
+
+    with open(wb_file, 'w', encoding='utf-8') as f:
+        for i in sorted(_wb):
+            f.write(i + '\n')
+
+    logger.info("* Exported {} addresses to {}.".format(len(_wb), wb_file))
+
 elif action == 'delete':
     try:
         if inout_type == 'inbound':